@@ -19,70 +19,84 @@ testing, and handling missing values and making transformations of variables as
 needed. EDA encompasses IDA.
 """
 
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import matplotlib.style as style
-from functions import add_fignum
+from functions import summary_box_plot, corr_heatmap
+from plot_data import box_stats, cached_summary, scatter_source
+from plot_jobs import plot_job, render_jobs
+from storage import load_cleaned
+from cache import cached_stage
+from outliers import outlier_mask, keep_rows, masked, save_mask
+from cleaning import ID_COL
+from correlation import (
+        corr_stats,
+        corr_matrix,
+        top_k_correlated,
+        save_corr_stats
+)
+from instrument import stage
 
-# Read all the cleaned data files.
-cleaned_train = pd.read_csv("Cleaned_train.csv")
-cleaned_test = pd.read_csv("Cleaned_test.csv")
+# Read all the cleaned data files. The columnar files written by
+# data_cleaning.py are memory-mapped; the CSV export is the fallback.
+with stage('load_cleaned') as s:
+    cleaned_train = load_cleaned("Cleaned_train")
+    cleaned_test = load_cleaned("Cleaned_test")
+    s['rows_out'] = len(cleaned_train) + len(cleaned_test)
 
 # Keep numerical features
 num_features = cleaned_train.select_dtypes(include = np.number)
-correl = num_features.corr()
+# Sufficient statistics of the numerical features. They are stored so that new
+# sales can be added with correlation.update_corr_stats() without a rescan,
+# and reused from the stage cache when the data is unchanged.
+with stage('corr_stats', rows_in=num_features):
+    stats = cached_stage("corr_stats", lambda: corr_stats(num_features),
+                         inputs=[num_features], depends=[corr_stats])
+    save_corr_stats(stats, "corr_stats.npz")
+
+# Every figure is a self-contained plot job with its own style, rendered in
+# parallel at the end of the script
+jobs = []
+title_kw = dict(loc='left', fontdict=dict(fontsize = 18))
+label_kw = dict(fontsize = 15, weight = 'bold')
 
 # SalePrice correlation matrix
 k = 11
-plt.figure(figsize = (10,10))
-sns.set_style(style = 'white')
-figtext_args, figtext_kwargs = add_fignum(
-        "Fig 8. Correlation Matrix Heatmap of Sale Price")
-cols = correl.nlargest(k,'SalePrice')['SalePrice'].index
-cm = np.corrcoef(cleaned_train[cols].values.T)
-sns.set(font_scale = 1.25)
-plt.title(
-        "Correlation Heatmap of Sale Price with 10 most related variable\n", 
-        weight = 'bold')
-mask = np.triu(np.ones_like(cm, dtype=np.bool))
-cmap = sns.diverging_palette(220, 10, as_cmap=True)
-hm = sns.heatmap(cm, mask=mask, cmap=cmap, cbar=True, annot=True, square=True,
-                 fmt='.2f', annot_kws={'size':10}, yticklabels=cols.values, 
-                 xticklabels=cols.values)
-plt.figtext(*figtext_args, **figtext_kwargs)
+cols = top_k_correlated(stats, 'SalePrice', k).index
+cm = corr_matrix(stats, cols)
+jobs.append(plot_job(
+        corr_heatmap, "correlation_11.png", cm, sns_style='darkgrid',
+        font_scale=1.25,
+        title="Correlation Heatmap of Sale Price with 10 most related variable\n",
+        title_kw=dict(weight = 'bold'),
+        caption="Fig 8. Correlation Matrix Heatmap of Sale Price"))
 
 """
 #Impact of Overall Quality on SalePrice
 In normal marketting terms, better quality products generally costs more, which 
 is exactly the thing we are expecting in case of house 
 """
-plt.figure(figsize=(12,7))
-figtext_args, figtext_kwargs = add_fignum(
-        "Fig 9. Impact of Overall Quality on Sale Price") 
-style.use('fivethirtyeight')
-sns.boxplot(x='OverallQual', y='SalePrice', data=cleaned_train)
-plt.title("Impact of Overall Quality on Sale Price")
-plt.figtext(*figtext_args, **figtext_kwargs)
+jobs.append(plot_job(
+        summary_box_plot, "Overall_Quality.png",
+        cached_summary(box_stats, cleaned_train[['OverallQual', 'SalePrice']],
+                       x='OverallQual'),
+        style='fivethirtyeight',
+        x='OverallQual', title="Impact of Overall Quality on Sale Price",
+        caption="Fig 9. Impact of Overall Quality on Sale Price"))
 
 """
 As Expected, as the overall quality improves, the sale price of the houses in Ames, 
 Iowa increases which is expected
 """
 
-# Sale Price vs Ground Living Area
-plt.figure(figsize=(12,7))
-figtext_args, figtext_kwargs = add_fignum(
-        "Fig 10. Sale Price by Above ground Living Area") 
-sns.regplot(x='GrLivArea', 
-            y = 'SalePrice', 
-            color = 'brown',
-            data = cleaned_train)
-plt.title("House Prices in Ames, Iowa", 
-          loc='left', fontdict=dict(fontsize = 18))
-plt.xlabel("Above Ground Living Area", fontsize = 12)
-plt.figtext(*figtext_args, **figtext_kwargs)
+# Sale Price vs Ground Living Area. Scatter plots of large inputs are drawn
+# as density grids (see plot_data.py).
+plot, data = scatter_source(cleaned_train[['GrLivArea', 'SalePrice']],
+                            'GrLivArea', fit=True)
+jobs.append(plot_job(
+        plot, "GrLivArea.png", data,
+        style='fivethirtyeight', x='GrLivArea', color='brown',
+        title="House Prices in Ames, Iowa", title_kw=title_kw,
+        xlabel="Above Ground Living Area", label_kw=dict(fontsize = 12),
+        caption="Fig 10. Sale Price by Above ground Living Area"))
 
 """
 There seems to be a linear relationship between Sale Price and Above ground 
@@ -92,36 +106,40 @@ the bottom right of plot are clearly outliers as it seems highly impossible for
 the house of size with greater than 4000 sq ft. have such low price, so it is 
 safe to remove these two entries from the dataset
 """
-# Delete outliers
-cleaned_train = cleaned_train.drop(
-        cleaned_train[(cleaned_train['GrLivArea'] > 4000) & 
-                    (cleaned_train['SalePrice'] < 300000)].index)
+# Flag the outliers of every rule in one pass and store the mask next to the
+# cleaned data. The plots below take only the rows and columns they need.
+with stage('outlier_mask', rows_in=cleaned_train) as s:
+    bits, hits = outlier_mask(cleaned_train)
+    print("Rows flagged by each outlier rule:\n%s" % hits.to_string())
+    save_mask(bits, "Cleaned_train.outliers.npz",
+              ids=cleaned_train[ID_COL].to_numpy())
+    # Delete outliers
+    keep = keep_rows(bits, names=['large_cheap_house'])
+    s['rows_out'] = int(keep.sum())
 
-plt.figure(figsize=(12,7))
-figtext_args, figtext_kwargs = add_fignum(
-        "Fig 11. Sale Price by Above ground Living Area (without outlier)") 
-sns.regplot(x='GrLivArea', 
-            y = 'SalePrice', 
-            color = 'brown',
-            data = cleaned_train)
-plt.title("House Prices in Ames, Iowa", 
-          loc='left', fontdict=dict(fontsize = 18))
-plt.xlabel("Above Ground Living Area", fontsize = 12)
-plt.figtext(*figtext_args, **figtext_kwargs)
+plot, data = scatter_source(
+        masked(cleaned_train, keep, ['GrLivArea', 'SalePrice']),
+        'GrLivArea', fit=True)
+jobs.append(plot_job(
+        plot, "GrLivArea_wo_Outlier.png", data, style='fivethirtyeight',
+        x='GrLivArea', color='brown',
+        title="House Prices in Ames, Iowa", title_kw=title_kw,
+        xlabel="Above Ground Living Area", label_kw=dict(fontsize = 12),
+        caption="Fig 11. Sale Price by Above ground Living Area (without outlier)"))
 
 # Plot the Sale Price vs overall condition
-plt.figure(figsize = (10,7))
-style.use('fivethirtyeight')
-figtext_args, figtext_kwargs = add_fignum(
-        "Fig 12. Sale Price vs Overall Condition")
-sns.boxplot(x="OverallCond",
-            y="SalePrice",
-            palette = "colorblind",
-            data = cleaned_train)
-plt.title("House Price in Ames, Iowa",
-          loc= 'left', fontdict = dict(fontsize=18))
-plt.xlabel("Overall Material and Finish of the house", fontsize = 12)
-plt.figtext(*figtext_args, **figtext_kwargs)
+jobs.append(plot_job(
+        summary_box_plot, "Overall_Condition.png",
+        cached_summary(
+                box_stats,
+                masked(cleaned_train, keep, ['OverallCond', 'SalePrice']),
+                x='OverallCond'),
+        style='fivethirtyeight',
+        x='OverallCond', figsize=(10,7), palette="colorblind",
+        title="House Price in Ames, Iowa", title_kw=title_kw,
+        xlabel="Overall Material and Finish of the house",
+        label_kw=dict(fontsize = 12),
+        caption="Fig 12. Sale Price vs Overall Condition"))
 
 """
 The price of the house increases as the overall condition of the house 
@@ -131,138 +149,124 @@ of the house.
 """
 
 # Sale Price by Neighborhood
-plt.figure(figsize = (12,7))
-style.use("bmh")
-figtext_args, figtext_kwargs = add_fignum(
-        "Fig 13. Sale Price by Neighborhood")
-sns.boxplot(x="Neighborhood",
-            y="SalePrice",
-            palette = "colorblind",
-            data = cleaned_train)
-plt.title("House Prices in Ames, Iowa",
-          loc = "left", fontdict=dict(fontsize=18))
-plt.xticks(rotation = 45)
-plt.figtext(*figtext_args, **figtext_kwargs)
+jobs.append(plot_job(
+        summary_box_plot, "Neighborhood.png",
+        cached_summary(
+                box_stats,
+                masked(cleaned_train, keep, ['Neighborhood', 'SalePrice']),
+                x='Neighborhood'),
+        style='bmh',
+        x='Neighborhood', palette="colorblind",
+        title="House Prices in Ames, Iowa", title_kw=title_kw, rotation=45,
+        caption="Fig 13. Sale Price by Neighborhood"))
 
 # Sale Price by bedroom size
-plt.figure(figsize=(7,7))
-sns.set_style(style='whitegrid')
-figtext_args, figtext_kwargs = add_fignum(
-        "Fig 14. Sale Price by Number of Bedrooms") 
-sns.boxplot(x='BedroomAbvGr', 
-            y = 'SalePrice', 
-            palette='colorblind',
-            data = cleaned_train)
-plt.title("House Prices in Ames, Iowa", 
-          loc='left', fontdict=dict(fontsize = 18))
-plt.xticks(rotation = 45)
-plt.figtext(*figtext_args, **figtext_kwargs)
+jobs.append(plot_job(
+        summary_box_plot, "Bedroom.png",
+        cached_summary(
+                box_stats,
+                masked(cleaned_train, keep, ['BedroomAbvGr', 'SalePrice']),
+                x='BedroomAbvGr'),
+        style='bmh', sns_style='whitegrid', x='BedroomAbvGr', figsize=(7,7),
+        palette='colorblind',
+        title="House Prices in Ames, Iowa", title_kw=title_kw, rotation=45,
+        caption="Fig 14. Sale Price by Number of Bedrooms"))
 
 # Sale Price by Sale Zoning classification
-plt.figure(figsize=(7,7))
-sns.set_style(style="dark")
-figtext_args, figtext_kwargs = add_fignum("Fig 15. Sale Price by Sale Zoning classification") 
-sns.boxplot(x='MSZoning', 
-            y = 'SalePrice', 
-            palette='colorblind',
-            data = cleaned_train)
-plt.title("House Price in Ames, Iowa by Sale Zoning Identification\n", 
-          loc='left', fontdict=dict(fontsize = 18))
-plt.xticks(rotation = 45)
-plt.figtext(*figtext_args, **figtext_kwargs)
+jobs.append(plot_job(
+        summary_box_plot, "SaleZoning.png",
+        cached_summary(
+                box_stats,
+                masked(cleaned_train, keep, ['MSZoning', 'SalePrice']),
+                x='MSZoning'),
+        style='bmh', sns_style='dark', x='MSZoning', figsize=(7,7),
+        palette='colorblind',
+        title="House Price in Ames, Iowa by Sale Zoning Identification\n",
+        title_kw=title_kw, rotation=45,
+        caption="Fig 15. Sale Price by Sale Zoning classification"))
 
 # Sale Price vs Garage Area
-plt.figure(figsize=(12,5))
-sns.set_context('paper')
-sns.set_style(style="ticks")
-style.use('fivethirtyeight')
-figtext_args, figtext_kwargs = add_fignum(
-        "Fig 16. Sale Price by Garage Area") 
-sns.scatterplot(x=cleaned_train.drop(
-    cleaned_train[(cleaned_train['LotArea'] > 55000) & 
-                (cleaned_train['GarageArea'] < 500000)].index).LotArea, 
-                y='SalePrice',data=cleaned_train,
-                color = 'orange')
-plt.title("House Price in Ames, Iowa\n", 
-          loc='center', fontdict=dict(fontsize = 18))
-plt.xlabel('Garage Area', fontsize = 15, weight = 'bold')
-plt.ylabel('Sale Price', fontsize = 15, weight = 'bold')
-plt.figtext(*figtext_args, **figtext_kwargs)
+lot_area = masked(
+        cleaned_train,
+        keep_rows(bits, names=['large_cheap_house', 'large_lot_garage']),
+        ['LotArea', 'SalePrice'])
+plot, data = scatter_source(lot_area, 'LotArea')
+jobs.append(plot_job(
+        plot, "GarageArea.png", data, style='fivethirtyeight',
+        context='paper', x='LotArea', figsize=(12,5), color='orange',
+        title="House Price in Ames, Iowa\n",
+        title_kw=dict(loc='center', fontdict=dict(fontsize = 18)),
+        xlabel='Garage Area', ylabel='Sale Price', label_kw=label_kw,
+        caption="Fig 16. Sale Price by Garage Area"))
 
 # Sale Price by Sale Zoning classification and Lot Area
-plt.figure(figsize=(12,5))
-sns.set_context('paper')
-sns.set_style(style="ticks")
-figtext_args, figtext_kwargs = add_fignum(
-        "Fig 17. Sale Price by Sale Zoning classification and Lot Area") 
-sns.scatterplot(x=cleaned_train.drop(
-    cleaned_train[(cleaned_train['LotArea'] > 55000) & 
-                (cleaned_train['SalePrice'] < 500000)].index).LotArea, 
-                y='SalePrice', hue = 'MSZoning',data=cleaned_train)
-plt.title("House Price in Ames, Iowa\n", 
-          loc='center', fontdict=dict(fontsize = 18))
-plt.xlabel('Lot Area', fontsize = 15, weight = 'bold')
-plt.ylabel('Sale Price', fontsize = 15, weight = 'bold')
-plt.figtext(*figtext_args, **figtext_kwargs)
+lot_area = masked(
+        cleaned_train,
+        keep_rows(bits, names=['large_cheap_house', 'large_lot']),
+        ['LotArea', 'SalePrice', 'MSZoning'])
+plot, data = scatter_source(lot_area, 'LotArea', hue='MSZoning')
+jobs.append(plot_job(
+        plot, "Zoning&lotA.png", data, style='fivethirtyeight',
+        sns_style='ticks', context='paper', x='LotArea', hue='MSZoning',
+        figsize=(12,5), title="House Price in Ames, Iowa\n",
+        title_kw=dict(loc='center', fontdict=dict(fontsize = 18)),
+        xlabel='Lot Area', ylabel='Sale Price', label_kw=label_kw,
+        caption="Fig 17. Sale Price by Sale Zoning classification and Lot Area"))
 
 # Sale Price by Total square feet of basement area
-plt.figure(figsize=(12,7))
-figtext_args, figtext_kwargs = add_fignum(
-        "Fig 18. Sale Price by Total square feet of basement area") 
-style.use('fivethirtyeight')
-sns.regplot(x='TotalBsmtSF', 
-            y = 'SalePrice', 
-            color='crimson',
-            data = cleaned_train)
-plt.title("House Prices in Ames, Iowa", 
-          loc='left', fontdict=dict(fontsize = 18))
-plt.xlabel("Total square feet of basement area", 
-           fontsize = 15, weight = 'bold')
-plt.ylabel('Sale Price', fontsize = 15, weight = 'bold')
-plt.figtext(*figtext_args, **figtext_kwargs)
+plot, data = scatter_source(
+        masked(cleaned_train, keep, ['TotalBsmtSF', 'SalePrice']),
+        'TotalBsmtSF', fit=True)
+jobs.append(plot_job(
+        plot, "basementArea.png", data,
+        style='fivethirtyeight', context='paper', x='TotalBsmtSF',
+        color='crimson', title="House Prices in Ames, Iowa", title_kw=title_kw,
+        xlabel="Total square feet of basement area", ylabel='Sale Price',
+        label_kw=label_kw,
+        caption="Fig 18. Sale Price by Total square feet of basement area"))
 
 # Sale Price by First Floor square feet
-plt.figure(figsize=(12,7))
-figtext_args, figtext_kwargs = add_fignum(
-        "Fig 19. Sale Price by First Floor square feet") 
-style.use('fivethirtyeight')
-sns.scatterplot(x='1stFlrSF', 
-            y = 'SalePrice', 
-            color='olive',
-            data = cleaned_train)
-plt.title("House Prices in Ames, Iowa", 
-          loc='left', fontdict=dict(fontsize = 18))
-plt.xlabel("First Floor square feet", fontsize = 15, weight = 'bold')
-plt.ylabel('Sale Price', fontsize = 15, weight = 'bold')
-plt.figtext(*figtext_args, **figtext_kwargs)
+plot, data = scatter_source(
+        masked(cleaned_train, keep, ['1stFlrSF', 'SalePrice']), '1stFlrSF')
+jobs.append(plot_job(
+        plot, "FirstFloor.png", data,
+        style='fivethirtyeight', context='paper', x='1stFlrSF', color='olive',
+        title="House Prices in Ames, Iowa", title_kw=title_kw,
+        xlabel="First Floor square feet", ylabel='Sale Price',
+        label_kw=label_kw,
+        caption="Fig 19. Sale Price by First Floor square feet"))
 
 # Sale Price by Full bathrooms above grade
-plt.figure(figsize=(12,7))
-figtext_args, figtext_kwargs = add_fignum(
-        "Fig 20. Sale Price by Full bathrooms above grade") 
-sns.boxplot(x='FullBath', 
-            y = 'SalePrice', 
-            color='khaki',
-            data = cleaned_train)
-plt.title("House Prices in Ames, Iowa", 
-          loc='left', fontdict=dict(fontsize = 18))
-plt.xlabel("Full bathrooms above grade", fontsize = 15, weight = 'bold')
-plt.ylabel('Sale Price', fontsize = 15, weight = 'bold')
-plt.figtext(*figtext_args, **figtext_kwargs)
+jobs.append(plot_job(
+        summary_box_plot, "bathroom.png",
+        cached_summary(
+                box_stats,
+                masked(cleaned_train, keep, ['FullBath', 'SalePrice']),
+                x='FullBath'),
+        style='fivethirtyeight', context='paper', x='FullBath', color='khaki',
+        title="House Prices in Ames, Iowa", title_kw=title_kw,
+        xlabel="Full bathrooms above grade", ylabel='Sale Price',
+        label_kw=label_kw,
+        caption="Fig 20. Sale Price by Full bathrooms above grade"))
 
 # Sale Price by Total rooms above grade (does not include bathrooms)
-plt.figure(figsize=(12,7))
-figtext_args, figtext_kwargs = add_fignum(
-        "Fig 21. Sale Price by Total rooms above grade (does not include bathrooms)") 
-sns.boxplot(x='TotRmsAbvGrd', 
-            y = 'SalePrice', 
-            color='indianred',
-            data = cleaned_train)
-plt.title("House Prices in Ames, Iowa", 
-          loc='left', fontdict=dict(fontsize = 18))
-plt.xlabel("Total rooms above grade (does not include bathrooms)", 
-           fontsize = 15, weight = 'bold')
-plt.ylabel('Sale Price', fontsize = 15, weight = 'bold')
-plt.figtext(*figtext_args, **figtext_kwargs)
+jobs.append(plot_job(
+        summary_box_plot, "rooms.png",
+        cached_summary(
+                box_stats,
+                masked(cleaned_train, keep, ['TotRmsAbvGrd', 'SalePrice']),
+                x='TotRmsAbvGrd'),
+        style='fivethirtyeight', context='paper', x='TotRmsAbvGrd',
+        color='indianred', title="House Prices in Ames, Iowa",
+        title_kw=title_kw,
+        xlabel="Total rooms above grade (does not include bathrooms)",
+        ylabel='Sale Price', label_kw=label_kw,
+        caption="Fig 21. Sale Price by Total rooms above grade (does not include bathrooms)"))
 
-cleaned_train.to_csv("cleaned_train.csv", index = False, header = True)
+if __name__ == '__main__':
+    with stage('render_jobs', rows_in=len(jobs)):
+        render_jobs(jobs)
+    with stage('write_csv', rows_in=cleaned_train) as s:
+        kept = masked(cleaned_train, keep, cleaned_train.columns)
+        kept.to_csv("cleaned_train.csv", index = False, header = True)
+        s['rows_out'] = len(kept)
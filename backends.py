@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+Pluggable frame backends for the cleaning and EDA computations.
+
+A backend is a dict of functions over its own frame type:
+
+- scan(path, columns=None): open a csv file
+- missing(frame): missing values per variable, in the layout of missing()
+- clean(frame, cleaner): drop and fill with a fitted cleaner (cleaning.py)
+- describe(frame, column): describe() plus Skew and Kurtosis
+- box_stats(frame, x, y): five-number summary of y for each level of x
+- corr(frame, columns=None): correlation matrix of the numerical columns
+- project(frame, columns): only the given columns, materialized once so the
+  queries that follow share one parse of the file
+- to_pandas(frame, columns=None): the given columns as a pandas frame
+
+The pandas backend is eager. The polars backend builds every step as a lazy
+query that runs multi-threaded when collected; projection pushdown means a
+query reads only the csv columns it uses. In run_pipeline() the
+missing-value count comes first and needs every column, so the whole file is
+parsed once; the queries after it read only the projected columns, and the
+columns dropped by the cleaner (PoolQC, MiscFeature, ...) are not parsed
+again. Results come back as pandas objects, and check_backends() verifies
+that the backends agree.
+
+The backends run the computations of the scripts through run_pipeline(),
+which is what the check and time commands below and the pipeline stage of
+benchmark.py use. EDA.py and data_cleaning.py themselves always run on
+pandas; of their helpers, only functions.missing() and plotting_3_charts()
+also accept a polars frame, through backend_of(). HOUSE_BACKEND is the
+backend of run_pipeline() when none is given, pandas by default. polars is
+an optional dependency, imported only when its backend is used.
+
+Usage:
+    python backends.py check --data Cleaned_train.csv
+    python backends.py time --data Cleaned_train.csv --backend polars
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from cleaning import TARGET
+from profiler import missing_table, profile_frame
+
+# Backend of run_pipeline() when none is given; the scripts ignore it
+BACKEND = os.environ.get('HOUSE_BACKEND', 'pandas')
+# Columns summarised for the box plots of EDA.py
+BOX_COLS = ['OverallQual', 'OverallCond', 'Neighborhood', 'BedroomAbvGr',
+            'MSZoning', 'FullBath', 'TotRmsAbvGrd']
+# The strings pandas reads as missing values
+NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN',
+             '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN',
+             'None', 'n/a', 'nan', 'null']
+QUANTILES = [.25, .5, .75]
+# Rows polars reads to infer the csv column types
+INFER_ROWS = 1000
+
+
+def _describe_row(values, name):
+    return pd.DataFrame([values], index=[name],
+                        columns=['count', 'mean', 'std', 'min', '25%', '50%',
+                                 '75%', 'max', 'Skew', 'Kurtosis'])
+
+
+## pandas
+
+def _pd_scan(path, columns=None):
+    return pd.read_csv(path, usecols=columns)
+
+
+def _pd_missing(df):
+    return missing_table(profile_frame(df))
+
+
+def _pd_clean(df, cleaner):
+    from cleaning import apply_cleaner
+    return apply_cleaner(cleaner, df)
+
+
+def _pd_describe(df, column):
+    values = df[column]
+    stats = values.describe()
+    return _describe_row(list(stats) + [values.skew(), values.kurt()], column)
+
+
+def _pd_box_stats(df, x, y):
+    groups = df.groupby(x, observed=True, sort=True)[y]
+    table = groups.quantile(QUANTILES).unstack()
+    table.columns = ['q1', 'med', 'q3']
+    table.insert(0, 'count', groups.count())
+    table.insert(1, 'min', groups.min())
+    table['max'] = groups.max()
+    return table
+
+
+def _pd_corr(df, columns=None):
+    if columns is None:
+        columns = df.select_dtypes(include=np.number).columns
+    return df[list(columns)].corr()
+
+
+def _pd_project(df, columns):
+    return df[list(columns)]
+
+
+def _pd_to_pandas(df, columns=None):
+    return df if columns is None else df[list(columns)]
+
+
+def _pd_numeric(df):
+    return list(df.select_dtypes(include=np.number).columns)
+
+
+PANDAS = {'scan': _pd_scan, 'missing': _pd_missing, 'clean': _pd_clean,
+          'describe': _pd_describe, 'box_stats': _pd_box_stats,
+          'corr': _pd_corr, 'project': _pd_project,
+          'to_pandas': _pd_to_pandas, 'numeric': _pd_numeric}
+
+
+## polars
+
+def _pl_scan(path, columns=None):
+    import polars as pl
+    frame = pl.scan_csv(path, null_values=NA_VALUES,
+                        infer_schema_length=INFER_ROWS)
+    return frame if columns is None else frame.select(columns)
+
+
+def _pl_missing(frame):
+    import polars as pl
+    counts = frame.select(pl.all().null_count()).collect()
+    rows = frame.select(pl.len()).collect().item()
+    columns = counts.columns
+    total = np.array(counts.row(0), dtype=np.int64)
+    table = pd.DataFrame({'Variable': columns, 'Total': total,
+                          'Percent': total / max(rows, 1) * 100})
+    table = table[table['Total'] != 0]
+    return table.sort_values('Total', ascending=False,
+                             kind='mergesort').reset_index(drop=True)
+
+
+def _pl_clean(frame, cleaner):
+    import polars as pl
+    columns = frame.collect_schema().names()
+    frame = frame.drop([c for c in cleaner['drop'] if c in columns])
+    return frame.with_columns([pl.col(c).fill_null(pl.lit(v))
+                               for c, v in cleaner['fill'].items()
+                               if c in columns and c not in cleaner['drop']])
+
+
+def _pl_describe(frame, column):
+    import polars as pl
+    col = pl.col(column)
+    exprs = ([col.count(), col.mean(), col.std(), col.min()]
+             + [col.quantile(q, interpolation='linear') for q in QUANTILES]
+             + [col.max(), col.skew(bias=False),
+                col.kurtosis(fisher=True, bias=False)])
+    row = frame.select([e.alias(str(i)) for i, e in enumerate(exprs)]).collect()
+    return _describe_row([float(v) for v in row.row(0)], column)
+
+
+def _pl_box_stats(frame, x, y):
+    import polars as pl
+    col = pl.col(y)
+    table = (frame.filter(pl.col(x).is_not_null())
+             .group_by(x)
+             .agg(col.count().alias('count'), col.min().alias('min'),
+                  *[col.quantile(q, interpolation='linear').alias(name)
+                    for q, name in zip(QUANTILES, ['q1', 'med', 'q3'])],
+                  col.max().alias('max'))
+             .sort(x)
+             .collect()
+             .to_pandas())
+    return table.set_index(x)
+
+
+def _pl_corr(frame, columns=None):
+    import polars as pl
+    if columns is None:
+        columns = _pl_numeric(frame)
+    df = frame.select(list(columns)).collect()
+    if not any(df.null_count().row(0)):
+        corr = df.corr().to_numpy()
+    else:
+        # Pairwise complete observations, like DataFrame.corr() in pandas,
+        # with every pair in one query
+        pairs = [(i, j) for i in range(len(columns))
+                 for j in range(i + 1, len(columns))]
+        values = df.select([pl.corr(columns[i], columns[j]).alias(str(n))
+                            for n, (i, j) in enumerate(pairs)]).row(0)
+        corr = np.eye(len(columns))
+        for (i, j), value in zip(pairs, values):
+            corr[i, j] = corr[j, i] = np.nan if value is None else value
+    return pd.DataFrame(corr, index=columns, columns=columns)
+
+
+def _pl_project(frame, columns):
+    return frame.select(list(columns)).collect().lazy()
+
+
+def _pl_to_pandas(frame, columns=None):
+    if columns is not None:
+        frame = frame.select(list(columns))
+    return frame.collect().to_pandas()
+
+
+def _pl_numeric(frame):
+    return [c for c, dtype in frame.collect_schema().items()
+            if dtype.is_numeric()]
+
+
+POLARS = {'scan': _pl_scan, 'missing': _pl_missing, 'clean': _pl_clean,
+          'describe': _pl_describe, 'box_stats': _pl_box_stats,
+          'corr': _pl_corr, 'project': _pl_project,
+          'to_pandas': _pl_to_pandas, 'numeric': _pl_numeric}
+
+BACKENDS = {'pandas': PANDAS, 'polars': POLARS}
+
+
+def get_backend(name=None):
+    name = name or BACKEND
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend %s, expected one of %s"
+                         % (name, ', '.join(BACKENDS)))
+    return BACKENDS[name]
+
+
+# The backend of a frame: polars frames are recognised by their module, so
+# polars is never imported for pandas input
+def backend_of(frame):
+    if type(frame).__module__.split('.')[0] == 'polars':
+        return POLARS
+    return PANDAS
+
+
+# The cleaning and EDA computations of the scripts on one csv file. After
+# the missing-value count, which needs every column, only the columns used by
+# the summaries are kept; with the polars backend they are the only columns
+# parsed from the file for the rest of the pipeline.
+def run_pipeline(path, cleaner=None, backend=None, target=TARGET,
+                 box_cols=BOX_COLS):
+    b = get_backend(backend)
+    frame = b['scan'](path)
+    results = {'missing': b['missing'](frame)}
+    if cleaner is not None:
+        frame = b['clean'](frame, cleaner)
+    numeric = b['numeric'](frame)
+    frame = b['project'](frame, numeric + [c for c in box_cols
+                                           if c not in numeric])
+    results['describe'] = b['describe'](frame, target)
+    results['corr'] = b['corr'](frame, numeric)
+    results['box'] = {x: b['box_stats'](frame, x, target) for x in box_cols}
+    return results
+
+
+# Compare the pipeline results of two backends; returns a list of mismatches
+def compare_pipelines(left, right, rtol=1e-6, atol=1e-9):
+    problems = []
+
+    def close(name, a, b):
+        a, b = a.astype(float), b.astype(float)
+        if a.shape != b.shape or not np.allclose(a, b, rtol=rtol, atol=atol,
+                                                 equal_nan=True):
+            problems.append(name)
+
+    if list(left['missing']['Variable']) != list(right['missing']['Variable']):
+        problems.append('missing')
+    else:
+        close('missing', left['missing'][['Total', 'Percent']].to_numpy(),
+              right['missing'][['Total', 'Percent']].to_numpy())
+    close('describe', left['describe'].to_numpy(),
+          right['describe'].to_numpy())
+    cols = list(left['corr'].columns)
+    if cols != list(right['corr'].columns):
+        problems.append('corr')
+    else:
+        close('corr', left['corr'].to_numpy(), right['corr'].to_numpy())
+    for x, table in left['box'].items():
+        other = right['box'][x]
+        if list(map(str, table.index)) != list(map(str, other.index)):
+            problems.append('box ' + x)
+        else:
+            close('box ' + x, table.to_numpy(), other.to_numpy())
+    return problems
+
+
+# Check that every backend gives the results of the pandas backend
+def check_backends(path, cleaner=None, backends=None):
+    reference = run_pipeline(path, cleaner, 'pandas')
+    report = {}
+    for name in backends or [b for b in BACKENDS if b != 'pandas']:
+        report[name] = compare_pipelines(reference,
+                                         run_pipeline(path, cleaner, name))
+    return report
+
+
+def time_pipeline(path, cleaner=None, backend=None, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_pipeline(path, cleaner, backend)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check or time the frame "
+                                                 "backends")
+    parser.add_argument('command', choices=('check', 'time'))
+    parser.add_argument('--data', default='Cleaned_train.csv')
+    parser.add_argument('--cleaner', help="cleaner.json to apply first")
+    parser.add_argument('--backend', choices=list(BACKENDS))
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    cleaner = None
+    if args.cleaner:
+        from cleaning import load_cleaner
+        cleaner = load_cleaner(args.cleaner)
+    if args.command == 'check':
+        names = [args.backend] if args.backend else None
+        for name, problems in check_backends(args.data, cleaner,
+                                             names).items():
+            print("%s: %s" % (name, "matches pandas" if not problems
+                              else "differs in " + ', '.join(problems)))
+    else:
+        for name in [args.backend] if args.backend else BACKENDS:
+            print("%s: %.3f s" % (name, time_pipeline(args.data, cleaner, name,
+                                                      args.repeat)))
@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the cleaning, profiling, correlation and plotting stages at
+growing data sizes.
+
+Synthetic Ames-shaped data is generated from Cleaned_train.csv: rows are
+resampled with replacement (keeping the schema and the joint distribution of
+the columns), continuous numerical columns get a little multiplicative noise
+so their cardinality grows with the row count like real data would, and a
+share of the feature values is blanked out so the missing-value stages have
+work to do. Train and test files are written at 1x, 10x, 100x and 1000x the
+source row count.
+
+Every (size, stage) pair runs in a fresh process, which loads its inputs,
+times the stage and reports the peak resident memory of the process. Results
+are written as JSON together with the commit they were measured on, and two
+result files can be compared to spot regressions between commits.
+
+The pipeline stage runs the cleaning and EDA computations end to end on a
+frame backend (see backends.py); --backend polars times it on the lazy
+polars engine, the other stages use pandas only.
+
+The startup benchmark imports each entry point module in a fresh
+interpreter and reports its import time, the resident memory after the
+import, and which plotting or modelling libraries the import pulled in.
+
+Usage:
+    python benchmark.py run --scales 1 10 100
+    python benchmark.py run --backend polars --stages pipeline
+    python benchmark.py compare benchmarks/<old>.json benchmarks/<new>.json
+    python benchmark.py startup
+"""
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from cleaning import ID_COL, TARGET, apply_cleaner, fit_cleaner
+
+SCALES = (1, 10, 100, 1000)
+# Share of the feature values blanked out in the synthetic data
+MISSING_RATE = 0.05
+# Numerical columns with more distinct values than this get noise
+CONTINUOUS = 50
+# Results go to the directory given by HOUSE_BENCH_DIR, benchmarks/ by default
+RESULTS_DIR = os.environ.get('HOUSE_BENCH_DIR', 'benchmarks')
+
+
+## Synthetic data
+
+def synthesize(source, rows, missing_rate=MISSING_RATE, seed=0):
+    rng = np.random.default_rng(seed)
+    df = source.iloc[rng.integers(len(source), size=rows)].reset_index(
+            drop=True)
+    for col in df.columns:
+        if col in (ID_COL, TARGET):
+            continue
+        values = df[col]
+        if (pd.api.types.is_numeric_dtype(values)
+                and source[col].nunique() > CONTINUOUS):
+            noisy = values * rng.normal(1, 0.02, rows)
+            if pd.api.types.is_integer_dtype(values):
+                noisy = noisy.round().astype(values.dtype)
+            values = noisy
+        if missing_rate:
+            values = values.mask(rng.random(rows) < missing_rate)
+        df[col] = values
+    df[ID_COL] = np.arange(1, rows + 1)
+    return df
+
+
+# Write the train and test files of one scale, unless they already exist
+def write_dataset(source, scale, data_dir, missing_rate=MISSING_RATE):
+    paths = {part: os.path.join(data_dir, '%s_%sx.csv' % (part, scale))
+             for part in ('train', 'test')}
+    if not all(os.path.exists(p) for p in paths.values()):
+        os.makedirs(data_dir, exist_ok=True)
+        rows = len(source) * scale
+        synthesize(source, rows, missing_rate, seed=(scale, 0)).to_csv(
+                paths['train'], index=False)
+        synthesize(source, rows, missing_rate, seed=(scale, 1)).drop(
+                columns=TARGET).to_csv(paths['test'], index=False)
+    return paths
+
+
+## Stages
+
+# One function per figure function of functions.py, called the way EDA.py and
+# data_cleaning.py call it
+def _plot_normality(df, filename):
+    from functions import normality_plot
+    normality_plot(df, filename, 'SalePrice', 'Fig 1. SalePrice')
+
+
+def _plot_missing(df, filename):
+    from functions import plot_missing_data
+    plot_missing_data(1, df, filename)
+
+
+def _plot_box(df, filename):
+    from functions import box_plot
+    box_plot(df[['OverallQual', 'SalePrice']], filename, x='OverallQual',
+             title="Impact of Overall Quality on Sale Price")
+
+
+def _plot_reg(df, filename):
+    from functions import reg_plot
+    reg_plot(df[['GrLivArea', 'SalePrice']], filename, x='GrLivArea',
+             color='brown', title="House Prices in Ames, Iowa")
+
+
+def _plot_scatter(df, filename):
+    from functions import scatter_plot
+    scatter_plot(df[['LotArea', 'MSZoning', 'SalePrice']], filename,
+                 x='LotArea', hue='MSZoning', figsize=(12,5))
+
+
+def _plot_box_grid(df, filename):
+    from functions import box_grid
+    xs = ['OverallQual', 'FullBath', 'BedroomAbvGr', 'TotRmsAbvGrd']
+    box_grid(df[xs + ['SalePrice']], filename, xs, xs, 2, 2)
+
+
+def _plot_scatter_grid(df, filename):
+    from functions import scatter_grid
+    ys = ['GrLivArea', 'TotalBsmtSF', '1stFlrSF']
+    scatter_grid(df[ys + ['SalePrice']], filename, ys, ys,
+                 ['red', 'green', 'blue'])
+
+
+def _plot_heatmap(df, filename):
+    from functions import corr_heatmap
+    corr = df.select_dtypes(include=np.number).corr()
+    cols = corr.nlargest(10, 'SalePrice')['SalePrice'].index
+    corr_heatmap(corr.loc[cols, cols], filename)
+
+
+PLOTS = {'plotting_3_charts': _plot_normality,
+         'plot_missing_data': _plot_missing,
+         'box_plot': _plot_box,
+         'reg_plot': _plot_reg,
+         'scatter_plot': _plot_scatter,
+         'box_grid': _plot_box_grid,
+         'scatter_grid': _plot_scatter_grid,
+         'corr_heatmap': _plot_heatmap}
+
+STAGES = (['read_csv', 'concat', 'missing', 'impute', 'corr', 'pipeline']
+          + ['plot:' + name for name in PLOTS])
+# Stages that run on every backend
+BACKEND_STAGES = ['pipeline']
+
+
+# Peak resident memory of this process. VmHWM is read where /proc has it:
+# the ru_maxrss of a spawned worker starts from the peak of its parent, which
+# has built the large input files by then.
+def _peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 1024 ** (2 if sys.platform == 'darwin' else 1)
+
+
+# Reset VmHWM to the current memory (Linux), so the peak that follows is the
+# timed part's own and not that of preparing its inputs
+def _reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _read(paths):
+    return pd.read_csv(paths['train']), pd.read_csv(paths['test'])
+
+
+def _combine(train, test):
+    return pd.concat([train, test], ignore_index=True)
+
+
+# Prepare the inputs of a stage and return the timed part as a function
+def _prepare(stage, paths, out_dir, backend='pandas'):
+    if stage == 'pipeline':
+        from backends import run_pipeline
+        cleaner = fit_cleaner(pd.read_csv(paths['train']))
+        return lambda: run_pipeline(paths['train'], cleaner, backend)
+    if stage == 'read_csv':
+        return lambda: _read(paths)
+    train, test = _read(paths)
+    if stage == 'concat':
+        return lambda: _combine(train, test)
+    if stage == 'missing':
+        from functions import missing
+        combined = _combine(train, test)
+        return lambda: missing(combined)
+    if stage == 'impute':
+        def impute():
+            cleaner = fit_cleaner(train)
+            return apply_cleaner(cleaner, train), apply_cleaner(cleaner, test)
+        return impute
+    if stage == 'corr':
+        numeric = train.select_dtypes(include=np.number)
+        return lambda: numeric.corr()
+    name = stage.split(':', 1)[1]
+    # Only the plot stages load the plotting libraries, on the Agg backend
+    # and outside of the timed call
+    import matplotlib
+    matplotlib.use('Agg')
+    for module in ('matplotlib.pyplot', 'seaborn'):
+        importlib.import_module(module)
+    if name == 'plot_missing_data':
+        df = _combine(train, test)
+    else:
+        df = apply_cleaner(fit_cleaner(train), train)
+    filename = os.path.join(out_dir, name + '.png')
+    return lambda: PLOTS[name](df, filename)
+
+
+# Run one stage in the current process. Meant to be called in a fresh worker
+# process so the memory figures belong to this stage alone.
+def run_stage(stage, paths, out_dir, repeat=1, backend='pandas'):
+    func = _prepare(stage, paths, out_dir, backend)
+    base = _peak_rss_mb()
+    _reset_peak_rss()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'seconds': min(times), 'base_rss_mb': base,
+            'peak_rss_mb': _peak_rss_mb()}
+
+
+def _in_child(stage, paths, out_dir, repeat, backend):
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(1, mp_context=context) as pool:
+        return pool.submit(run_stage, stage, paths, out_dir, repeat,
+                           backend).result()
+
+
+def _git(*args):
+    try:
+        return subprocess.run(['git'] + list(args), capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Time every stage at every scale. A stage that fails (a MemoryError, or the
+# worker being killed at the larger sizes) is recorded with its error.
+def run_benchmark(source_path='Cleaned_train.csv', scales=SCALES,
+                  stages=STAGES, repeat=1, missing_rate=MISSING_RATE,
+                  data_dir=None, backend='pandas'):
+    if backend != 'pandas':
+        stages = [s for s in stages if s in BACKEND_STAGES]
+    source = pd.read_csv(source_path)
+    data_dir = data_dir or os.path.join(RESULTS_DIR, 'data')
+    results = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        for scale in scales:
+            paths = write_dataset(source, scale, data_dir, missing_rate)
+            for stage in stages:
+                row = {'scale': scale, 'rows': len(source) * scale,
+                       'stage': stage, 'backend': backend}
+                try:
+                    row.update(_in_child(stage, paths, out_dir, repeat,
+                                         backend))
+                except Exception as error:
+                    row['error'] = '%s: %s' % (type(error).__name__, error)
+                results.append(row)
+                print("%5sx %-28s %s" % (scale, stage, _format_row(row)))
+    status = _git('status', '--porcelain', '--untracked-files=no')
+    return {'commit': _git('rev-parse', 'HEAD'),
+            'dirty': bool(status) if status is not None else None,
+            'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'source': source_path,
+            'missing_rate': missing_rate,
+            'results': results}
+
+
+def _format_row(row):
+    if 'error' in row:
+        return "failed (%s)" % row['error']
+    rss = row['peak_rss_mb']
+    return "%9.3f s  %s" % (row['seconds'],
+                            "%8.0f MB" % rss if rss is not None else "")
+
+
+def save_results(report, path=None):
+    if path is None:
+        commit = (report['commit'] or 'nocommit')[:10]
+        path = os.path.join(RESULTS_DIR, '%s%s.json'
+                            % (commit, '-dirty' if report['dirty'] else ''))
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# Side by side timings and memory of two result files. ratio is new/old
+# time; a stage is flagged when it got slower than 1 + tolerance.
+def compare_results(old, new, tolerance=0.2):
+    def frame(report):
+        rows = [dict({'backend': 'pandas'}, **r) for r in report['results']
+                if 'error' not in r]
+        return pd.DataFrame(rows, columns=['scale', 'backend', 'stage',
+                                           'seconds', 'peak_rss_mb']
+                            ).set_index(['scale', 'backend', 'stage'])
+    table = frame(old).join(frame(new), how='inner', lsuffix='_old',
+                            rsuffix='_new')
+    table['ratio'] = table['seconds_new'] / table['seconds_old']
+    table['regression'] = table['ratio'] > 1 + tolerance
+    return table
+
+
+## Startup
+
+# Entry point modules timed by the startup benchmark, the cleaning ones first
+STARTUP_MODULES = ('cleaning', 'profiler', 'functions', 'refresh', 'model',
+                   'serve')
+# Libraries that the modules above should only import when they are used
+HEAVY_MODULES = ('matplotlib', 'seaborn', 'scipy', 'sklearn', 'polars')
+
+_IMPORT_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+%s
+seconds = time.perf_counter() - start
+# Peak memory of this process: ru_maxrss carries over the peak of the
+# parent through fork on Linux, VmHWM starts afresh at exec
+try:
+    with open('/proc/self/status') as f:
+        rss = [int(line.split()[1]) / 1024 for line in f
+               if line.startswith('VmHWM')][0]
+except (OSError, IndexError):
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        rss /= 1024 ** (2 if sys.platform == 'darwin' else 1)
+    except ImportError:
+        rss = None
+print(json.dumps({'seconds': seconds, 'rss_mb': rss,
+                  'heavy': [m for m in %r if m in sys.modules]}))
+'''
+
+
+# Import time and memory of a module in a fresh interpreter, best of repeat
+# runs; module None measures the bare interpreter
+def measure_import(module, repeat=5):
+    script = _IMPORT_SCRIPT % ('import %s' % module if module else 'pass',
+                               HEAVY_MODULES)
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', script],
+                             capture_output=True, text=True, check=True)
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    best = min(runs, key=lambda r: r['seconds'])
+    return {'module': module or '(python)', 'seconds': best['seconds'],
+            'rss_mb': best['rss_mb'], 'heavy': ', '.join(best['heavy'])}
+
+
+def startup_table(modules=STARTUP_MODULES, repeat=5):
+    rows = [measure_import(None, repeat)]
+    rows += [measure_import(module, repeat) for module in modules]
+    return pd.DataFrame(rows).set_index('module')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline "
+                                                 "stages at scaled data sizes")
+    sub = parser.add_subparsers(dest='command')
+    bench = sub.add_parser('run')
+    bench.add_argument('--source', default='Cleaned_train.csv')
+    bench.add_argument('--scales', type=int, nargs='+', default=list(SCALES))
+    bench.add_argument('--stages', nargs='+', choices=STAGES,
+                       default=STAGES)
+    bench.add_argument('--repeat', type=int, default=1)
+    bench.add_argument('--missing-rate', type=float, default=MISSING_RATE)
+    bench.add_argument('--data-dir')
+    bench.add_argument('--backend', choices=['pandas', 'polars'],
+                       default='pandas')
+    bench.add_argument('--out')
+    diff = sub.add_parser('compare')
+    diff.add_argument('old')
+    diff.add_argument('new')
+    diff.add_argument('--tolerance', type=float, default=0.2)
+    boot = sub.add_parser('startup')
+    boot.add_argument('--modules', nargs='+', default=list(STARTUP_MODULES))
+    boot.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    if args.command == 'run':
+        report = run_benchmark(args.source, args.scales, args.stages,
+                               args.repeat, args.missing_rate, args.data_dir,
+                               args.backend)
+        print("Results written to %s" % save_results(report, args.out))
+    elif args.command == 'compare':
+        old, new = load_results(args.old), load_results(args.new)
+        table = compare_results(old, new, args.tolerance)
+        print("%s -> %s" % (old['commit'], new['commit']))
+        with pd.option_context('display.width', 160,
+                               'display.max_columns', None,
+                               'display.max_rows', None):
+            print(table.round(3))
+        if table['regression'].any():
+            sys.exit(1)
+    elif args.command == 'startup':
+        table = startup_table(args.modules, args.repeat)
+        with pd.option_context('display.width', 120,
+                               'display.float_format', '{:.3f}'.format):
+            print(table.to_string())
+    else:
+        parser.print_help()
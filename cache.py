@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed stage cache.
+
+A stage result is stored on local disk under a key made from the contents of
+its inputs (files are hashed by content, frames by their values, other
+objects by their pickle), the stage parameters and the source code of the
+functions the stage depends on. A rerun with the same inputs, parameters and
+code loads the stored result instead of recomputing it, while editing one
+function only invalidates the stages that list it. A stage whose code calls
+into helpers lists their modules, so that any edit in them is seen. Results are frames,
+correlation matrices or any other picklable object; rendered plots are cached
+as files. The cache directory is kept under a size bound by evicting the
+least recently used entries.
+"""
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+
+import pandas as pd
+
+CACHE_DIR = os.environ.get('HOUSE_CACHE_DIR', '.stage_cache')
+# Size bound of the cache directory in bytes
+MAX_BYTES = int(os.environ.get('HOUSE_CACHE_BYTES', 2 * 1024 ** 3))
+# Set HOUSE_CACHE=0 to always recompute
+ENABLED = os.environ.get('HOUSE_CACHE', '1') != '0'
+
+_file_digests = {}
+
+
+# sha256 of a file's contents, remembered while the file is unchanged
+def file_digest(path):
+    stat = os.stat(path)
+    memo = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo not in _file_digests:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        _file_digests[memo] = sha.hexdigest()
+    return _file_digests[memo]
+
+
+# sha256 of a frame's values, index and column labels
+def frame_digest(df):
+    sha = hashlib.sha256()
+    sha.update(repr(list(df.columns)).encode())
+    sha.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return sha.hexdigest()
+
+
+def _input_digest(item):
+    if isinstance(item, (pd.DataFrame, pd.Series)):
+        return frame_digest(item)
+    if isinstance(item, (str, os.PathLike)):
+        return file_digest(item)
+    # Other inputs, such as precomputed plot summaries, by their pickle
+    return hashlib.sha256(pickle.dumps(
+            item, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+
+def _source(func):
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        return repr(getattr(func, '__code__', func))
+
+
+# Key of a stage run: its name, input contents, parameters and code
+def stage_key(name, inputs=(), params=None, depends=()):
+    sha = hashlib.sha256(name.encode())
+    for item in inputs:
+        sha.update(_input_digest(item).encode())
+    sha.update(json.dumps(params, sort_keys=True, default=repr).encode())
+    for func in depends:
+        sha.update(_source(func).encode())
+    return '%s-%s' % (name, sha.hexdigest()[:24])
+
+
+# Remove the least recently used entries until the cache fits its bound.
+# Worker processes evict concurrently: files still being written (*.tmp)
+# are left alone, and an entry another process removed first is skipped.
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.tmp'):
+            continue
+        try:
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            continue
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        total -= size
+
+
+def _store(path, write, cache_dir, max_bytes):
+    os.makedirs(cache_dir, exist_ok=True)
+    # One temporary file per process, so two workers storing the same key
+    # do not write into each other's file
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    write(tmp)
+    os.replace(tmp, path)
+    evict(cache_dir, max_bytes)
+
+
+# Run func() unless a result for the same inputs, parameters and code is
+# cached. depends lists the functions, or whole modules, whose source
+# belongs to the key.
+def cached_stage(name, func, inputs=(), params=None, depends=(),
+                 cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+    if not ENABLED:
+        return func()
+    key = stage_key(name, inputs, params, tuple(depends) + (func,))
+    path = os.path.join(cache_dir, key + '.pkl')
+    # An entry evicted by another process between the lookup and the read
+    # is a miss
+    try:
+        os.utime(path)
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        pass
+    result = func()
+
+    def write(tmp):
+        with open(tmp, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    _store(path, write, cache_dir, max_bytes)
+    return result
+
+
+# Render a file (a plot) with render(target) unless a copy for the same
+# inputs, parameters and code is cached, in which case it is copied back.
+def cached_file(name, render, target, inputs=(), params=None, depends=(),
+                cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+    if not ENABLED:
+        render(target)
+        return False
+    key = stage_key(name, inputs, params, tuple(depends) + (render,))
+    path = os.path.join(cache_dir, key + os.path.splitext(target)[1])
+    try:
+        os.utime(path)
+        shutil.copyfile(path, target)
+        return True
+    except FileNotFoundError:
+        pass
+    render(target)
+    _store(path, lambda tmp: shutil.copyfile(target, tmp), cache_dir,
+           max_bytes)
+    return False
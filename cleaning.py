@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming cleaning engine for the Ames housing data.
+
+data_cleaning.py walks through the cleaning decisions one plot at a time on a
+fully materialised train + test frame. This module applies the same decisions
+to raw CSVs of any size. A first pass reads the files in fixed-size chunks and
+learns the missing-value profile, the per-column modes and the drop list from
+mergeable partial aggregates (null counts and value counts). A second pass
+drops and imputes chunk by chunk and appends to Cleaned_train.csv /
+Cleaned_test.csv, so peak memory depends on the chunk size only.
+
+The same decisions are available as a fit-once cleaner: fit_cleaner() learns
+the drop list and the fill values from training data and apply_cleaner()
+reuses them on the test file or on any new batch; serve.py folds the fill
+values into its encoder for single listings.
+
+Usage:
+    python cleaning.py path/to/train.csv path/to/test.csv --chunksize 100000
+"""
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from sketches import reduce_counts
+
+TARGET = 'SalePrice'
+ID_COL = 'Id'
+# Variables with more than this percentage of missing data are deleted
+MISSING_THRESHOLD = 15
+# Variables deleted by judgement in data_cleaning.py after plotting them
+# against SalePrice (GarageYrBlt, GarageX and BsmtX variables)
+DROP_COLS = ['GarageYrBlt',
+             'GarageQual', 'GarageType', 'GarageFinish', 'GarageCond',
+             'BsmtQual', 'BsmtCond', 'BsmtFinType1',
+             'BsmtFinType2', 'BsmtExposure']
+# Variables whose few missing values are replaced with the mode
+MODE_COLS = ['MasVnrType','MSZoning', 'BsmtFullBath', 'Functional',
+             'Utilities', 'BsmtHalfBath', 'Exterior1st', 'KitchenQual',
+             'GarageCars','GarageArea', 'TotalBsmtSF', 'SaleType',
+             'BsmtUnfSF','BsmtFinSF2','BsmtFinSF1', 'Exterior2nd',
+             'MasVnrArea', 'Electrical']
+CHUNKSIZE = 100000
+
+
+# Read a csv file as a stream of chunks
+def iter_chunks(path, chunksize=CHUNKSIZE, **kwargs):
+    return pd.read_csv(path, chunksize=chunksize, **kwargs)
+
+
+# Partial aggregates of one chunk. Every field can be merged with the same
+# field of another chunk, so a whole file is summarised without holding it.
+def scan_chunk(chunk, impute_cols=MODE_COLS):
+    counts = {}
+    for col in impute_cols:
+        if col in chunk.columns:
+            counts[col] = chunk[col].value_counts()
+    numeric = set(chunk.select_dtypes(include=np.number).columns)
+    # A chunk where a text column is entirely empty is read as float, so it
+    # says nothing about the column type
+    numeric |= set(chunk.columns[chunk.isnull().all().to_numpy()])
+    return {'rows': len(chunk),
+            'columns': list(chunk.columns),
+            'nulls': chunk.isnull().sum(),
+            'numeric': numeric,
+            'counts': counts}
+
+
+# Merge two partial aggregates. With top_k, the value counts are reduced to
+# Misra-Gries heavy hitters so high-cardinality columns stay bounded in
+# memory; the mode is then approximate (see sketches.py for the error bound).
+def merge_scans(left, right, top_k=None):
+    if left is None:
+        if top_k is None:
+            return right
+        return dict(right, counts={col: reduce_counts(values, top_k)
+                                   for col, values in right['counts'].items()})
+    columns = left['columns'] + [c for c in right['columns']
+                                 if c not in left['columns']]
+    counts = dict(left['counts'])
+    for col, values in right['counts'].items():
+        if col in counts:
+            counts[col] = counts[col].add(values, fill_value=0)
+        else:
+            counts[col] = values
+        if top_k is not None:
+            counts[col] = reduce_counts(counts[col], top_k)
+    return {'rows': left['rows'] + right['rows'],
+            'columns': columns,
+            'nulls': left['nulls'].add(right['nulls'], fill_value=0),
+            'numeric': left['numeric'] & right['numeric'],
+            'counts': counts}
+
+
+# First pass over a file
+def scan_file(path, chunksize=CHUNKSIZE, impute_cols=MODE_COLS, top_k=None):
+    scan = None
+    for chunk in iter_chunks(path, chunksize):
+        scan = merge_scans(scan, scan_chunk(chunk, impute_cols), top_k)
+    return scan
+
+
+# Mode from merged value counts. Ties go to the smallest value, which is what
+# Series.mode()[0] returns.
+def mode_from_counts(counts):
+    if counts is None or counts.empty:
+        return np.nan
+    top = counts[counts == counts.max()].index
+    try:
+        return sorted(top)[0]
+    except TypeError:
+        return top[0]
+
+
+# Percentage of missing values per variable, in the layout of missing()
+def missing_from_scan(scan, exclude=(TARGET,)):
+    nulls = scan['nulls'].drop(labels=list(exclude), errors='ignore')
+    percent = nulls / scan['rows'] * 100
+    return pd.DataFrame({'Variable': nulls.index,
+                         'Total': nulls.to_numpy(),
+                         'Percent': percent.to_numpy()}).sort_values(
+                                 'Total', ascending=False).reset_index(
+                                         drop=True)
+
+
+# Learn a cleaner from the scan of the training data: the drop list and one
+# fill value per imputed column. The cleaner is a plain dict of built-in types
+# so it can be stored as JSON and reused on any later batch.
+def cleaner_from_scan(scan, threshold=MISSING_THRESHOLD, drop_cols=DROP_COLS,
+                      impute_cols=MODE_COLS):
+    profile = missing_from_scan(scan)
+    drop = list(profile.loc[profile['Percent'] > threshold, 'Variable'])
+    drop += [c for c in drop_cols if c in scan['columns'] and c not in drop]
+    fill = {}
+    for col in impute_cols:
+        if col in scan['columns'] and col not in drop:
+            value = mode_from_counts(scan['counts'].get(col))
+            fill[col] = value.item() if hasattr(value, 'item') else value
+    return {'drop': drop,
+            'fill': fill,
+            'columns': [c for c in scan['columns'] if c not in drop]}
+
+
+# Fit a cleaner on an in-memory training frame. By default every kept column
+# except the identifier and the target gets a fill value, so a new listing
+# with any field missing can be cleaned.
+def fit_cleaner(df, threshold=MISSING_THRESHOLD, drop_cols=DROP_COLS,
+                impute_cols=None):
+    if impute_cols is None:
+        impute_cols = [c for c in df.columns if c not in (ID_COL, TARGET)]
+    return cleaner_from_scan(scan_chunk(df, impute_cols), threshold,
+                             drop_cols, impute_cols)
+
+
+# Drop and impute a batch in one vectorized pass
+def apply_cleaner(cleaner, df):
+    df = df.drop(columns=[c for c in cleaner['drop'] if c in df.columns])
+    return df.fillna(cleaner['fill'])
+
+
+def save_cleaner(cleaner, path):
+    with open(path, 'w') as f:
+        json.dump(cleaner, f, indent=1)
+
+
+def load_cleaner(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# Numerical columns that have missing values are float for the whole file
+# when pandas reads it at once. Pin them so every chunk is written the same.
+def _float_dtypes(scan):
+    return {col: 'float64' for col in scan['columns']
+            if col in scan['numeric'] and scan['nulls'].get(col, 0) > 0}
+
+
+# Second pass over a file: drop, impute and append chunk by chunk
+def clean_file(path, out_path, cleaner, scan, chunksize=CHUNKSIZE,
+               log_target=True):
+    rows = 0
+    reader = iter_chunks(path, chunksize, dtype=_float_dtypes(scan))
+    for n, chunk in enumerate(reader):
+        chunk = apply_cleaner(cleaner, chunk)
+        if log_target and TARGET in chunk.columns:
+            chunk[TARGET] = np.log(chunk[TARGET])
+        chunk.to_csv(out_path, index=False, header=(n == 0),
+                     mode='w' if n == 0 else 'a')
+        rows += len(chunk)
+    return rows
+
+
+# Run both passes over the raw train and test files. The cleaner is learned
+# from the training file only and applied unchanged to the test file.
+def stream_clean(train_path, test_path, train_out='Cleaned_train.csv',
+                 test_out='Cleaned_test.csv', chunksize=CHUNKSIZE,
+                 threshold=MISSING_THRESHOLD, drop_cols=DROP_COLS,
+                 impute_cols=MODE_COLS, top_k=None):
+    train_scan = scan_file(train_path, chunksize, impute_cols, top_k)
+    test_scan = scan_file(test_path, chunksize, impute_cols=())
+    cleaner = cleaner_from_scan(train_scan, threshold, drop_cols, impute_cols)
+    clean_file(train_path, train_out, cleaner, train_scan, chunksize)
+    clean_file(test_path, test_out, cleaner, test_scan, chunksize)
+    return cleaner
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description="Clean the raw train/test files in chunks")
+    parser.add_argument('train')
+    parser.add_argument('test')
+    parser.add_argument('--train-out', default='Cleaned_train.csv')
+    parser.add_argument('--test-out', default='Cleaned_test.csv')
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE)
+    parser.add_argument('--threshold', type=float, default=MISSING_THRESHOLD)
+    parser.add_argument('--cleaner', default='cleaner.json',
+                        help="where to store the fitted cleaner")
+    parser.add_argument('--top-k', type=int, default=None,
+                        help="approximate modes with this many heavy hitters")
+    args = parser.parse_args()
+    cleaner = stream_clean(args.train, args.test, args.train_out,
+                           args.test_out, args.chunksize, args.threshold,
+                           top_k=args.top_k)
+    save_cleaner(cleaner, args.cleaner)
+    print("Dropped %s columns: %s" % (len(cleaner['drop']),
+                                       ', '.join(cleaner['drop'])))
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental correlation engine.
+
+Instead of recomputing DataFrame.corr() over every row, the engine keeps the
+sufficient statistics of the numerical columns: the row count, the column
+sums and the matrix of cross-products. New rows are added to these totals
+without rescanning history, so refreshing the SalePrice heatmap when new
+sales land costs O(new rows). The top-k features correlated with a target
+and any sub-matrix of the correlation matrix are read directly from the
+statistics.
+
+Values are shifted by the column means of the first batch before they are
+accumulated, which keeps the sums small and avoids the loss of precision of
+the textbook sum-of-squares formula. Rows with a missing value in any of the
+tracked columns are skipped.
+"""
+import numpy as np
+import pandas as pd
+
+
+def _matrix(df, columns):
+    values = df[columns].to_numpy(dtype=np.float64)
+    return values[~np.isnan(values).any(axis=1)]
+
+
+def _accumulate(stats, values):
+    centered = values - stats['shift']
+    stats['n'] += len(centered)
+    stats['sum'] += centered.sum(axis=0)
+    stats['cross'] += centered.T @ centered
+    return stats
+
+
+# Sufficient statistics of the numerical columns of a frame
+def corr_stats(df, columns=None):
+    if columns is None:
+        columns = list(df.select_dtypes(include=np.number).columns)
+    values = _matrix(df, columns)
+    width = len(columns)
+    shift = values.mean(axis=0) if len(values) else np.zeros(width)
+    stats = {'columns': list(columns), 'shift': shift, 'n': 0,
+             'sum': np.zeros(width), 'cross': np.zeros((width, width))}
+    return _accumulate(stats, values)
+
+
+# Add appended rows to the statistics
+def update_corr_stats(stats, df):
+    return _accumulate(stats, _matrix(df, stats['columns']))
+
+
+# Combine the statistics of two partitions over the same columns
+def merge_corr_stats(left, right):
+    delta = right['shift'] - left['shift']
+    # Move the right totals onto the left shift
+    sums = right['sum'] + right['n'] * delta
+    cross = (right['cross'] + np.outer(right['sum'], delta)
+             + np.outer(delta, right['sum'])
+             + right['n'] * np.outer(delta, delta))
+    return {'columns': list(left['columns']), 'shift': left['shift'].copy(),
+            'n': left['n'] + right['n'], 'sum': left['sum'] + sums,
+            'cross': left['cross'] + cross}
+
+
+def _positions(stats, columns):
+    index = {col: i for i, col in enumerate(stats['columns'])}
+    return np.array([index[col] for col in columns], dtype=np.intp)
+
+
+def _covariance(stats, rows, cols):
+    n = stats['n']
+    means = stats['sum'] / n
+    return (stats['cross'][np.ix_(rows, cols)] / n
+            - np.outer(means[rows], means[cols]))
+
+
+def _variance(stats, idx):
+    means = stats['sum'][idx] / stats['n']
+    return stats['cross'][idx, idx] / stats['n'] - means ** 2
+
+
+# Correlation matrix of the given columns (all tracked columns by default)
+def corr_matrix(stats, columns=None):
+    if columns is None:
+        columns = stats['columns']
+    columns = list(columns)
+    idx = _positions(stats, columns)
+    std = np.sqrt(_variance(stats, idx))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corr = _covariance(stats, idx, idx) / np.outer(std, std)
+    np.fill_diagonal(corr, 1.0)
+    return pd.DataFrame(np.clip(corr, -1, 1), index=columns, columns=columns)
+
+
+# The k columns most correlated with the target, the target itself included,
+# as DataFrame.corr().nlargest(k, target)[target] returns them
+def top_k_correlated(stats, target, k):
+    idx = np.arange(len(stats['columns']))
+    t = _positions(stats, [target])
+    std = np.sqrt(_variance(stats, idx))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corr = _covariance(stats, t, idx)[0] / (std[t] * std)
+    corr[t] = 1.0
+    corr = pd.Series(np.clip(corr, -1, 1), index=stats['columns'])
+    return corr.dropna().nlargest(k)
+
+
+def save_corr_stats(stats, path):
+    np.savez(path, columns=np.array(stats['columns'], dtype=object),
+             shift=stats['shift'], n=stats['n'], sum=stats['sum'],
+             cross=stats['cross'])
+
+
+def load_corr_stats(path):
+    with np.load(path, allow_pickle=True) as data:
+        return {'columns': list(data['columns']), 'shift': data['shift'],
+                'n': int(data['n']), 'sum': data['sum'],
+                'cross': data['cross']}
@@ -24,42 +24,90 @@ modernized and expanded version of the often cited Boston Housing dataset.
 #### Load all required Libraries
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
+import cleaning
+import sketches
 from functions import (
-        add_fignum, 
-        plotting_3_charts, 
         missing,
-        plot_missing_data
+        normality_plot,
+        missing_plot,
+        scatter_grid,
+        box_grid
 )
+from cleaning import (
+        fit_cleaner,
+        apply_cleaner,
+        save_cleaner,
+        MISSING_THRESHOLD,
+        DROP_COLS
+)
+from cache import cached_stage
+from plot_jobs import plot_job, render_jobs
+from storage import write_cleaned
+from sketches import sketch_describe
+from plot_data import normality_summary, normality_table
+from instrument import stage
+from dtype_plan import update_plan, merge_plans, plan_schema, bytes_per_row
+from ingest import DATA_DIR, find_shards, plan_shards, read_shards, assemble
+from correlation import corr_stats
+from refresh import new_state, save_state
+from features import build_index, save_index
+from drift import build_profile, save_profile
+from neighborhood_index import (build_index as build_neighborhoods,
+                                save_index as save_neighborhoods)
 
 pd.set_option('display.float_format', lambda x: '%.3f' % x)
 pd.set_option('display.max_columns', 100)
-sns.set_color_codes("dark")
-sns.set_style(style='whitegrid')
 
-# Specify the folder where the files are stored
-file_folder = "C:\\Users\Anshul Arya\Desktop\DataScience\HousePrice\Data" 
-# Read Train.csv file
-house_train = pd.read_csv(file_folder + '\\' + 'train.csv')
-# Read Test.csv file
-house_test = pd.read_csv(file_folder + '\\' + 'test.csv')
+# Also export the cleaned data as CSV next to the columnar files
+EXPORT_CSV = True
+# Summarize SalePrice with approximate sketches instead of exact statistics
+SKETCH_MODE = False
+
+# The files are read from the folder given by HOUSE_DATA_DIR (Data/ by
+# default): a train.csv and test.csv pair, or any number of train*.csv and
+# test*.csv shards in the folder and its subfolders
+train_paths = find_shards(DATA_DIR, 'train*.csv')
+test_paths = find_shards(DATA_DIR, 'test*.csv')
+# Compact dtypes planned from all files: small integers, float32 and
+# categoricals with the same categories in train and test. The plan is redone
+# only when the files change.
+with stage('plan_dtypes'):
+    schema = cached_stage("schema", lambda: plan_shards(train_paths
+                                                        + test_paths),
+                          inputs=train_paths + test_paths,
+                          depends=[plan_shards, update_plan, merge_plans,
+                                   plan_schema])
+with stage('read_csv') as s:
+    # Read the Train shards, parsed in parallel
+    house_train = read_shards(train_paths, schema)
+    # Read the Test shards
+    house_test = read_shards(test_paths, schema)
+    s['rows_out'] = len(house_train) + len(house_test)
 
 print("The Training dataset has %s rows and %s columns" 
       %(house_train.shape[0],house_train.shape[1]))
 print("The Test dataset has %s rows and %s columns" 
       %(house_test.shape[0],house_test.shape[1]))
 
-combine_data = pd.concat((house_train, house_test), sort=False).reset_index(
-        drop=True)
-# Drop the Target Variable from the combined dataset
-combine_data.drop(['SalePrice'], axis = 1, inplace = True)
+with stage('combine', rows_in=len(house_train) + len(house_test)) as s:
+    # Leave the Target Variable out of the combined dataset. The columns are
+    # allocated once and filled from train and test.
+    combine_data = assemble((house_train, house_test),
+                            [c for c in house_train.columns if c != 'SalePrice'])
+    s['rows_out'] = len(combine_data)
 print("The Combined dataset has %s rows and %s columns"
       %(combine_data.shape[0],combine_data.shape[1]))
-
-df_sp = pd.DataFrame(house_train.SalePrice.describe()).T
-df_sp['Skew'] = round(house_train.SalePrice.skew(),2)
-df_sp['Kurtosis'] = round(house_train.SalePrice.kurt(),2)
+print("The Combined dataset takes %.0f bytes per row"
+      % bytes_per_row(combine_data))
+
+with stage('describe SalePrice', rows_in=house_train):
+    if SKETCH_MODE:
+        # Mergeable quantile and moment sketches, see sketches.py for the bounds
+        df_sp = sketch_describe(house_train.SalePrice, name='SalePrice')
+    else:
+        df_sp = pd.DataFrame(house_train.SalePrice.describe()).T
+        df_sp['Skew'] = round(house_train.SalePrice.skew(),2)
+        df_sp['Kurtosis'] = round(house_train.SalePrice.kurt(),2)
 round(df_sp,2)
 
 
@@ -74,9 +122,13 @@ We will be checking:<br>
 diagonal that represents the normal distribution.
 """
 
-plotting_3_charts(house_train, 'SalePrice', 
-                  cap="Fig 1. Histogram and normal probability plot",
-                  filename = "SalePrice_Normality.png")
+# Every figure is a self-contained plot job with its own style, rendered in
+# parallel at the end of the script
+jobs = []
+jobs.append(plot_job(
+        normality_plot, "SalePrice_Normality.png", house_train[['SalePrice']],
+        feature='SalePrice',
+        cap="Fig 1. Histogram and normal probability plot"))
 
 """
 Ok, 'SalePrice' is not normal. It shows 'peakedness', positive skewness and 
@@ -94,13 +146,17 @@ print("Kurtosis: %.2f" % house_train['SalePrice'].kurt())
 
 # Applying Log Transformation
 house_train['SalePrice'] = np.log(house_train['SalePrice'])
-plotting_3_charts(house_train, 'SalePrice', 
-                  cap="Fig 2. Transformed Histogram and normal probability plot",
-                  filename = "Transformed_SalePrice_Normality.png")
+jobs.append(plot_job(
+        normality_plot, "Transformed_SalePrice_Normality.png",
+        house_train[['SalePrice']], feature='SalePrice',
+        cap="Fig 2. Transformed Histogram and normal probability plot"))
 
 # Check Skewness and Kurtosis
 print("Skewness: %.2f" % house_train['SalePrice'].skew())
 print("Kurtosis: %.2f" % house_train['SalePrice'].kurt())
+# Normality tests of the transformed Sale Price; Shapiro-Wilk and
+# Anderson-Darling run on a subsample when there are many sales
+print(normality_table(normality_summary(house_train, 'SalePrice')).T)
 
 df_num = house_train._get_numeric_data()
 df_mis = pd.DataFrame(df_num.isnull().sum(), columns=['Count']).reset_index()
@@ -111,20 +167,14 @@ df_mis[df_mis.Count != 0]
 Relationship between Target variable and Other variable
    Sale Price vs Lot Frontage, MasVnrArea and GarageYrBlt
 """
-figtext_args, figtext_kwargs = add_fignum("Fig 3. Sale Price vs Garage, MasVnr and Garage year built")
-fig = plt.figure(figsize=(15,5))
-fig.subplots_adjust(hspace = 1, wspace = 1)
-ax = fig.add_subplot(1,3,1)
-sns.scatterplot(x="SalePrice", y="LotFrontage", data=house_train, ax=ax, color = 'red')
-plt.title("Sale Price vs LotFrontage")
-ax = fig.add_subplot(1,3,2)
-sns.scatterplot(x="SalePrice", y="MasVnrArea", data=house_train, ax=ax, color = 'green')
-plt.title("Sale Price vs MasVnrArea")
-ax = fig.add_subplot(1,3,3)
-sns.scatterplot(x="SalePrice", y="GarageYrBlt", data=house_train, ax=ax, color = 'blue')
-plt.title("Sale Price vs Garage Built Year")
-plt.figtext(*figtext_args,**figtext_kwargs)
-plt.savefig("Fig_2.png")
+jobs.append(plot_job(
+        scatter_grid, "Fig_2.png",
+        house_train[['SalePrice', 'LotFrontage', 'MasVnrArea', 'GarageYrBlt']],
+        sns_style='whitegrid', ys=['LotFrontage', 'MasVnrArea', 'GarageYrBlt'],
+        titles=["Sale Price vs LotFrontage", "Sale Price vs MasVnrArea",
+                "Sale Price vs Garage Built Year"],
+        colors=['red', 'green', 'blue'],
+        caption="Fig 3. Sale Price vs Garage, MasVnr and Garage year built"))
 
 """
 From the three numerical variable that has missing values, we checked the 
@@ -134,7 +184,12 @@ can safely remove these columns from our dataset instead of handling missing
 values.
 """
 
-plot_missing_data(i=4, df=combine_data, figname = "missing_percent_1.png")
+# The plot is drawn from the missing-value table computed here
+with stage('missing', rows_in=combine_data):
+    missing_data = missing(combine_data)
+jobs.append(plot_job(
+        missing_plot, "missing_percent_1.png", missing_data,
+        sns_style='whitegrid', i=4))
 
 """
 Let's analyse this to understand how to handle the missing data
@@ -166,19 +221,18 @@ data, except the variable 'Electrical'. In 'Electrical' we'll just delete the
 observation with missing data.
 """
 
-def drop_col(cols, df):
-    df.drop(columns=cols, inplace=True)
-
 cols = ['PoolQC', 'MiscFeature', 'Alley', 
         'Fence', 'FireplaceQu', 'LotFrontage', 'GarageYrBlt']
-# Drop columns from combined data
-drop_col(cols, df=combine_data)
-# Drop columns from train data
-drop_col(cols, df=house_train)
-# Drop columns from test data
-drop_col(cols, df=house_test)
+# Drop columns from combined data. Train and test data are cleaned in one go
+# at the end by the fitted cleaner.
+combine_data.drop(columns=cols, inplace=True)
 
-plot_missing_data(i = 5, df=combine_data, figname = "missing_percent_2.png")
+# The plot is drawn from the missing-value table computed here
+with stage('missing', rows_in=combine_data):
+    missing_data = missing(combine_data)
+jobs.append(plot_job(
+        missing_plot, "missing_percent_2.png", missing_data,
+        sns_style='whitegrid', i=5))
 
 """
 #### Let's Explore the relationship of Variables with missing values with 
@@ -186,22 +240,13 @@ plot_missing_data(i = 5, df=combine_data, figname = "missing_percent_2.png")
 ##### GarageX Variables
 """
 
-figtext_args, figtext_kwargs = add_fignum("Fig 6. Sale Price vs GarageX variable")
-fig = plt.figure(figsize=(15,10))
-fig.subplots_adjust(hspace = 1, wspace = 1)
-ax = fig.add_subplot(2,2,1)
-sns.boxplot(x="GarageQual", y='SalePrice', data=house_train, ax=ax)
-plt.title("Sale Price Vs Garage Quality")
-ax = fig.add_subplot(2,2,2)
-sns.boxplot(x="GarageType", y='SalePrice', data=house_train, ax=ax)
-plt.title("Sale Price Vs Garage Type")
-ax = fig.add_subplot(2,2,3)
-sns.boxplot(x="GarageFinish", y='SalePrice', data=house_train, ax=ax)
-plt.title("Sale Price Vs Garage Finish")
-ax = fig.add_subplot(2,2,4)
-sns.boxplot(x="GarageCond", y='SalePrice', data=house_train, ax=ax)
-plt.title("Sale Price Vs Garage Condition")
-plt.figtext(*figtext_args, **figtext_kwargs)
+cols = ['GarageQual', 'GarageType', 'GarageFinish', 'GarageCond']
+jobs.append(plot_job(
+        box_grid, "GarageX.png", house_train[cols + ['SalePrice']],
+        sns_style='whitegrid', xs=cols, nrows=2, ncols=2,
+        titles=["Sale Price Vs Garage Quality", "Sale Price Vs Garage Type",
+                "Sale Price Vs Garage Finish", "Sale Price Vs Garage Condition"],
+        caption="Fig 6. Sale Price vs GarageX variable"))
 
 """
 After exploring the four garage variables, it seems that the garage X's 
@@ -212,32 +257,19 @@ drop these variable when doing the modelling for Price prediction.
 
 cols = ['GarageQual', 'GarageType', 'GarageFinish', 'GarageCond']
 # Drop columns from combined data
-drop_col(cols, df=combine_data)
-# Drop columns from train data
-drop_col(cols, df=house_train)
-# Drop columns from test data
-drop_col(cols, df=house_test)
+combine_data.drop(columns=cols, inplace=True)
 
 # BasementX Variables
-figtext_args, figtext_kwargs = add_fignum("Fig 7. Sale Price vs BasementX Variables")
-fig = plt.figure(figsize=(15,10))
-fig.subplots_adjust(hspace = 1, wspace = 1)
-ax = fig.add_subplot(2,3,1)
-sns.boxplot(x='BsmtFinType2', y='SalePrice', data=house_train, ax = ax)
-plt.title("Sale Price Vs Basement Finish Type 2")
-ax = fig.add_subplot(2,3,2)
-sns.boxplot(x = 'BsmtExposure', y = 'SalePrice', data=house_train, ax = ax)
-plt.title("Sale Price vs Basement Exposure")
-ax = fig.add_subplot(2,3,3)
-sns.boxplot(x = 'BsmtFinType1', y = 'SalePrice', data=house_train, ax=ax)
-plt.title("Sale Price vs Basement Finish Type 1")
-ax = fig.add_subplot(2,3,4)
-sns.boxplot(x = 'BsmtCond', y = 'SalePrice', data=house_train, ax=ax)
-plt.title("Sale Price vs Basement Condition")
-ax = fig.add_subplot(2,3,5)
-sns.boxplot(x = 'BsmtQual', y = 'SalePrice', data=house_train, ax=ax)
-plt.title("Sale Price vs Basement Quality")
-plt.figtext(*figtext_args, **figtext_kwargs)
+cols = ['BsmtFinType2', 'BsmtExposure', 'BsmtFinType1', 'BsmtCond', 'BsmtQual']
+jobs.append(plot_job(
+        box_grid, "BasementX.png", house_train[cols + ['SalePrice']],
+        sns_style='whitegrid', xs=cols, nrows=2, ncols=3,
+        titles=["Sale Price Vs Basement Finish Type 2",
+                "Sale Price vs Basement Exposure",
+                "Sale Price vs Basement Finish Type 1",
+                "Sale Price vs Basement Condition",
+                "Sale Price vs Basement Quality"],
+        caption="Fig 7. Sale Price vs BasementX Variables"))
 
 """
 After exploring the five Basement variables, it seems that the Basement X's 
@@ -249,30 +281,76 @@ drop these variable when doing the modelling for Price prediction.
 cols = ['BsmtQual', 'BsmtCond', 'BsmtFinType1', 
         'BsmtFinType2', 'BsmtExposure']
 # Drop columns from combined data
-drop_col(cols, df=combine_data)
-# Drop columns from train data
-drop_col(cols, df=house_train)
-# Drop columns from test data
-drop_col(cols, df=house_test)
-
-plot_missing_data(i=7, df=combine_data, figname = "missing_percent_3.png")
+combine_data.drop(columns=cols, inplace=True)
 
-cols = ['MasVnrType','MSZoning', 'BsmtFullBath', 'Functional', 'Utilities', 
-        'BsmtHalfBath', 'Exterior1st', 'KitchenQual','GarageCars','GarageArea',
-        'TotalBsmtSF', 'SaleType', 'BsmtUnfSF','BsmtFinSF2','BsmtFinSF1',
-        'Exterior2nd', 'MasVnrArea', 'Electrical']
+# The plot is drawn from the missing-value table computed here
+with stage('missing', rows_in=combine_data):
+    missing_data = missing(combine_data)
+jobs.append(plot_job(
+        missing_plot, "missing_percent_3.png", missing_data,
+        sns_style='whitegrid', i=7))
 
-# Define a function to replace the missing value with mode in all the column with missing values
-def handle_missing(col):
-    combine_data[col] = combine_data[col].fillna(combine_data[col].mode()[0])
-    house_train[col]  = house_train[col].fillna(house_train[col].mode()[0])
-    house_test[col]   = house_test[col].fillna(house_test[col].mode()[0])
-
-for value in cols:
-    handle_missing(value)
-
-if missing(df=combine_data).empty:
-    print('No More Columns with missing values')
-
-house_train.to_csv("Cleaned_train.csv", index=False, header=True)
-house_test.to_csv("Cleaned_test.csv", index=False, header=True)
\ No newline at end of file
+"""
+The remaining variables have only a handful of missing values, which we replace
+with the mode. The cleaner learns the drop list above and the mode of every
+column once from the training data, and then cleans the test data (or any new
+listing) with those same values.
+"""
+def clean_stage():
+    with stage('fit_cleaner', rows_in=house_train):
+        cleaner = fit_cleaner(house_train)
+    with stage('apply_cleaner', rows_in=len(house_train) + len(house_test)):
+        return (cleaner, apply_cleaner(cleaner, house_train),
+                apply_cleaner(cleaner, house_test))
+
+# Reuse the cleaned frames if the raw data, the rules and the code are the
+# same. The key covers the whole cleaning module (and the sketches its scans
+# use), so editing any helper of the cleaner invalidates it.
+raw_train = house_train
+with stage('clean', rows_in=len(house_train) + len(house_test)) as s:
+    cleaner, house_train, house_test = cached_stage(
+            "clean", clean_stage, inputs=[house_train, house_test],
+            params={'threshold': MISSING_THRESHOLD, 'drop_cols': DROP_COLS},
+            depends=[cleaning, sketches])
+    save_cleaner(cleaner, "cleaner.json")
+    s['rows_out'] = len(house_train) + len(house_test)
+
+with stage('missing', rows_in=len(house_train) + len(house_test)):
+    if missing(df=house_train).empty and missing(df=house_test).empty:
+        print('No More Columns with missing values')
+
+# Write the cleaned data as typed columnar files, plus an optional CSV export
+with stage('write_cleaned', rows_in=len(house_train) + len(house_test)):
+    write_cleaned(house_train, "Cleaned_train.feather")
+    write_cleaned(house_test, "Cleaned_test.feather")
+    if EXPORT_CSV:
+        write_cleaned(house_train, "Cleaned_train.csv")
+        write_cleaned(house_test, "Cleaned_test.csv")
+
+# The feature index shared by model training, test scoring and the
+# prediction service: quality grades, derived features and category codes
+with stage('features', rows_in=house_train):
+    save_index(build_index(house_train), "features.json")
+
+# Per-neighborhood price statistics and comparable-sales trees; after a
+# refresh, neighborhood_index.py update adds the appended sales
+with stage('neighborhoods', rows_in=house_train):
+    save_neighborhoods(build_neighborhoods(house_train), "neighborhoods.pkl")
+
+# Reference profile of the raw training data that drift.py checks incoming
+# batches against
+with stage('drift_profile', rows_in=raw_train):
+    save_profile(build_profile(raw_train, cleaner), "drift_profile.json")
+
+# State for the daily refreshes of refresh.py, which append new sales to the
+# files above: the cleaner with the counts behind it, the correlation
+# statistics of the cleaned training data and the shards read here
+with stage('refresh_state', rows_in=raw_train):
+    save_state(new_state(raw_train, cleaner,
+                         corr_stats(house_train.select_dtypes(
+                                 include=np.number)),
+                         train_paths, test_paths))
+
+if __name__ == '__main__':
+    with stage('render_jobs', rows_in=len(jobs)):
+        render_jobs(jobs)
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+Drift and data-quality monitor for incoming listings.
+
+The cleaning rules (the drop list and the mode fills of cleaning.py) were
+chosen from one snapshot of missingness. This module keeps a compact
+reference profile of the raw training data and scores every incoming batch
+against it, so that a feed that changes is noticed before the rules and the
+predictions go wrong.
+
+The profile, saved as JSON, holds per column the number of missing values
+and either
+- for numbers, bin edges at the percentiles of the training values and the
+  training count in each bin, or
+- for text, the training categories and their counts.
+
+A batch is reduced to the same counts in one pass over each column: a
+searchsorted into the bin edges or a lookup of the category codes. Counts
+add up, so a file is checked chunk by chunk. The report then compares the
+counts per column:
+- psi: population stability index over the deciles (numbers) or the
+  categories plus one bucket for unseen values (text),
+- ks: Kolmogorov-Smirnov distance between the training and batch CDFs at
+  the percentile edges (numbers),
+- unseen_rate: the share of non-missing text values absent from training,
+- invalid_rate: the share of values of a numerical column that are not
+  numbers,
+- the missing percentage before and after.
+
+It also lists what the batch changes in the cleaning rules: columns whose
+missing percentage crosses the drop threshold, text columns whose mode is no
+longer the fill value, and columns added to or missing from the feed.
+
+Usage:
+    python drift.py build --data Data/train.csv --cleaner cleaner.json
+    python drift.py check "Data/daily/train_*.csv" --out drift.json
+writes the report of the new shards and exits with status 1 when a column
+drifted or a cleaning rule is affected.
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from cleaning import (CHUNKSIZE, DROP_COLS, ID_COL, MISSING_THRESHOLD,
+                      TARGET, iter_chunks)
+from ingest import find_shards
+from sketches import reduce_counts
+
+PROFILE_FILE = 'drift_profile.json'
+# Percentiles of the training values used as bin edges; the PSI of numbers
+# is computed over every tenth of them (the deciles)
+KS_POINTS = 100
+PSI_STEP = 10
+# Usual PSI rule of thumb: below 0.1 stable, above 0.25 a significant shift
+PSI_WARN = 0.1
+PSI_DRIFT = 0.25
+KS_DRIFT = 0.1
+UNSEEN_DRIFT = 0.01
+# Empty bins are given this share so the PSI stays finite
+EPSILON = 1e-4
+# Unseen values counted per column, with the Misra-Gries bound of sketches.py
+TOP_UNSEEN = 100
+
+
+# The reference profile of a raw training frame. With a fitted cleaner, its
+# drop list and fill values are kept to check the rules against batches.
+def build_profile(df, cleaner=None, ks_points=KS_POINTS):
+    columns = {}
+    for col in df.columns:
+        if col in (ID_COL, TARGET):
+            continue
+        values = df[col]
+        if pd.api.types.is_numeric_dtype(values):
+            x = values.to_numpy(dtype=np.float64)
+            x = x[~np.isnan(x)]
+            grid = (np.quantile(x, np.linspace(0, 1, ks_points + 1))
+                    if len(x) else np.empty(0))
+            edges = np.unique(grid[1:-1])
+            deciles = np.unique(grid[PSI_STEP:-1:PSI_STEP])
+            starts = [0] + list(np.searchsorted(edges, deciles) + 1)
+            columns[col] = {'kind': 'numeric', 'edges': edges.tolist(),
+                            'psi_starts': [int(s) for s in starts]}
+        else:
+            categories = sorted(values.dropna().astype(str).unique())
+            columns[col] = {'kind': 'categorical', 'categories': categories}
+    profile = {'threshold': MISSING_THRESHOLD, 'columns': columns,
+               'drop': list(cleaner['drop']) if cleaner else [],
+               'fill': dict(cleaner['fill']) if cleaner else {}}
+    reference = update_counts(new_counts(profile), profile, df)
+    profile['rows'] = reference['rows']
+    for col, counts in reference['columns'].items():
+        columns[col]['nulls'] = counts['nulls']
+        columns[col]['counts'] = counts['counts'].tolist()
+    return profile
+
+
+def save_profile(profile, path=PROFILE_FILE):
+    with open(path, 'w') as f:
+        json.dump(profile, f)
+
+
+def load_profile(path=PROFILE_FILE):
+    with open(path) as f:
+        return json.load(f)
+
+
+# Empty counts of a batch, to be filled chunk by chunk with update_counts()
+def new_counts(profile):
+    columns = {}
+    for col, ref in profile['columns'].items():
+        if ref['kind'] == 'numeric':
+            columns[col] = {'nulls': 0, 'invalid': 0,
+                            'counts': np.zeros(len(ref['edges']) + 1,
+                                               dtype=np.int64)}
+        else:
+            columns[col] = {'nulls': 0, 'unseen': 0,
+                            'unseen_values': pd.Series(dtype=np.int64),
+                            'counts': np.zeros(len(ref['categories']),
+                                               dtype=np.int64)}
+    return {'rows': 0, 'columns': columns, 'seen': set()}
+
+
+def _update_numeric(counts, ref, values):
+    if pd.api.types.is_numeric_dtype(values):
+        x = values.to_numpy(dtype=np.float64)
+        invalid = 0
+    else:
+        x = pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64)
+        invalid = int((np.isnan(x) & values.notna().to_numpy()).sum())
+    null = np.isnan(x)
+    bins = np.searchsorted(ref['edges'], x[~null], side='right')
+    counts['counts'] += np.bincount(bins, minlength=len(counts['counts']))
+    counts['nulls'] += int(null.sum()) - invalid
+    counts['invalid'] += invalid
+
+
+# The column is factorized once; only its distinct values are looked up in
+# the training categories
+def _update_categorical(counts, ref, values):
+    codes, uniques = pd.factorize(values)
+    per_value = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    uniques = pd.Index(uniques).astype(str)
+    remap = pd.Index(ref['categories']).get_indexer(uniques)
+    known = remap >= 0
+    counts['counts'] += np.bincount(remap[known], weights=per_value[known],
+                                    minlength=len(counts['counts'])
+                                    ).astype(np.int64)
+    counts['nulls'] += int((codes < 0).sum())
+    if not known.all():
+        unseen = pd.Series(per_value[~known], index=uniques[~known])
+        counts['unseen'] += int(unseen.sum())
+        counts['unseen_values'] = reduce_counts(
+                counts['unseen_values'].add(unseen, fill_value=0),
+                TOP_UNSEEN)
+
+
+# Add one chunk of a batch to its counts, one pass over each column
+def update_counts(counts, profile, chunk):
+    for col, ref in profile['columns'].items():
+        if col not in chunk.columns:
+            continue
+        if ref['kind'] == 'numeric':
+            _update_numeric(counts['columns'][col], ref, chunk[col])
+        else:
+            _update_categorical(counts['columns'][col], ref, chunk[col])
+    counts['seen'].update(chunk.columns)
+    counts['rows'] += len(chunk)
+    return counts
+
+
+# Population stability index between two count vectors
+def psi(expected, actual, eps=EPSILON):
+    p = np.maximum(np.asarray(expected) / max(np.sum(expected), 1), eps)
+    q = np.maximum(np.asarray(actual) / max(np.sum(actual), 1), eps)
+    return float(np.sum((q - p) * np.log(q / p)))
+
+
+# Largest gap between the CDFs of two count vectors over the same bins
+def ks_distance(expected, actual):
+    p = np.cumsum(expected) / max(np.sum(expected), 1)
+    q = np.cumsum(actual) / max(np.sum(actual), 1)
+    return float(np.max(np.abs(p - q)))
+
+
+def _status(metrics):
+    if (metrics['psi'] >= PSI_DRIFT
+            or metrics.get('ks', 0) >= KS_DRIFT
+            or metrics.get('unseen_rate', 0) >= UNSEEN_DRIFT
+            or metrics.get('invalid_rate', 0) >= UNSEEN_DRIFT):
+        return 'drift'
+    return 'warn' if metrics['psi'] >= PSI_WARN else 'ok'
+
+
+def _column_report(ref, counts, ref_rows, rows):
+    expected = np.asarray(ref['counts'])
+    actual = counts['counts']
+    metrics = {'missing_before': 100 * ref['nulls'] / max(ref_rows, 1),
+               'missing_after': 100 * counts['nulls'] / max(rows, 1)}
+    if ref['kind'] == 'numeric':
+        starts = ref['psi_starts']
+        metrics['psi'] = psi(np.add.reduceat(expected, starts),
+                             np.add.reduceat(actual, starts))
+        metrics['ks'] = ks_distance(expected, actual)
+        valid = rows - counts['nulls']
+        metrics['invalid_rate'] = float(counts['invalid'] / max(valid, 1))
+    else:
+        seen = actual.sum() + counts['unseen']
+        metrics['psi'] = psi(np.append(expected, 0),
+                             np.append(actual, counts['unseen']))
+        metrics['unseen_rate'] = float(counts['unseen'] / max(seen, 1))
+        top = counts['unseen_values'].sort_values(ascending=False)
+        metrics['unseen_values'] = [str(v) for v in top.index[:10]]
+    metrics['status'] = _status(metrics)
+    return metrics
+
+
+# What the batch changes in the cleaning rules: missing percentages that
+# cross the drop threshold (columns dropped by judgement aside), text
+# columns filled with a value that is no longer their mode, and columns
+# added to or missing from the feed
+def _rules(profile, counts, columns):
+    threshold = profile['threshold']
+    crossings, modes = [], []
+    for col, metrics in columns.items():
+        was = metrics['missing_before'] > threshold
+        now = metrics['missing_after'] > threshold
+        # Columns dropped by judgement stay dropped whatever their count,
+        # and a crossing the cleaner already agrees with changes nothing
+        if was == now or col in DROP_COLS or (
+                profile['drop'] and (col in profile['drop']) == now):
+            continue
+        crossings.append({'column': col,
+                          'before': metrics['missing_before'],
+                          'after': metrics['missing_after'],
+                          'action': 'drop' if now else 'keep'})
+    for col, value in profile['fill'].items():
+        ref = profile['columns'].get(col)
+        if ref is None or ref['kind'] != 'categorical' \
+                or col not in counts['seen'] \
+                or not counts['columns'][col]['nulls']:
+            continue
+        actual = counts['columns'][col]['counts']
+        if actual.any():
+            mode = ref['categories'][int(np.argmax(actual))]
+            if mode != str(value):
+                modes.append({'column': col, 'fill': value, 'mode': mode})
+    known = set(profile['columns']) | {ID_COL, TARGET}
+    return {'crossings': crossings, 'mode_changes': modes,
+            'columns': {'added': sorted(counts['seen'] - known),
+                        'missing': sorted(c for c in profile['columns']
+                                          if c not in counts['seen'])}}
+
+
+# The machine-readable report of a batch against the reference profile
+def drift_report(profile, counts):
+    columns = {col: _column_report(ref, counts['columns'][col],
+                                   profile['rows'], counts['rows'])
+               for col, ref in profile['columns'].items()
+               if col in counts['seen']}
+    rules = _rules(profile, counts, columns)
+    drifted = [col for col, m in columns.items() if m['status'] == 'drift']
+    return {'reference_rows': profile['rows'], 'rows': counts['rows'],
+            'drifted': drifted,
+            'warned': [col for col, m in columns.items()
+                       if m['status'] == 'warn'],
+            'rules': rules,
+            'alert': bool(drifted or rules['crossings']
+                          or rules['mode_changes']
+                          or rules['columns']['added']
+                          or rules['columns']['missing']),
+            'columns': columns}
+
+
+# Check a frame, or the chunks of a list of csv files, against the profile
+def check(profile, data, chunksize=CHUNKSIZE):
+    counts = new_counts(profile)
+    if isinstance(data, pd.DataFrame):
+        update_counts(counts, profile, data)
+    else:
+        for path in data:
+            for chunk in iter_chunks(path, chunksize):
+                update_counts(counts, profile, chunk)
+    return drift_report(profile, counts)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check incoming listings "
+                                                 "for drift")
+    sub = parser.add_subparsers(dest='command')
+    build = sub.add_parser('build')
+    build.add_argument('--data', default='Data/train.csv')
+    build.add_argument('--cleaner', help="cleaner.json of the training data")
+    build.add_argument('--out', default=PROFILE_FILE)
+    run = sub.add_parser('check')
+    run.add_argument('data', help="directory, glob pattern or csv file of "
+                                  "the incoming batch")
+    run.add_argument('--profile', default=PROFILE_FILE)
+    run.add_argument('--out', help="write the JSON report here")
+    run.add_argument('--chunksize', type=int, default=CHUNKSIZE)
+    args = parser.parse_args()
+    if args.command == 'build':
+        from cleaning import load_cleaner
+
+        cleaner = load_cleaner(args.cleaner) if args.cleaner else None
+        save_profile(build_profile(pd.read_csv(args.data), cleaner),
+                     args.out)
+    elif args.command == 'check':
+        start = time.perf_counter()
+        report = check(load_profile(args.profile),
+                       find_shards(args.data, '*.csv'), args.chunksize)
+        report['seconds'] = time.perf_counter() - start
+        text = json.dumps(report, indent=1)
+        if args.out:
+            with open(args.out, 'w') as f:
+                f.write(text)
+        else:
+            print(text)
+        sys.exit(1 if report['alert'] else 0)
+    else:
+        parser.print_help()
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Compact dtype planner for the Ames csv files.
+
+pd.read_csv loads every number as int64 or float64 and every text column as
+a column of Python strings. The planner scans the files once, chunk by chunk,
+and infers a schema: the smallest integer type that holds each integer column
+(int8 for OverallQual, FullBath, MoSold, int16 for YrSold), float32 for the
+numbers with missing values when float32 holds them exactly, and a
+categorical with a fixed, sorted category set for the text columns. Planning
+train and test together gives both the same categories, so their codes agree
+and pd.concat keeps the categoricals.
+
+The schema is a plain dict stored as JSON and is applied at parse time with
+read_csv(dtype=...), so the wide int64/object frame is never built.
+
+Usage:
+    python dtype_plan.py train.csv test.csv --schema schema.json
+plans the schema, saves it and reports bytes per row before and after.
+"""
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from cleaning import CHUNKSIZE, iter_chunks
+
+# Text columns with more distinct values than this stay plain strings
+MAX_CATEGORIES = 1000
+INT_DTYPES = ('int8', 'int16', 'int32', 'int64')
+
+
+# An empty plan to be filled with update_plan()
+def new_plan():
+    return {}
+
+
+def _kind(series):
+    if pd.api.types.is_bool_dtype(series):
+        return 'bool'
+    if pd.api.types.is_integer_dtype(series):
+        return 'int'
+    if pd.api.types.is_float_dtype(series):
+        return 'float'
+    return 'text'
+
+
+# Merge the kinds seen in two chunks. A chunk where a text column is entirely
+# empty is read as float, so an all-null chunk says nothing about the kind.
+def _merge_kind(entry, kind, all_null):
+    if all_null:
+        return entry['kind']
+    if entry['kind'] in (None, kind):
+        return kind
+    if {entry['kind'], kind} == {'int', 'float'}:
+        return 'float'
+    return 'text'
+
+
+# Add one chunk to a plan: per column the kind, null count, value range,
+# whether float32 holds the values exactly and the distinct text values
+def update_plan(plan, chunk, max_categories=MAX_CATEGORIES):
+    for col in chunk.columns:
+        series = chunk[col]
+        entry = plan.setdefault(col, {'kind': None, 'nulls': 0, 'min': None,
+                                      'max': None, 'exact32': True,
+                                      'values': set()})
+        isnull = series.isna().to_numpy()
+        entry['nulls'] += int(isnull.sum())
+        entry['kind'] = _merge_kind(entry, _kind(series), isnull.all())
+        values = series.to_numpy()[~isnull]
+        if entry['values'] is not None and not pd.api.types.is_numeric_dtype(
+                series):
+            entry['values'].update(str(v) for v in pd.unique(values))
+            if len(entry['values']) > max_categories:
+                entry['values'] = None
+        elif len(values) and _kind(series) in ('int', 'float'):
+            values = values.astype(np.float64)
+            lo, hi = values.min(), values.max()
+            entry['min'] = lo if entry['min'] is None else min(entry['min'],
+                                                               lo)
+            entry['max'] = hi if entry['max'] is None else max(entry['max'],
+                                                               hi)
+            entry['exact32'] &= bool(np.array_equal(
+                    values.astype(np.float32).astype(np.float64), values))
+    return plan
+
+
+# Combine the plans of two partitions, e.g. of two files planned in parallel
+def merge_plans(left, right, max_categories=MAX_CATEGORIES):
+    plan = {col: dict(entry) for col, entry in left.items()}
+    for col, other in right.items():
+        if col not in plan:
+            plan[col] = dict(other)
+            continue
+        entry = plan[col]
+        entry['kind'] = _merge_kind(entry, other['kind'],
+                                    other['kind'] is None)
+        entry['nulls'] += other['nulls']
+        for key, pick in (('min', min), ('max', max)):
+            values = [v for v in (entry[key], other[key]) if v is not None]
+            entry[key] = pick(values) if values else None
+        entry['exact32'] = entry['exact32'] and other['exact32']
+        if entry['values'] is None or other['values'] is None:
+            entry['values'] = None
+        else:
+            entry['values'] = entry['values'] | other['values']
+            if len(entry['values']) > max_categories:
+                entry['values'] = None
+    return plan
+
+
+def _int_dtype(lo, hi):
+    for dtype in INT_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return dtype
+    return 'int64'
+
+
+# Turn a plan into a schema: {column: {'dtype': ..., 'categories': [...]}}
+def plan_schema(plan):
+    schema = {}
+    for col, entry in plan.items():
+        kind = entry['kind']
+        if kind == 'text' and entry['values'] is not None:
+            schema[col] = {'dtype': 'category',
+                           'categories': sorted(entry['values'])}
+        elif kind == 'text':
+            schema[col] = {'dtype': 'object'}
+        elif kind == 'bool':
+            schema[col] = {'dtype': 'bool'}
+        elif kind == 'int' and entry['nulls'] == 0:
+            schema[col] = {'dtype': _int_dtype(entry['min'], entry['max'])}
+        elif kind is None:
+            # Entirely empty column
+            schema[col] = {'dtype': 'float32'}
+        else:
+            schema[col] = {'dtype': 'float32' if entry['exact32']
+                           else 'float64'}
+    return schema
+
+
+# Widen a schema so it also holds the columns of another, e.g. the schema of
+# rows appended to a file: category lists are joined, integers widened and
+# mixed numbers become float64
+def merge_schemas(left, right):
+    schema = dict(left)
+    for col, entry in right.items():
+        old = schema.get(col)
+        if old is None or old == entry:
+            schema[col] = entry
+            continue
+        dtypes = {old['dtype'], entry['dtype']}
+        if dtypes == {'category'}:
+            schema[col] = {'dtype': 'category',
+                           'categories': sorted(set(old['categories'])
+                                                | set(entry['categories']))}
+        elif dtypes <= set(INT_DTYPES):
+            schema[col] = {'dtype': max(dtypes, key=INT_DTYPES.index)}
+        elif dtypes <= set(INT_DTYPES) | {'float32', 'float64'}:
+            schema[col] = {'dtype': 'float64'}
+        else:
+            schema[col] = {'dtype': 'object'}
+    return schema
+
+
+# Plan the schema of one or more csv files read chunk by chunk
+def infer_schema(paths, chunksize=CHUNKSIZE, max_categories=MAX_CATEGORIES):
+    if isinstance(paths, str):
+        paths = [paths]
+    plan = new_plan()
+    for path in paths:
+        for chunk in iter_chunks(path, chunksize):
+            update_plan(plan, chunk, max_categories)
+    return plan_schema(plan)
+
+
+# Plan the schema of frames already in memory
+def schema_from_frame(*frames, max_categories=MAX_CATEGORIES):
+    plan = new_plan()
+    for df in frames:
+        update_plan(plan, df, max_categories)
+    return plan_schema(plan)
+
+
+# The schema as the dtype argument of read_csv
+def read_dtypes(schema):
+    dtypes = {}
+    for col, entry in schema.items():
+        if entry['dtype'] == 'category':
+            dtypes[col] = pd.CategoricalDtype(entry['categories'])
+        else:
+            dtypes[col] = entry['dtype']
+    return dtypes
+
+
+# Read a csv file with the schema applied while parsing. Text values outside
+# a column's categories are read as missing values.
+def read_planned(path, schema, **kwargs):
+    return pd.read_csv(path, dtype=read_dtypes(schema), **kwargs)
+
+
+def save_schema(schema, path):
+    with open(path, 'w') as f:
+        json.dump(schema, f, indent=1)
+
+
+def load_schema(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def bytes_per_row(df):
+    return df.memory_usage(deep=True).sum() / max(len(df), 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Plan compact dtypes for "
+                                                 "csv files")
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--schema', default='schema.json')
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE)
+    parser.add_argument('--max-categories', type=int, default=MAX_CATEGORIES)
+    args = parser.parse_args()
+    schema = infer_schema(args.files, args.chunksize, args.max_categories)
+    save_schema(schema, args.schema)
+    before, after = [], []
+    for path in args.files:
+        before.append(pd.read_csv(path))
+        after.append(read_planned(path, schema))
+        print("%s: %.0f -> %.0f bytes per row"
+              % (path, bytes_per_row(before[-1]), bytes_per_row(after[-1])))
+    old = bytes_per_row(pd.concat(before, ignore_index=True))
+    new = bytes_per_row(pd.concat(after, ignore_index=True))
+    print("Combined: %.0f -> %.0f bytes per row (%.1fx smaller)"
+          % (old, new, old / new))
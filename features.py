@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Feature engineering for the SalePrice models.
+
+The feature index is built once from the cleaned training data and saved as
+JSON next to cleaner.json. It lists the columns of the model matrix and how
+each one is computed:
+
+- numbers as they are,
+- quality scales (ExterQual, KitchenQual, ...) as ordinal numbers, with 0
+  for a missing or unrecognised grade,
+- derived features: total square footage, house and remodelling age at the
+  sale, and total bathrooms,
+- the other text columns as integer codes against the sorted training
+  categories, with -1 as the bucket for categories unseen in training.
+
+encode() fills a dense float32 matrix column by column: the numbers and
+ordinal grades first, then the derived features computed from the matrix
+columns with whole-column NumPy operations, then the category codes. The
+training data, the test data (model.py) and live listings (serve.py) are
+all encoded against the same index.
+
+Usage:
+    python features.py --data Cleaned_train --out features.json
+"""
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from cleaning import ID_COL, TARGET
+
+FEATURES_FILE = 'features.json'
+# Code of a category unseen in training
+UNKNOWN = -1
+
+_GRADES = {'Po': 1, 'Fa': 2, 'TA': 3, 'Gd': 4, 'Ex': 5}
+_FINISH = {'Unf': 1, 'LwQ': 2, 'Rec': 3, 'BLQ': 4, 'ALQ': 5, 'GLQ': 6}
+# Ordered grades of the quality columns, from the data description; a
+# missing grade (no basement, no garage, ...) is 0
+QUALITY_SCALES = {
+    'ExterQual': _GRADES, 'ExterCond': _GRADES, 'BsmtQual': _GRADES,
+    'BsmtCond': _GRADES, 'HeatingQC': _GRADES, 'KitchenQual': _GRADES,
+    'FireplaceQu': _GRADES, 'GarageQual': _GRADES, 'GarageCond': _GRADES,
+    'PoolQC': _GRADES,
+    'BsmtExposure': {'No': 1, 'Mn': 2, 'Av': 3, 'Gd': 4},
+    'BsmtFinType1': _FINISH, 'BsmtFinType2': _FINISH,
+    'GarageFinish': {'Unf': 1, 'RFn': 2, 'Fin': 3},
+    'Functional': {'Sal': 1, 'Sev': 2, 'Maj2': 3, 'Maj1': 4, 'Mod': 5,
+                   'Min2': 6, 'Min1': 7, 'Typ': 8},
+}
+# Derived features: the columns they are computed from and the function of
+# those columns
+DERIVED = {
+    'TotalSF': (('TotalBsmtSF', '1stFlrSF', '2ndFlrSF'),
+                lambda bsmt, first, second: bsmt + first + second),
+    'HouseAge': (('YrSold', 'YearBuilt'), np.subtract),
+    'RemodAge': (('YrSold', 'YearRemodAdd'), np.subtract),
+    'TotalBath': (('FullBath', 'HalfBath', 'BsmtFullBath', 'BsmtHalfBath'),
+                  lambda full, half, bsmt_full, bsmt_half:
+                  full + 0.5 * half + bsmt_full + 0.5 * bsmt_half),
+}
+
+
+# The feature index of a cleaned training frame. 'numeric' holds the names
+# of all numerical matrix columns in order (numbers, ordinal grades, derived
+# features), so the models only need its length to find the category codes.
+def build_index(df):
+    features = [c for c in df.columns if c not in (ID_COL, TARGET)]
+    numbers = [c for c in features if pd.api.types.is_numeric_dtype(df[c])]
+    ordinal = {c: QUALITY_SCALES[c] for c in features
+               if c in QUALITY_SCALES and c not in numbers}
+    derived = [name for name, (inputs, _) in DERIVED.items()
+               if all(c in numbers for c in inputs)]
+    categorical = {}
+    for col in features:
+        if col not in numbers and col not in ordinal:
+            values = df[col].dropna().astype(str).unique()
+            categorical[col] = sorted(values)
+    return {'numeric': numbers + list(ordinal) + derived, 'ordinal': ordinal,
+            'derived': derived, 'categorical': categorical}
+
+
+def save_index(index, path=FEATURES_FILE):
+    with open(path, 'w') as f:
+        json.dump(index, f, indent=1)
+
+
+def load_index(path=FEATURES_FILE):
+    with open(path) as f:
+        return json.load(f)
+
+
+# Integer codes of a text column against the training categories. Columns
+# already stored as categoricals are remapped through their (small) category
+# list instead of hashing every value again.
+def _codes(values, categories):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        remap = pd.Index(categories).get_indexer(
+                values.cat.categories.astype(str))
+        remap = np.append(remap, UNKNOWN)
+        return remap[values.cat.codes.to_numpy()]
+    return pd.Categorical(values, categories=categories).codes
+
+
+# Ordinal grades of a quality column, 0 for missing or unrecognised grades
+def _grades(values, scale):
+    grades = np.append(np.array(list(scale.values()), dtype=np.float32), 0)
+    codes = _codes(values, list(scale))
+    return grades[np.where(codes < 0, len(scale), codes)]
+
+
+# Compute the derived features in place from the other columns of an
+# encoded matrix (or of any block of its rows)
+def add_derived(index, X):
+    position = {col: j for j, col in enumerate(index['numeric'])}
+    for name in index['derived']:
+        inputs, func = DERIVED[name]
+        X[:, position[name]] = func(*(X[:, position[c]] for c in inputs))
+    return X
+
+
+# Encode a batch into one float32 matrix: the numerical columns followed by
+# the category codes (UNKNOWN for a category unseen in training). out may be
+# a preallocated matrix to fill, e.g. a memory-mapped file.
+def encode(index, df, out=None):
+    numeric, ordinal = index['numeric'], index['ordinal']
+    categorical = index['categorical']
+    shape = (len(df), len(numeric) + len(categorical))
+    X = np.empty(shape, dtype=np.float32) if out is None else out
+    derived = set(index['derived'])
+    for j, col in enumerate(numeric):
+        if col in ordinal:
+            X[:, j] = _grades(df[col], ordinal[col])
+        elif col not in derived:
+            X[:, j] = df[col].to_numpy(dtype=np.float32)
+    add_derived(index, X)
+    for j, (col, categories) in enumerate(categorical.items(),
+                                          start=len(numeric)):
+        X[:, j] = _codes(df[col], categories)
+    return X
+
+
+if __name__ == '__main__':
+    from storage import load_cleaned
+
+    parser = argparse.ArgumentParser(description="Build the feature index "
+                                                 "of the SalePrice models")
+    parser.add_argument('--data', default='Cleaned_train')
+    parser.add_argument('--out', default=FEATURES_FILE)
+    args = parser.parse_args()
+    index = build_index(load_cleaned(args.data))
+    save_index(index, args.out)
+    print("%d numerical columns (%d ordinal, %d derived) and %d categorical "
+          "columns written to %s"
+          % (len(index['numeric']), len(index['ordinal']),
+             len(index['derived']), len(index['categorical']), args.out))
@@ -4,13 +4,25 @@ Created on Wed Aug 19 04:16:58 2020
 
 @author: Anshul Arya
 """
+import os
+
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import matplotlib.ticker as mtick
-from scipy import stats
-import matplotlib.gridspec as gridspec
-import matplotlib.style as style
+from profiler import profile_frame, missing_table
+from instrument import stage
+from backends import backend_of
+
+# matplotlib, seaborn and scipy are imported by the figure functions that use
+# them, so missing() and the modules that only need it start without them
+
+# Save a figure, including the caption below the axes, and release it
+def save_figure(fig, filename):
+    import matplotlib.pyplot as plt
+
+    with stage('savefig'):
+        fig.savefig(filename, bbox_inches='tight')
+    plt.close(fig)
+
 
 # Function to add figure number
 def add_fignum(caption):
@@ -22,8 +34,31 @@ def add_fignum(caption):
     return figtext_args, figtext_kwargs
 
 
+# Histogram, QQ plot and box plot of a feature. Long columns are drawn from
+# a bounded normality summary (plot_data.normality_summary) instead of every
+# value, so the figure and its render time stay the same at any length.
 def plotting_3_charts(df, feature, cap, filename):
-    style.use('fivethirtyeight')
+    import matplotlib.style as style
+    from plot_data import DIAGNOSTICS_ROWS, cached_summary, normality_summary
+
+    # Only the plotted column is collected from a lazy frame
+    df = backend_of(df)['to_pandas'](df, [feature])
+    with style.context('fivethirtyeight'):
+        if len(df) > DIAGNOSTICS_ROWS:
+            summary = cached_summary(normality_summary, df[[feature]],
+                                     feature=feature)
+            _summary_3_charts(summary, cap, filename)
+        else:
+            _plotting_3_charts(df, feature, cap, filename)
+
+
+def _plotting_3_charts(df, feature, cap, filename):
+    from scipy import stats
+    import matplotlib.pyplot as plt
+    import matplotlib.gridspec as gridspec
+    import seaborn as sns
+    from plot_data import histogram_bins
+
     figtext_args, figtext_kwargs = add_fignum(cap)
     ## Creating a custom chart and giving in figsize and everything
     fig = plt.figure(constrained_layout=True, figsize=(12,8))
@@ -34,7 +69,10 @@ def plotting_3_charts(df, feature, cap, filename):
     ## Set the title
     ax1.set_title('Histogram')
     ## Plot the histogram
-    sns.distplot(df.loc[:,feature], norm_hist=True, ax=ax1)
+    values = np.sort(df[feature].dropna().to_numpy(dtype=np.float64))
+    sns.histplot(values, bins=histogram_bins(values), stat='density',
+                 kde=True, ax=ax1)
+    ax1.set_xlabel(feature)
     
     ## Customizing the QQplot.
     ax2 = fig.add_subplot(grid[1, :2])
@@ -50,44 +88,295 @@ def plotting_3_charts(df, feature, cap, filename):
     ## Plotting the Box Plot
     sns.boxplot(df.loc[:, feature], orient = 'v', ax=ax3)
     
-    plt.figtext(*figtext_args, **figtext_kwargs)
-    plt.savefig(filename)
+    fig.text(*figtext_args, **figtext_kwargs)
+    save_figure(fig, filename)
     
 
-# Define a function to get the missing values
+# The three charts of _plotting_3_charts drawn from a normality summary, in
+# the layout and labels of histplot, probplot and boxplot
+def _summary_3_charts(summary, cap, filename):
+    import matplotlib.pyplot as plt
+    import matplotlib.gridspec as gridspec
+
+    figtext_args, figtext_kwargs = add_fignum(cap)
+    fig = plt.figure(constrained_layout=True, figsize=(12,8))
+    grid = gridspec.GridSpec(ncols=3, nrows=3, figure=fig)
+    feature = summary['feature']
+
+    ax1 = fig.add_subplot(grid[0, :2])
+    ax1.set_title('Histogram')
+    hist = summary['hist']
+    ax1.hist(hist['edges'][:-1], hist['edges'], weights=hist['counts'],
+             density=True, color='C0', alpha=0.4)
+    if summary['kde'] is not None:
+        ax1.plot(summary['kde']['x'], summary['kde']['density'], color='C0')
+    ax1.set_xlabel(feature)
+    ax1.set_ylabel('Density')
+
+    ax2 = fig.add_subplot(grid[1, :2])
+    qq = summary['qq']
+    ax2.plot(qq['theoretical'], qq['ordered'], 'bo')
+    ax2.plot(qq['theoretical'],
+             qq['slope'] * qq['theoretical'] + qq['intercept'], 'r-')
+    ax2.set_title('Probability Plot')
+    ax2.set_xlabel('Theoretical quantiles')
+    ax2.set_ylabel('Ordered Values')
+
+    ax3 = fig.add_subplot(grid[:, 2])
+    ax3.set_title('Box Plot')
+    parts = ax3.bxp([summary['box']], widths=0.8, patch_artist=True,
+                    flierprops=dict(marker='o', markerfacecolor='none',
+                                    markeredgecolor='0.25'),
+                    medianprops=dict(color='0.25'))
+    parts['boxes'][0].set_facecolor('C0')
+    ax3.set_xticks([])
+    ax3.set_ylabel(feature)
+
+    fig.text(*figtext_args, **figtext_kwargs)
+    save_figure(fig, filename)
+
+
+# Define a function to get the missing values. The profile is computed in a
+# single pass over the columns and cached for unchanged frames; lazy frames
+# of another backend count their missing values in their own engine.
 def missing(df):
-    total = df.isnull().sum().sort_values(ascending=False)
-    percent = (df.isnull().sum()/df.isnull().count()).sort_values(
-                                                        ascending=False) * 100
-    missing_data = pd.concat([total, percent], axis=1, 
-                             keys=['Total', 'Percent']).reset_index()
-    missing_data = missing_data[missing_data['Total'] != 0]
-    missing_data = missing_data.rename(
-            columns={'index':'Variable', 
-                     'Total':'Total', 
-                     'Percent':'Percent'})
-    return missing_data
+    if isinstance(df, pd.DataFrame):
+        return missing_table(profile_frame(df))
+    return backend_of(df)['missing'](df)
+
+# Variables drawn per figure by plot_missing_data; wider tables are split
+# over several figures so each one renders in about the same time
+MISSING_PER_FIGURE = 60
+
+
+# The missing-value table of a frame, or of a precomputed profile
+# (profiler.profile_frame) or missing() table when one is given
+def _missing_data(df, profile):
+    if profile is None:
+        return missing(df=df)
+    if isinstance(profile, pd.DataFrame):
+        return profile
+    return missing_table(profile)
+
+
+# File name of page n (from 0) of a figure: the name itself for the first
+# page, then name_2.png, name_3.png, ...
+def _page_filename(figname, n):
+    if n == 0:
+        return figname
+    stem, ext = os.path.splitext(figname)
+    return '%s_%d%s' % (stem, n + 1, ext)
+
 
 # Define a function to plot the missing data percentage
-def plot_missing_data(i, df, figname):
-    i = i
-    missing_data = missing(df=df)
-    plt.figure(figsize=(15,7))
-    chart = sns.barplot(
-        x='Variable', 
-        y = 'Percent',
-        palette='Set1',
-        data=missing_data)
-    chart.set_xticklabels(chart.get_xticklabels(), rotation=90)
-    plt.title("Percentage of Missing Values by Variable")
-    fmt = '%.0f%%'
-    xticks = mtick.FormatStrFormatter(fmt)
-    chart.yaxis.set_major_formatter(xticks)
-    plt.figtext(0.3,-0.3, 
-                "Fig %s. Display Missing data percentage by variable" % i)
-    for index, row in missing_data.iterrows():
-        chart.text(row.name,row.Percent, round(row.Percent,2), 
-                   color='black', ha="center")
-    
-    plt.savefig(figname)
+# Bar chart of the missing percentage per variable, most missing first. The
+# table is computed from df unless a profile or missing() table is passed;
+# top_n keeps only the most missing variables, and tables longer than
+# per_page are drawn over several figures. Returns the files written.
+def plot_missing_data(i, df, figname, profile=None, top_n=None,
+                      per_page=MISSING_PER_FIGURE):
+    missing_data = _missing_data(df, profile)
+    if top_n is not None:
+        missing_data = missing_data.head(top_n)
+    pages = max(-(-len(missing_data) // per_page), 1)
+    filenames = []
+    for n in range(pages):
+        page = missing_data.iloc[n * per_page:(n + 1) * per_page]
+        caption = "Fig %s. Display Missing data percentage by variable" % i
+        if pages > 1:
+            caption += " (%d of %d)" % (n + 1, pages)
+        filenames.append(_page_filename(figname, n))
+        _missing_figure(page, caption, filenames[-1])
+    return filenames
+
+
+# One figure of plot_missing_data: the bars, their colours and their labels
+# are each drawn with a single call over the whole page
+def _missing_figure(missing_data, caption, filename):
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker as mtick
+    import seaborn as sns
+
+    percent = missing_data['Percent'].to_numpy(dtype=np.float64)
+    positions = np.arange(len(percent))
+    fig, chart = plt.subplots(figsize=(15,7))
+    bars = chart.bar(positions, percent, width=0.8,
+                     color=sns.color_palette('Set1', len(percent)))
+    chart.set_xlim(-0.5, len(percent) - 0.5)
+    chart.set_xticks(positions)
+    chart.set_xticklabels(missing_data['Variable'].astype(str), rotation=90)
+    chart.set_xlabel('Variable')
+    chart.set_ylabel('Percent')
+    chart.set_title("Percentage of Missing Values by Variable")
+    chart.yaxis.set_major_formatter(mtick.FormatStrFormatter('%.0f%%'))
+    fig.text(0.3, -0.3, caption)
+    with stage('missing labels', rows_in=missing_data):
+        chart.bar_label(bars, labels=np.round(percent, 2).astype(str),
+                        color='black')
+    save_figure(fig, filename)
+
+
+# Set the title, axis labels and caption shared by the single-chart figures
+def _decorate(fig, ax, caption=None, title=None, title_kw=None, xlabel=None,
+              ylabel=None, label_kw=None, rotation=None):
+    import matplotlib.pyplot as plt
+
+    if title is not None:
+        ax.set_title(title, **(title_kw or {}))
+    if xlabel is not None:
+        ax.set_xlabel(xlabel, **(label_kw or {}))
+    if ylabel is not None:
+        ax.set_ylabel(ylabel, **(label_kw or {}))
+    if rotation is not None:
+        plt.setp(ax.get_xticklabels(), rotation=rotation)
+    if caption is not None:
+        figtext_args, figtext_kwargs = add_fignum(caption)
+        fig.text(*figtext_args, **figtext_kwargs)
+
+
+# Box plot of y for each level of x
+def box_plot(df, filename, x, y='SalePrice', figsize=(12,7), palette=None,
+             color=None, **decorate):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    fig, ax = plt.subplots(figsize=figsize)
+    sns.boxplot(x=x, y=y, data=df, palette=palette, color=color, ax=ax)
+    _decorate(fig, ax, **decorate)
+    save_figure(fig, filename)
+
+
+# Scatter plot of y against x with a fitted regression line
+def reg_plot(df, filename, x, y='SalePrice', figsize=(12,7), color=None,
+             **decorate):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    fig, ax = plt.subplots(figsize=figsize)
+    sns.regplot(x=x, y=y, data=df, color=color, ax=ax)
+    _decorate(fig, ax, **decorate)
+    save_figure(fig, filename)
+
+
+# Scatter plot of y against x, optionally coloured by hue
+def scatter_plot(df, filename, x, y='SalePrice', figsize=(12,7), color=None,
+                 hue=None, **decorate):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    fig, ax = plt.subplots(figsize=figsize)
+    sns.scatterplot(x=x, y=y, hue=hue, data=df, color=color, ax=ax)
+    _decorate(fig, ax, **decorate)
+    save_figure(fig, filename)
+
+
+# Box plot drawn from the per-level statistics of plot_data.box_stats, so the
+# rows are not regrouped on every render. x and y only name the summarised
+# variables; the axis labels come from the summary.
+def summary_box_plot(summary, filename, x=None, y=None, figsize=(12,7),
+                     palette=None, color=None, **decorate):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    fig, ax = plt.subplots(figsize=figsize)
+    stats = summary['stats']
+    parts = ax.bxp(stats, widths=0.8, patch_artist=True,
+                   flierprops=dict(marker='d', markersize=4),
+                   medianprops=dict(color='0.25'))
+    if color is not None and palette is None:
+        colors = [color] * len(stats)
+    else:
+        colors = sns.color_palette(palette, len(stats))
+    for box, c in zip(parts['boxes'], colors):
+        box.set_facecolor(c)
+    ax.set_xlabel(summary['x'])
+    ax.set_ylabel(summary['y'])
+    _decorate(fig, ax, **decorate)
+    save_figure(fig, filename)
+
+
+# 2D density of a plot_data.density_grid on a log colour scale, with its
+# least squares line when the grid has one
+def density_plot(grid, filename, x=None, y=None, figsize=(12,7), color=None,
+                 **decorate):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from matplotlib.colors import LogNorm
+
+    fig, ax = plt.subplots(figsize=figsize)
+    counts = np.ma.masked_equal(grid['counts'].T, 0)
+    # Cells holding a single house stay visible against the background
+    cmap = (sns.blend_palette(['0.8', color], as_cmap=True)
+            if color is not None else 'viridis')
+    mesh = ax.pcolormesh(grid['xedges'], grid['yedges'], counts, cmap=cmap,
+                         norm=LogNorm(vmin=1, vmax=max(int(grid['counts'].max()), 1)))
+    fig.colorbar(mesh, ax=ax, label='Houses')
+    if grid['line'] is not None:
+        slope, intercept = grid['line']
+        xs = grid['xedges'][[0, -1]]
+        ax.plot(xs, slope * xs + intercept, color=color or 'C1')
+    ax.set_xlabel(grid['x'])
+    ax.set_ylabel(grid['y'])
+    _decorate(fig, ax, **decorate)
+    save_figure(fig, filename)
+
+
+# Grid of box plots of y, one panel per variable in xs
+def box_grid(df, filename, xs, titles, nrows, ncols, y='SalePrice',
+             figsize=(15,10), caption=None):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    fig = plt.figure(figsize=figsize)
+    fig.subplots_adjust(hspace = 1, wspace = 1)
+    for n, (x, title) in enumerate(zip(xs, titles)):
+        ax = fig.add_subplot(nrows, ncols, n + 1)
+        sns.boxplot(x=x, y=y, data=df, ax=ax)
+        ax.set_title(title)
+    _decorate(fig, ax, caption=caption)
+    save_figure(fig, filename)
+
+
+# Row of scatter plots of each variable in ys against x
+def scatter_grid(df, filename, ys, titles, colors, x='SalePrice',
+                 figsize=(15,5), caption=None):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    fig = plt.figure(figsize=figsize)
+    fig.subplots_adjust(hspace = 1, wspace = 1)
+    for n, (y, title, color) in enumerate(zip(ys, titles, colors)):
+        ax = fig.add_subplot(1, len(ys), n + 1)
+        sns.scatterplot(x=x, y=y, data=df, ax=ax, color=color)
+        ax.set_title(title)
+    _decorate(fig, ax, caption=caption)
+    save_figure(fig, filename)
+
+
+# Lower triangle heatmap of a correlation matrix given as a square frame
+def corr_heatmap(cm, filename, figsize=(10,10), **decorate):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    fig, ax = plt.subplots(figsize=figsize)
+    mask = np.triu(np.ones_like(cm, dtype=bool))
+    cmap = sns.diverging_palette(220, 10, as_cmap=True)
+    sns.heatmap(cm.to_numpy(), mask=mask, cmap=cmap, cbar=True, annot=True,
+                square=True, fmt='.2f', annot_kws={'size':10},
+                yticklabels=cm.index.values, xticklabels=cm.columns.values,
+                ax=ax)
+    _decorate(fig, ax, **decorate)
+    save_figure(fig, filename)
+
+
+# Adapters with the (df, filename) signature of the other figure functions,
+# used by the plot jobs
+def normality_plot(df, filename, feature, cap):
+    plotting_3_charts(df, feature, cap, filename)
+
 
+# From a precomputed missing() table. Draws the top_n most missing variables
+# in a single figure, so that the plot job writes one file.
+def missing_plot(missing_data, filename, i, top_n=MISSING_PER_FIGURE):
+    plot_missing_data(i, None, filename, profile=missing_data, top_n=top_n,
+                      per_page=top_n)
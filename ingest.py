@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel ingestion of sharded csv inputs.
+
+The raw data may be one train.csv/test.csv pair or many shard files (daily
+files per region, in any subfolder). Shards are found from a directory, a
+glob pattern or a single path, their headers are checked against each other,
+and they are parsed concurrently with one shared dtype schema (see
+dtype_plan.py), so every shard comes back with the same compact dtypes and
+the same categories. The shards are then either streamed one frame at a time
+or assembled into one frame whose columns are preallocated and filled shard
+by shard, which copies the data once instead of concatenating and then
+re-indexing.
+
+The data directory is taken from HOUSE_DATA_DIR, Data/ by default.
+
+Usage:
+    python ingest.py "Data/**/train*.csv"
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from cleaning import CHUNKSIZE, iter_chunks
+from dtype_plan import (MAX_CATEGORIES, bytes_per_row, merge_plans, new_plan,
+                        plan_schema, read_planned, update_plan)
+
+DATA_DIR = os.environ.get('HOUSE_DATA_DIR', 'Data')
+
+
+# Sorted csv shards of a directory (searched recursively for pattern), a glob
+# pattern or a single file
+def find_shards(source=DATA_DIR, pattern='*.csv'):
+    if glob.has_magic(source):
+        paths = glob.glob(source, recursive=True)
+    elif os.path.isdir(source):
+        paths = glob.glob(os.path.join(source, '**', pattern), recursive=True)
+    else:
+        paths = [source] if os.path.exists(source) else []
+    if not paths:
+        raise FileNotFoundError("No csv shards found for %s (pattern %s)"
+                                % (source, pattern))
+    return sorted(paths)
+
+
+# Check that every shard has the expected columns (those of the first shard
+# by default), in any order, and return them
+def check_columns(paths, columns=None):
+    problems = []
+    for path in paths:
+        header = list(pd.read_csv(path, nrows=0).columns)
+        if columns is None:
+            columns = header
+        missing = [c for c in columns if c not in header]
+        extra = [c for c in header if c not in columns]
+        if missing or extra:
+            problems.append("%s: missing %s, unexpected %s"
+                            % (path, missing, extra))
+    if problems:
+        raise ValueError("Shards with inconsistent columns:\n%s"
+                         % '\n'.join(problems))
+    return list(columns)
+
+
+# Forked workers do not re-import the calling script, which is plain
+# top-level code. Where fork is unavailable the shards are parsed in threads.
+def _executor(workers):
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('fork'))
+    return ThreadPoolExecutor(workers)
+
+
+# Ordered map over the shards with at most two tasks per worker in flight, so
+# a slow consumer does not hold every parsed shard in memory
+def _map(func, paths, processes=None, *args):
+    workers = processes or os.cpu_count() or 1
+    if workers == 1 or len(paths) <= 1:
+        for path in paths:
+            yield func(path, *args)
+        return
+    with _executor(workers) as pool:
+        pending = deque()
+        for path in paths:
+            pending.append(pool.submit(func, path, *args))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _plan_shard(path, chunksize, max_categories):
+    plan = new_plan()
+    for chunk in iter_chunks(path, chunksize):
+        update_plan(plan, chunk, max_categories)
+    return plan
+
+
+# Plan one dtype schema for all shards, planning each shard in parallel
+def plan_shards(paths, processes=None, chunksize=CHUNKSIZE,
+                max_categories=MAX_CATEGORIES):
+    plan = new_plan()
+    for part in _map(_plan_shard, paths, processes, chunksize,
+                     max_categories):
+        plan = merge_plans(plan, part, max_categories)
+    return plan_schema(plan)
+
+
+def _read_shard(path, schema, columns):
+    return read_planned(path, schema, usecols=columns)[columns]
+
+
+# Stream the shards as frames, in order, parsed in parallel with the schema.
+# The columns are checked unless they are given.
+def iter_shards(paths, schema, processes=None, columns=None):
+    if columns is None:
+        columns = check_columns(paths)
+    return _map(_read_shard, paths, processes, schema, columns)
+
+
+# Copy frames with the same columns into one frame. Every column is allocated
+# once at its final length and filled frame by frame; categoricals are
+# assembled from their codes. Columns whose dtype differs between frames, or
+# is not a numpy dtype, fall back to pd.concat.
+def assemble(frames, columns=None):
+    frames = list(frames)
+    if columns is None:
+        columns = list(frames[0].columns)
+    rows = sum(len(df) for df in frames)
+    out = {}
+    for col in columns:
+        dtypes = {df[col].dtype for df in frames}
+        dtype = frames[0][col].dtype
+        if len(dtypes) > 1 or not (isinstance(dtype, pd.CategoricalDtype)
+                                   or isinstance(dtype, np.dtype)):
+            out[col] = pd.concat([df[col] for df in frames],
+                                 ignore_index=True)
+            continue
+        categorical = isinstance(dtype, pd.CategoricalDtype)
+        values = np.empty(rows, dtype=frames[0][col].cat.codes.dtype
+                          if categorical else dtype)
+        start = 0
+        for df in frames:
+            series = df[col].cat.codes if categorical else df[col]
+            values[start:start + len(df)] = series.to_numpy()
+            start += len(df)
+        out[col] = (pd.Categorical.from_codes(values, dtype=dtype)
+                    if categorical else values)
+    return pd.DataFrame(out, columns=columns, copy=False)
+
+
+# Read the shards into one frame. Without a schema, one is planned from the
+# shards first.
+def read_shards(paths, schema=None, processes=None, columns=None):
+    columns = check_columns(paths, columns)
+    if schema is None:
+        schema = plan_shards(paths, processes)
+    return assemble(iter_shards(paths, schema, processes, columns), columns)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Read csv shards into one "
+                                                 "frame")
+    parser.add_argument('source', nargs='?', default=DATA_DIR,
+                        help="directory, glob pattern or file")
+    parser.add_argument('--pattern', default='*.csv')
+    parser.add_argument('--processes', type=int)
+    args = parser.parse_args()
+    paths = find_shards(args.source, args.pattern)
+    df = read_shards(paths, processes=args.processes)
+    print("%s shards, %s rows, %s columns, %.0f bytes per row"
+          % (len(paths), len(df), df.shape[1], bytes_per_row(df)))
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Stage instrumentation for the pipeline scripts.
+
+Code is split into named stages with the stage() context manager. For each
+stage the wall time, CPU time, rows in and out and the change in resident
+memory are recorded. The mode is taken from HOUSE_TRACE:
+
+- off (default): stage() returns a no-op context, nothing is measured.
+- summary: a table of all stages is printed when the process exits.
+- chrome: a Chrome trace (chrome://tracing, Perfetto) is written to
+  HOUSE_TRACE_FILE, trace.json by default.
+
+Set HOUSE_PROFILE to a stage name to also capture that stage, with cProfile
+(written to <stage>.prof) or, when HOUSE_PROFILE_MODE=sample, with a
+statistical sampler that writes collapsed stacks to <stage>.stacks for
+flamegraph tools. The sampler uses SIGPROF and is only available on Unix.
+
+Usage:
+    with stage('read_csv') as s:
+        df = pd.read_csv(path)
+        s['rows_out'] = len(df)
+"""
+import atexit
+import contextlib
+import os
+import threading
+import time
+from collections import Counter
+
+import pandas as pd
+
+MODES = ('off', 'summary', 'chrome')
+MODE = os.environ.get('HOUSE_TRACE', 'off')
+TRACE_FILE = os.environ.get('HOUSE_TRACE_FILE', 'trace.json')
+# Stage to profile, and how
+PROFILE_STAGE = os.environ.get('HOUSE_PROFILE')
+PROFILE_MODE = os.environ.get('HOUSE_PROFILE_MODE', 'cprofile')
+# Sampling interval of the statistical profiler in seconds
+SAMPLE_INTERVAL = 0.005
+
+if MODE not in MODES:
+    raise ValueError("HOUSE_TRACE must be one of %s" % ', '.join(MODES))
+
+_records = []
+_depth = threading.local()
+
+
+# Resident memory of the process in bytes, or None when it can't be read
+def _rss():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# Rows of a frame, or of the data a plot summary was computed from
+def _rows(value):
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, dict):
+        return value.get('rows')
+    return len(value)
+
+
+# Record the stage name with its wall and CPU time, rows and memory change.
+# rows_in may be given as a count or as the frame itself; rows_out is set on
+# the yielded dict inside the block, as a count (len(df)) so that the record
+# does not keep the frame alive.
+def stage(name, rows_in=None):
+    if MODE == 'off' and PROFILE_STAGE is None:
+        return _off()
+    return _stage(name, rows_in)
+
+
+# Nothing measured: a fresh dict per block, dropped with what it was given
+@contextlib.contextmanager
+def _off():
+    yield {}
+
+
+@contextlib.contextmanager
+def _stage(name, rows_in):
+    record = {'name': name, 'rows_in': _rows(rows_in), 'rows_out': None,
+              'pid': os.getpid(), 'tid': threading.get_ident()}
+    depth = getattr(_depth, 'value', 0)
+    _depth.value = depth + 1
+    capture = (_capture(name) if name == PROFILE_STAGE
+               else contextlib.nullcontext())
+    rss = _rss()
+    cpu = time.process_time()
+    start = time.perf_counter()
+    try:
+        with capture:
+            yield record
+    finally:
+        record['wall'] = time.perf_counter() - start
+        record['cpu'] = time.process_time() - cpu
+        end_rss = _rss()
+        record['mem_delta'] = (end_rss - rss if rss is not None
+                               and end_rss is not None else None)
+        record['start'] = start
+        record['depth'] = depth
+        record['rows_out'] = _rows(record['rows_out'])
+        _depth.value = depth
+        if MODE != 'off':
+            _records.append(record)
+
+
+## Profiling
+
+def _capture(name):
+    if PROFILE_MODE == 'sample':
+        return _sample(name)
+    return _cprofile(name)
+
+
+@contextlib.contextmanager
+def _cprofile(name):
+    import cProfile
+    import pstats
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats('%s.prof' % name)
+        pstats.Stats(profile).sort_stats('cumulative').print_stats(20)
+
+
+# Statistical profiler: every SAMPLE_INTERVAL of CPU time the current stack
+# is counted, and the counts are written in the collapsed format of
+# flamegraph.pl and speedscope
+@contextlib.contextmanager
+def _sample(name, interval=SAMPLE_INTERVAL):
+    import signal
+
+    stacks = Counter()
+
+    def on_sample(signum, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('%s (%s:%s)' % (code.co_name,
+                                         os.path.basename(code.co_filename),
+                                         code.co_firstlineno))
+            frame = frame.f_back
+        stacks[';'.join(reversed(names))] += 1
+
+    previous = signal.signal(signal.SIGPROF, on_sample)
+    signal.setitimer(signal.ITIMER_PROF, interval, interval)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, previous)
+        with open('%s.stacks' % name, 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write('%s %d\n' % (stack, count))
+
+
+## Reports
+
+# Worker processes hand their records to the parent, which adds them to its own
+def take_records():
+    taken = list(_records)
+    del _records[:]
+    return taken
+
+
+def add_records(new):
+    _records.extend(new)
+
+
+# One row per stage name, in order of first appearance, with totals over
+# repeated calls. Nested stages are indented under their parent.
+def summary(recs=None):
+    recs = _records if recs is None else recs
+    columns = ['Stage', 'Calls', 'Wall (s)', 'CPU (s)', 'Rows in',
+               'Rows out', 'Mem delta (MB)']
+    if not recs:
+        return pd.DataFrame(columns=columns)
+    # A stage is recorded when it ends, so order by start to list parents
+    # before the stages nested in them
+    df = pd.DataFrame(recs).sort_values('start', kind='mergesort')
+    df['mem_delta'] = pd.to_numeric(df['mem_delta']) / 1024 ** 2
+    total = lambda values: values.sum(min_count=1)
+    table = df.groupby('name', sort=False).agg(
+            depth=('depth', 'min'), calls=('name', 'size'),
+            wall=('wall', 'sum'), cpu=('cpu', 'sum'),
+            rows_in=('rows_in', total), rows_out=('rows_out', total),
+            mem=('mem_delta', total))
+    table[['rows_in', 'rows_out']] = table[['rows_in',
+                                            'rows_out']].astype('Int64')
+    table.insert(0, 'stage', ['  ' * d + name
+                              for name, d in table['depth'].items()])
+    table = table.drop(columns='depth').reset_index(drop=True)
+    table.columns = columns
+    return table
+
+
+def chrome_trace(recs=None):
+    recs = _records if recs is None else recs
+    origin = min((r['start'] for r in recs), default=0)
+    events = []
+    for r in recs:
+        args = {k: r[k] for k in ('rows_in', 'rows_out', 'cpu', 'mem_delta')
+                if r[k] is not None}
+        events.append({'name': r['name'], 'ph': 'X', 'pid': r['pid'],
+                       'tid': r['tid'], 'ts': (r['start'] - origin) * 1e6,
+                       'dur': r['wall'] * 1e6, 'args': args})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def report():
+    if not _records:
+        return
+    if MODE == 'summary':
+        with pd.option_context('display.width', 120,
+                               'display.max_columns', None,
+                               'display.max_rows', None,
+                               'display.float_format', '{:.3f}'.format):
+            table = summary()
+            width = table['Stage'].str.len().max()
+            print(table.to_string(index=False, formatters={
+                    'Stage': ('{:<%d}' % width).format}))
+    elif MODE == 'chrome':
+        import json
+        with open(TRACE_FILE, 'w') as f:
+            json.dump(chrome_trace(), f)
+        print("Trace written to %s" % TRACE_FILE)
+
+
+# Only the process that imported this module first reports; forked workers
+# hand their records back instead
+_owner = os.getpid()
+if MODE != 'off':
+    atexit.register(lambda: os.getpid() == _owner and report())
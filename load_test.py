@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Load test for serve.py.
+
+Opens a number of concurrent keep-alive connections to the prediction
+service on localhost, posts single listings taken from the cleaned test data
+and reports the p50/p99 request latency and the throughput.
+
+Usage:
+    python load_test.py --port 8000 --connections 32 --requests 200
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from storage import load_cleaned
+
+
+# Listings as JSON bodies, with missing values sent as null
+def listing_bodies(name='Cleaned_test', limit=1000):
+    df = load_cleaned(name).head(limit)
+    df = df.astype(object).where(df.notnull(), None)
+    return [json.dumps(record, default=lambda v: v.item()).encode()
+            for record in df.to_dict(orient='records')]
+
+
+async def client(host, port, bodies, n_requests, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    for i in range(n_requests):
+        body = bodies[i % len(bodies)]
+        start = time.perf_counter()
+        writer.write(b'POST /predict HTTP/1.1\r\nHost: %s\r\n'
+                     b'Content-Type: application/json\r\n'
+                     b'Content-Length: %d\r\n\r\n'
+                     % (host.encode(), len(body)) + body)
+        await writer.drain()
+        head = await reader.readuntil(b'\r\n\r\n')
+        length = [line for line in head.split(b'\r\n')
+                  if line.lower().startswith(b'content-length')][0]
+        await reader.readexactly(int(length.split(b':')[1]))
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+async def run(host, port, connections, n_requests, bodies):
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(host, port, bodies[i::connections],
+                                  n_requests, latencies)
+                           for i in range(connections)])
+    return np.array(latencies), time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test serve.py")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--connections', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=200,
+                        help="requests per connection")
+    parser.add_argument('--data', default='Cleaned_test')
+    args = parser.parse_args()
+    bodies = listing_bodies(args.data)
+    latencies, seconds = asyncio.run(run(args.host, args.port,
+                                         args.connections, args.requests,
+                                         bodies))
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    print("%s requests over %s connections in %.2f s (%.0f req/s)"
+          % (len(latencies), args.connections, seconds,
+             len(latencies) / seconds))
+    print("Latency p50 %.2f ms, p99 %.2f ms" % (p50, p99))
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel cross-validated model selection on the log SalePrice.
+
+The cleaned training data is encoded once, with the feature index of
+features.py, into a contiguous float32 matrix written as a .npy file next to
+the target. Every (fold, config) pair is a task for a process pool; the
+workers open the files memory-mapped, so they all read the same pages of the
+page cache and the matrix is never pickled or copied per task. Each worker
+keeps its libraries to one thread, as the pool already uses the cores.
+
+Every finished task is appended as one JSON line to the checkpoint file. A
+rerun with the same data, folds, seed and model code skips the tasks of the
+configs whose parameters are unchanged, so an interrupted search resumes
+where it stopped and editing one config only reruns that config. The report is the mean and
+spread of the RMSE on log SalePrice over the folds, per config. With
+--drop-outliers the search runs without the outliers EDA.py deletes, as
+model.py trains with the same option.
+
+Usage:
+    python model_selection.py --data Cleaned_train --folds 5
+    python model_selection.py --data Cleaned_train --drop-outliers
+"""
+import argparse
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import features
+import model
+from cache import frame_digest
+from cleaning import TARGET
+from features import build_index, encode
+from model import compile_gbm, fit_gbm, fit_ridge, predict_log
+from outliers import drop_outliers, mask_path
+from storage import load_cleaned
+
+CHECKPOINT = 'selection.jsonl'
+MATRIX = 'features.npy'
+FOLDS = 5
+# The regressors and hyperparameters compared, by name
+CONFIGS = {
+    'ridge alpha=1': ('ridge', {'alpha': 1.0}),
+    'ridge alpha=10': ('ridge', {'alpha': 10.0}),
+    'ridge alpha=30': ('ridge', {'alpha': 30.0}),
+    'gbm depth=3': ('gbm', {'max_depth': 3, 'learning_rate': 0.1}),
+    'gbm depth=6': ('gbm', {'max_depth': 6, 'learning_rate': 0.1}),
+    'gbm depth=6 lr=0.05': ('gbm', {'max_depth': 6, 'learning_rate': 0.05,
+                                    'max_iter': 400}),
+    'blend': ('blend', {'alpha': 10.0}),
+}
+
+# The matrix, target, encoder and folds of a worker, set once per process
+_data = {}
+
+
+# Encode the frame straight into a memory-mapped float32 matrix, and store
+# the target beside it (<matrix>.target.npy)
+def write_matrix(df, path=MATRIX):
+    encoder = build_index(df)
+    shape = (len(df), len(encoder['numeric']) + len(encoder['categorical']))
+    X = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                  shape=shape)
+    encode(encoder, df, out=X)
+    X.flush()
+    del X
+    np.save(_target_path(path), df[TARGET].to_numpy(dtype=np.float64))
+    return encoder
+
+
+def _target_path(path):
+    return os.path.splitext(path)[0] + '.target.npy'
+
+
+def _open_data(path, encoder, folds):
+    _data.update(X=np.load(path, mmap_mode='r'),
+                 y=np.load(_target_path(path), mmap_mode='r'),
+                 encoder=encoder, folds=folds)
+
+
+def _init_worker(path, encoder, folds):
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(1)
+    except ImportError:
+        pass
+    _open_data(path, encoder, folds)
+
+
+# Fold of each row: a seeded shuffle dealt round-robin into k folds
+def assign_folds(rows, k=FOLDS, seed=0):
+    folds = np.empty(rows, dtype=np.int8)
+    folds[np.random.default_rng(seed).permutation(rows)] = np.arange(rows) % k
+    return folds
+
+
+# Fit one config on every fold but one and score it on the held-out fold
+def run_task(name, fold):
+    kind, params = CONFIGS[name]
+    X, y, folds = _data['X'], _data['y'], _data['folds']
+    encoder = _data['encoder']
+    start = time.perf_counter()
+    train, valid = folds != fold, folds == fold
+    X_train, y_train = X[train], y[train]
+    artifact = {'encoder': encoder}
+    if kind in ('ridge', 'blend'):
+        artifact['ridge'] = fit_ridge(encoder, X_train, y_train,
+                                      params.get('alpha', 10.0))
+    if kind in ('gbm', 'blend'):
+        gbm = fit_gbm(encoder, X_train, y_train,
+                      **{k: v for k, v in params.items() if k != 'alpha'})
+        artifact.update(gbm=gbm, gbm_flat=compile_gbm(gbm))
+    pred = predict_log(artifact, X[valid], kind)
+    rmse = float(np.sqrt(np.mean((pred - y[valid]) ** 2)))
+    return {'config': name, 'fold': int(fold), 'rmse': rmse,
+            'rows': int(valid.sum()),
+            'seconds': time.perf_counter() - start}
+
+
+# Identifies the data, folds, seed and model code of a search (the source of
+# the estimators and of the feature encoding), so that a checkpoint of
+# another search is not resumed from
+def run_key(df, k, seed):
+    sha = hashlib.sha256(frame_digest(df).encode())
+    sha.update(json.dumps([k, seed]).encode())
+    for module in (model, features):
+        sha.update(inspect.getsource(module).encode())
+    return sha.hexdigest()[:16]
+
+
+# Identifies the tasks of one config in a search: the run key plus the
+# config's kind and parameters
+def config_key(key, name):
+    sha = hashlib.sha256(key.encode())
+    sha.update(json.dumps(CONFIGS[name], sort_keys=True, default=repr)
+               .encode())
+    return sha.hexdigest()[:16]
+
+
+# Finished tasks of the search, given the key of each config
+def load_checkpoint(path, keys):
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by an interruption
+                continue
+            if keys.get(record.get('config')) == record.get('run'):
+                done[(record['config'], record['fold'])] = record
+    return done
+
+
+# Run every (fold, config) task not yet in the checkpoint and return the
+# records of all tasks
+def select(df, configs=None, k=FOLDS, seed=0, processes=None,
+           checkpoint=CHECKPOINT, matrix=MATRIX):
+    configs = list(configs or CONFIGS)
+    key = run_key(df, k, seed)
+    keys = {name: config_key(key, name) for name in configs}
+    done = load_checkpoint(checkpoint, keys)
+    tasks = [(name, fold) for fold in range(k) for name in configs
+             if (name, fold) not in done]
+    records = [done[(name, fold)] for fold in range(k) for name in configs
+               if (name, fold) in done]
+    if not tasks:
+        return records
+    encoder = write_matrix(df, matrix)
+    folds = assign_folds(len(df), k, seed)
+    workers = min(processes or os.cpu_count() or 1, len(tasks))
+    with open(checkpoint, 'a') as out:
+        def finish(record):
+            record['run'] = keys[record['config']]
+            out.write(json.dumps(record) + '\n')
+            out.flush()
+            records.append(record)
+            print("%-22s fold %d: RMSE %.4f (%.1f s)"
+                  % (record['config'], record['fold'], record['rmse'],
+                     record['seconds']))
+
+        if workers == 1:
+            _open_data(matrix, encoder, folds)
+            for name, fold in tasks:
+                finish(run_task(name, fold))
+        else:
+            methods = multiprocessing.get_all_start_methods()
+            method = 'fork' if 'fork' in methods else 'spawn'
+            with ProcessPoolExecutor(
+                    workers, mp_context=multiprocessing.get_context(method),
+                    initializer=_init_worker,
+                    initargs=(matrix, encoder, folds)) as pool:
+                futures = [pool.submit(run_task, name, fold)
+                           for name, fold in tasks]
+                for future in as_completed(futures):
+                    finish(future.result())
+    return records
+
+
+# Mean, spread and total fit time of the RMSE on log SalePrice per config,
+# best first
+def report(records):
+    df = pd.DataFrame(records)
+    table = df.groupby('config').agg(folds=('fold', 'nunique'),
+                                     rmse=('rmse', 'mean'),
+                                     rmse_std=('rmse', 'std'),
+                                     seconds=('seconds', 'sum'))
+    return table.sort_values('rmse')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cross-validate the "
+                                                 "SalePrice models")
+    parser.add_argument('--data', default='Cleaned_train')
+    parser.add_argument('--folds', type=int, default=FOLDS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--config', action='append', choices=list(CONFIGS),
+                        help="config to run, all by default; may be repeated")
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--drop-outliers', action='store_true',
+                        help="leave out the outliers flagged in the mask "
+                             "EDA.py stores next to the data")
+    parser.add_argument('--checkpoint', default=CHECKPOINT)
+    parser.add_argument('--matrix', default=MATRIX)
+    args = parser.parse_args()
+    df = load_cleaned(args.data)
+    if args.drop_outliers:
+        df = drop_outliers(df, mask_path(args.data))
+    records = select(df, args.config, args.folds,
+                     args.seed, args.processes, args.checkpoint, args.matrix)
+    with pd.option_context('display.float_format', '{:.4f}'.format):
+        print(report(records).to_string())
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Per-neighborhood price index and comparable-sales lookup.
+
+Neighborhood is one of the strongest price drivers (see the Sale Price by
+Neighborhood box plot of EDA.py). The index is built once from the cleaned
+training data and saved as a pickle. For every neighborhood it keeps:
+
+- the sales: Id, the comparison features (GrLivArea and OverallQual by
+  default) and the log SalePrice,
+- a KD-tree (scipy.spatial.cKDTree) over the comparison features divided by
+  their standard deviation, so that the features weigh alike,
+- aggregates: sale count, median log price, SalePrice quartiles and the
+  median price per square foot of living area.
+
+A comparable-sales query is a tree lookup in one neighborhood:
+comparable_sales() returns the sales as plain arrays in a few tens of
+microseconds, while comparables() puts them in a DataFrame for display,
+which costs about a millisecond per call. Batch queries are grouped by
+neighborhood and each group is answered with one vectorized tree query. The feature scales are fixed when
+the index is first built, so update_index() adds the sales whose Id is not
+yet indexed by rebuilding only the trees and aggregates of the
+neighborhoods they fall in.
+
+data_cleaning.py builds the index; after refresh.py has appended new sales
+to the cleaned data, the update command adds them.
+
+Usage:
+    python neighborhood_index.py build --data Cleaned_train
+    python neighborhood_index.py update --data Cleaned_train
+    python neighborhood_index.py query --neighborhood CollgCr \\
+        --value GrLivArea=1500 --value OverallQual=7 -k 5
+"""
+import argparse
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from cleaning import ID_COL, TARGET
+
+INDEX_FILE = 'neighborhoods.pkl'
+GROUP_COL = 'Neighborhood'
+# Features a comparable sale should be close in
+COMP_FEATURES = ('GrLivArea', 'OverallQual')
+AREA_COL = 'GrLivArea'
+# Comparable sales returned per query
+K = 5
+
+
+# The aggregates of one neighborhood, from its log prices and living areas
+def _group_stats(log_price, area):
+    price = np.exp(log_price)
+    q1, med, q3 = np.percentile(price, [25, 50, 75])
+    return {'count': len(price),
+            'median_log_price': float(np.median(log_price)),
+            'q1': q1, 'median': med, 'q3': q3,
+            'price_per_sqft': float(np.median(price / area))}
+
+
+# The sales, tree and aggregates of one neighborhood
+def _build_group(ids, values, log_price, area, scale):
+    from scipy.spatial import cKDTree
+
+    return {'ids': ids, 'values': values, 'log_price': log_price,
+            'area': area, 'tree': cKDTree(values / scale),
+            'stats': _group_stats(log_price, area)}
+
+
+def _columns(df, features):
+    return (df[ID_COL].to_numpy(dtype=np.int64),
+            df[list(features)].to_numpy(dtype=np.float64),
+            df[TARGET].to_numpy(dtype=np.float64),
+            df[AREA_COL].to_numpy(dtype=np.float64))
+
+
+# Split the sales of a cleaned frame by neighborhood: one sort by the group
+# codes, then a slice per neighborhood
+def _by_group(df, features):
+    groups = df[GROUP_COL].astype(str).to_numpy()
+    names, codes = np.unique(groups, return_inverse=True)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(codes))])
+    arrays = [a[order] for a in _columns(df, features)]
+    for i, name in enumerate(names):
+        yield name, [a[bounds[i]:bounds[i + 1]] for a in arrays]
+
+
+# Build the index of a cleaned training frame (with the log SalePrice)
+def build_index(df, features=COMP_FEATURES):
+    features = list(features)
+    scale = df[features].to_numpy(dtype=np.float64).std(axis=0)
+    scale[scale == 0] = 1
+    groups = {name: _build_group(*arrays, scale)
+              for name, arrays in _by_group(df, features)}
+    return {'features': features, 'scale': scale, 'groups': groups}
+
+
+# Add the sales of df whose Id is not in the index yet; only the
+# neighborhoods that get new sales are rebuilt. Returns the number of sales
+# added.
+def update_index(index, df):
+    known = np.concatenate([g['ids'] for g in index['groups'].values()]
+                           or [np.empty(0, dtype=np.int64)])
+    df = df[~df[ID_COL].isin(known)]
+    for name, arrays in _by_group(df, index['features']):
+        old = index['groups'].get(name)
+        if old is not None:
+            arrays = [np.concatenate([old[key], new]) for key, new in
+                      zip(('ids', 'values', 'log_price', 'area'), arrays)]
+        index['groups'][name] = _build_group(*arrays, index['scale'])
+    return len(df)
+
+
+def save_index(index, path=INDEX_FILE):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def load_index(path=INDEX_FILE):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+# The aggregates of every neighborhood, one row each, most expensive first
+def neighborhood_table(index):
+    table = pd.DataFrame({name: g['stats']
+                          for name, g in index['groups'].items()}).T
+    table.index.name = GROUP_COL
+    table['count'] = table['count'].astype(int)
+    return table.sort_values('median_log_price', ascending=False)
+
+
+def _group(index, neighborhood):
+    try:
+        return index['groups'][neighborhood]
+    except KeyError:
+        raise ValueError("Unknown neighborhood %s" % neighborhood) from None
+
+
+# Positions of the k sales of a neighborhood closest to point (its feature
+# values in the order of index['features']) and their scaled distances
+def nearest(index, neighborhood, point, k=K):
+    group = _group(index, neighborhood)
+    k = min(k, len(group['ids']))
+    dist, pos = group['tree'].query(np.asarray(point, dtype=np.float64)
+                                    / index['scale'], k=k)
+    return np.atleast_1d(pos), np.atleast_1d(dist)
+
+
+# The k comparable sales of one house as a dict of arrays, closest first:
+# Id, the feature values (one row per sale), SalePrice and distance. This is
+# the fast path for callers that do not need a frame.
+def comparable_sales(index, neighborhood, k=K, **values):
+    point = [values[f] for f in index['features']]
+    pos, dist = nearest(index, neighborhood, point, k)
+    group = _group(index, neighborhood)
+    return {ID_COL: group['ids'][pos], 'values': group['values'][pos],
+            TARGET: np.exp(group['log_price'][pos]), 'distance': dist}
+
+
+# The k comparable sales of one house as a frame: Id, features, SalePrice and
+# distance, closest first
+def comparables(index, neighborhood, k=K, **values):
+    sales = comparable_sales(index, neighborhood, k, **values)
+    table = pd.DataFrame(sales['values'], columns=index['features'])
+    table.insert(0, ID_COL, sales[ID_COL])
+    table[TARGET] = sales[TARGET]
+    table['distance'] = sales['distance']
+    return table
+
+
+# The k comparable sales of every row of queries (a frame with the
+# neighborhood and the comparison features): one tree query per
+# neighborhood. Returns a long frame with the position of the query row.
+def batch_comparables(index, queries, k=K):
+    features = index['features']
+    points = queries[features].to_numpy(dtype=np.float64) / index['scale']
+    frames = []
+    for name, rows in queries.groupby(queries[GROUP_COL].astype(str),
+                                      sort=False).indices.items():
+        group = _group(index, name)
+        kk = min(k, len(group['ids']))
+        dist, pos = group['tree'].query(points[rows], k=kk)
+        pos, dist = pos.reshape(len(rows), kk), dist.reshape(len(rows), kk)
+        table = pd.DataFrame(group['values'][pos.ravel()], columns=features)
+        table.insert(0, 'query', np.repeat(rows, kk))
+        table.insert(1, 'rank', np.tile(np.arange(kk), len(rows)))
+        table.insert(2, ID_COL, group['ids'][pos.ravel()])
+        table[TARGET] = np.exp(group['log_price'][pos.ravel()])
+        table['distance'] = dist.ravel()
+        frames.append(table)
+    if not frames:
+        return pd.DataFrame(columns=['query', 'rank', ID_COL] + features
+                            + [TARGET, 'distance'])
+    return pd.concat(frames, ignore_index=True).sort_values(
+            ['query', 'rank'], kind='mergesort').reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    from storage import load_cleaned
+
+    parser = argparse.ArgumentParser(description="Neighborhood price index "
+                                                 "and comparable sales")
+    parser.add_argument('command', choices=('build', 'update', 'query'))
+    parser.add_argument('--data', default='Cleaned_train')
+    parser.add_argument('--index', default=INDEX_FILE)
+    parser.add_argument('--neighborhood')
+    parser.add_argument('--value', action='append', default=[],
+                        help="feature=value of the house to compare, e.g. "
+                             "GrLivArea=1500; may be repeated")
+    parser.add_argument('-k', type=int, default=K)
+    args = parser.parse_args()
+    if args.command == 'build':
+        index = build_index(load_cleaned(args.data))
+        save_index(index, args.index)
+        with pd.option_context('display.float_format', '{:,.2f}'.format):
+            print(neighborhood_table(index).to_string())
+    elif args.command == 'update':
+        index = load_index(args.index)
+        added = update_index(index, load_cleaned(args.data))
+        save_index(index, args.index)
+        print("Added %d sales" % added)
+    else:
+        index = load_index(args.index)
+        values = dict(v.split('=', 1) for v in args.value)
+        print(comparables(index, args.neighborhood, args.k,
+                          **{f: float(values[f])
+                             for f in index['features']}).to_string())
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Declarative outlier removal.
+
+Outlier rules are plain dicts. A 'threshold' rule flags the rows where all of
+its (column, operator, value) conditions hold; a 'zscore' rule flags values
+whose robust z-score (median and MAD) exceeds a limit; an 'iqr' rule flags
+values outside the Tukey fences. All rules are evaluated in one vectorized
+pass into a single bitmask with one bit per rule, which is stored next to the
+cleaned data with the Id of each row. Plots select the rows to keep from that
+mask and take only the columns they need, instead of materializing filtered
+copies of the whole frame. model.py and model_selection.py leave out the
+rows of MODEL_RULES when run with --drop-outliers.
+"""
+import operator
+import os
+
+import numpy as np
+import pandas as pd
+
+from cleaning import ID_COL
+
+OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt,
+             '<=': operator.le, '==': operator.eq, '!=': operator.ne}
+
+# The outliers removed in EDA.py
+OUTLIER_RULES = [
+    # Houses above 4000 sq ft sold at a low price
+    {'name': 'large_cheap_house', 'kind': 'threshold',
+     'when': [('GrLivArea', '>', 4000), ('SalePrice', '<', 300000)]},
+    # Very large lots, left out of the Lot Area scatterplots
+    {'name': 'large_lot_garage', 'kind': 'threshold',
+     'when': [('LotArea', '>', 55000), ('GarageArea', '<', 500000)]},
+    {'name': 'large_lot', 'kind': 'threshold',
+     'when': [('LotArea', '>', 55000), ('SalePrice', '<', 500000)]},
+]
+# The rules whose rows the models leave out with --drop-outliers: the
+# outliers EDA.py deletes before its plots
+MODEL_RULES = ['large_cheap_house']
+
+
+def _rule_hits(df, rule):
+    kind = rule['kind']
+    if kind == 'threshold':
+        hits = np.ones(len(df), dtype=bool)
+        for col, op, value in rule['when']:
+            hits &= OPERATORS[op](df[col].to_numpy(), value)
+        return hits
+    values = df[rule['column']].to_numpy(dtype=np.float64)
+    if kind == 'zscore':
+        median = np.nanmedian(values)
+        mad = np.nanmedian(np.abs(values - median))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z = 0.6745 * (values - median) / mad
+        return np.abs(z) > rule.get('limit', 3.5)
+    if kind == 'iqr':
+        q1, q3 = np.nanpercentile(values, [25, 75])
+        k = rule.get('k', 1.5) * (q3 - q1)
+        return (values < q1 - k) | (values > q3 + k)
+    raise ValueError("Unknown outlier rule kind: %s" % kind)
+
+
+# Evaluate every rule into one bitmask (bit i set when rule i flags the row)
+# and count the rows each rule flags
+def outlier_mask(df, rules=OUTLIER_RULES):
+    if len(rules) > 64:
+        raise ValueError("At most 64 outlier rules fit in the mask")
+    bits = np.zeros(len(df), dtype=np.uint64)
+    counts = {}
+    for i, rule in enumerate(rules):
+        hits = _rule_hits(df, rule)
+        bits |= hits.astype(np.uint64) << np.uint64(i)
+        counts[rule['name']] = int(hits.sum())
+    return bits, pd.Series(counts, name='Rows')
+
+
+# Boolean array of the rows flagged by none of the selected rules (all rules
+# by default). rules are the rules the mask was built with, or their names
+# as returned by load_mask().
+def keep_rows(bits, rules=OUTLIER_RULES, names=None):
+    selected = np.uint64(0)
+    for i, rule in enumerate(rules):
+        name = rule['name'] if isinstance(rule, dict) else rule
+        if names is None or name in names:
+            selected |= np.uint64(1) << np.uint64(i)
+    return (bits & selected) == 0
+
+
+# Only the given columns of the kept rows. pandas copies the rows selected
+# by a boolean mask, so this copies the named columns of the kept rows and
+# never the rest of the frame.
+def masked(df, keep, columns):
+    return df.loc[keep, list(columns)]
+
+
+# Store the mask; ids, the Id of each row, let drop_outliers() match the rows
+# of a frame that has grown since
+def save_mask(bits, path, rules=OUTLIER_RULES, ids=None):
+    arrays = {'bits': bits,
+              'names': np.array([rule['name'] for rule in rules])}
+    if ids is not None:
+        arrays['ids'] = np.asarray(ids)
+    np.savez(path, **arrays)
+
+
+def load_mask(path):
+    with np.load(path) as data:
+        return data['bits'], list(data['names'])
+
+
+# Mask file stored next to a cleaned dataset, e.g.
+# Cleaned_train.outliers.npz for Cleaned_train
+def mask_path(data):
+    return os.path.splitext(data)[0] + '.outliers.npz'
+
+
+# The rows of df not flagged by the named rules of a stored mask. Rows are
+# matched by Id when the mask has them, so the rows appended since
+# (refresh.py) are kept; otherwise the mask must cover the rows of df in
+# order.
+def drop_outliers(df, path, names=MODEL_RULES):
+    with np.load(path) as data:
+        bits, rules = data['bits'], list(data['names'])
+        ids = data['ids'] if 'ids' in data else None
+    flagged = ~keep_rows(bits, rules, names)
+    if ids is not None:
+        return df[~df[ID_COL].isin(ids[flagged])]
+    if len(bits) != len(df):
+        raise ValueError("The outlier mask %s covers %d rows, the data has %d"
+                         % (path, len(bits), len(df)))
+    return df[~flagged]
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-aggregated data for the box plots, scatter plots and normality plots.
+
+seaborn regroups the rows and recomputes the quartiles on every render, and
+a scatter plot draws every point, so at millions of rows the figures of
+EDA.py are slow and their files large. This module reduces the rows to
+compact summaries that the figure functions render instead:
+
+- box_stats: per level of x the quartiles, whiskers and a bounded sample of
+  the outliers of y, from one sort of the rows. The summaries are the bxp()
+  input of matplotlib and are drawn with functions.summary_box_plot.
+- density_grid: a 2D histogram of y against x, with an optional least
+  squares line, drawn with functions.density_plot.
+- normality_summary: skew, kurtosis and normality tests of a column with a
+  histogram, binned KDE, bounded QQ points and box statistics, drawn by
+  functions.plotting_3_charts for columns over HOUSE_DIAGNOSTICS_ROWS rows.
+
+Summaries are computed through the stage cache with cached_summary(), so
+the figures that show the same data in another style reuse them. Scatter
+inputs up to HOUSE_SCATTER_LIMIT rows are still drawn point by point.
+
+Usage:
+    summary = cached_summary(box_stats, df[['OverallQual', 'SalePrice']],
+                             x='OverallQual')
+    func, data = scatter_source(df[['GrLivArea', 'SalePrice']], 'GrLivArea',
+                                fit=True)
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import sketches
+from cache import cached_stage
+
+# Scatter plots of more rows than this are drawn as density grids
+SCATTER_LIMIT = int(os.environ.get('HOUSE_SCATTER_LIMIT', 50000))
+# Outliers kept per box, and bins per axis of a density grid
+MAX_FLIERS = 100
+GRID_BINS = 200
+
+
+# Levels of x in the order seaborn draws them: the categories of a
+# categorical, sorted numbers, otherwise order of appearance. Levels without
+# rows are left out.
+def _levels(values):
+    observed = pd.unique(values)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        present = set(observed)
+        return [c for c in values.cat.categories if c in present]
+    if pd.api.types.is_numeric_dtype(values):
+        return sorted(observed)
+    return list(observed)
+
+
+# Evenly spaced sample of at most n sorted values, keeping both extremes
+def _spread(values, n):
+    if len(values) <= n:
+        return values
+    return values[np.unique(np.linspace(0, len(values) - 1, n).round()
+                            .astype(int))]
+
+
+# The bxp() statistics of one group of sorted values
+def _box(label, values, whis, max_fliers):
+    q1, med, q3 = np.percentile(values, [25, 50, 75])
+    lo, hi = q1 - whis * (q3 - q1), q3 + whis * (q3 - q1)
+    start = np.searchsorted(values, lo, side='left')
+    end = np.searchsorted(values, hi, side='right')
+    fliers = np.concatenate([values[:start], values[end:]])
+    return {'label': str(label), 'med': med, 'q1': q1, 'q3': q3,
+            'whislo': values[start] if start < end else q1,
+            'whishi': values[end - 1] if start < end else q3,
+            'mean': values.mean(), 'count': len(values),
+            'fliers': _spread(fliers, max_fliers)}
+
+
+# Five-number summary of y for each level of x, with the whiskers at whis
+# times the interquartile range like seaborn and matplotlib, and at most
+# max_fliers outliers per level. The rows are sorted once by level and
+# value and every group is summarised from its slice.
+def box_stats(df, x, y='SalePrice', whis=1.5, max_fliers=MAX_FLIERS):
+    data = df[[x, y]].dropna()
+    levels = _levels(data[x])
+    codes = pd.Categorical(data[x], categories=levels).codes
+    values = data[y].to_numpy(dtype=np.float64)
+    order = np.lexsort((values, codes))
+    values = values[order]
+    sizes = np.bincount(codes, minlength=len(levels))
+    bounds = np.concatenate([[0], np.cumsum(sizes)])
+    stats = [_box(level, values[bounds[i]:bounds[i + 1]], whis, max_fliers)
+             for i, level in enumerate(levels)]
+    return {'x': x, 'y': y, 'rows': len(data), 'stats': stats}
+
+
+# Counts of the rows in a bins x bins grid over the range of x and y, and
+# with fit the slope and intercept of the least squares line of y on x
+def density_grid(df, x, y='SalePrice', bins=GRID_BINS, fit=False):
+    data = df[[x, y]].dropna()
+    xs = data[x].to_numpy(dtype=np.float64)
+    ys = data[y].to_numpy(dtype=np.float64)
+    counts, xedges, yedges = np.histogram2d(xs, ys, bins=bins)
+    line = tuple(np.polyfit(xs, ys, 1)) if fit and len(data) > 1 else None
+    return {'x': x, 'y': y, 'rows': len(data),
+            'counts': counts.astype(np.int64), 'xedges': xedges,
+            'yedges': yedges, 'line': line}
+
+
+# A summary through the stage cache, keyed by the frame and the parameters
+def cached_summary(func, df, **params):
+    return cached_stage(func.__name__, lambda: func(df, **params),
+                        inputs=[df], params=params,
+                        depends=[func, sys.modules[__name__], sketches])
+
+
+# The figure function and data for a scatter plot of y against x: the rows
+# themselves up to limit rows, otherwise a cached density grid. Points
+# coloured by hue can't be binned into one grid, so they are drawn from an
+# evenly spaced sample of limit rows instead.
+def scatter_source(df, x, y='SalePrice', fit=False, hue=None,
+                   limit=SCATTER_LIMIT):
+    from functions import density_plot, reg_plot, scatter_plot
+
+    if len(df) <= limit:
+        return (reg_plot if fit else scatter_plot), df
+    if hue is not None:
+        step = -(-len(df) // limit)
+        return scatter_plot, df.iloc[::step]
+    return density_plot, cached_summary(density_grid, df, x=x, y=y, fit=fit)
+
+
+## Normality diagnostics
+
+# Columns of more rows than this get the diagnostics version of the
+# histogram, QQ plot and box plot of functions.plotting_3_charts
+DIAGNOSTICS_ROWS = int(os.environ.get('HOUSE_DIAGNOSTICS_ROWS', 100000))
+# Points drawn on the QQ plot, size of the quantile sketch they are read
+# from and of the chunks it is fed, cells of the KDE grid and size of the
+# subsample that is tested
+QQ_POINTS = 500
+QQ_SKETCH = 2000
+QQ_CHUNK = 1 << 16
+KDE_GRID = 1024
+TEST_SAMPLE = 5000
+# Histogram bins, at most, as in seaborn's distplot
+MAX_BINS = 50
+
+
+# Percentiles of sorted values, interpolated linearly like np.percentile
+def _sorted_percentiles(ordered, qs):
+    pos = np.asarray(qs, dtype=np.float64) / 100 * (len(ordered) - 1)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (pos - lo) * (ordered[hi] - ordered[lo])
+
+
+# Freedman-Diaconis bins of n values with the given quartiles and range, at
+# most MAX_BINS: the histogram bins of seaborn's distplot
+def _fd_bins(n, q1, q3, span):
+    if n < 2:
+        return 1
+    width = 2 * (q3 - q1) / n ** (1 / 3)
+    bins = int(np.ceil(span / width)) if width > 0 else int(np.sqrt(n))
+    return max(min(bins, MAX_BINS), 1)
+
+
+# The bins of sorted values, which both versions of the histogram keep
+def histogram_bins(ordered):
+    if len(ordered) < 2:
+        return 1
+    q1, q3 = _sorted_percentiles(ordered, [25, 75])
+    return _fd_bins(len(ordered), q1, q3, ordered[-1] - ordered[0])
+
+
+# Medians of the uniform order statistics of ranks (1-based) out of n, the
+# plotting positions of scipy's probplot
+def _order_medians(n, ranks):
+    probs = (ranks - 0.3175) / (n + 0.365)
+    probs[ranks == 1] = 1 - 0.5 ** (1 / n)
+    probs[ranks == n] = 0.5 ** (1 / n)
+    return probs
+
+
+# Gaussian KDE with Scott's bandwidth, binned onto a grid and convolved with
+# the kernel by FFT, so its cost depends on the grid and not on the rows
+def _binned_kde(values, sd, grid=KDE_GRID):
+    n = len(values)
+    if n < 2 or not sd > 0:
+        return None
+    from scipy import stats
+
+    bw = sd * n ** (-1 / 5)
+    lo, hi = values.min() - 3 * bw, values.max() + 3 * bw
+    counts, edges = np.histogram(values, bins=grid, range=(lo, hi))
+    dx = edges[1] - edges[0]
+    half = int(np.ceil(4 * bw / dx))
+    kernel = stats.norm.pdf(np.arange(-half, half + 1) * dx, scale=bw)
+    size = grid + 2 * half
+    density = np.fft.irfft(np.fft.rfft(counts, size)
+                           * np.fft.rfft(kernel, size), size)
+    return {'x': (edges[:-1] + edges[1:]) / 2,
+            'density': np.maximum(density[half:half + grid], 0) / n,
+            'bandwidth': bw}
+
+
+# Anderson-Darling test for normality: the statistic and, on SciPy versions
+# that compute it, a p-value
+def _anderson(sample):
+    from scipy import stats
+
+    try:
+        result = stats.anderson(sample, 'norm', method='interpolate')
+        return {'statistic': float(result.statistic),
+                'pvalue': float(result.pvalue)}
+    except TypeError:
+        return {'statistic': float(stats.anderson(sample, 'norm').statistic),
+                'pvalue': None}
+
+
+# Normality statistics and the data of the histogram, KDE, QQ plot and box
+# plot of a column, bounded whatever its length. The moments, histogram and
+# whiskers are exact and take a pass over the values each; the QQ points and
+# quartiles of a column longer than qq_points are read from a seeded
+# quantile sketch fed in chunks of QQ_CHUNK values, so the column is never
+# sorted and the cost grows linearly with its length; only the fliers are
+# sorted. The Shapiro-Wilk and Anderson-Darling tests run on a seeded random
+# subsample of sample rows (their p-values are not meaningful for very large
+# samples anyway), while the Jarque-Bera test uses the exact moments.
+def normality_summary(df, feature, qq_points=QQ_POINTS, sample=TEST_SAMPLE,
+                      seed=0):
+    from scipy import stats
+    from sketches import (kurt, moments, quantile_sketch, skew,
+                          sketch_quantiles, std, update_quantiles)
+
+    values = df[feature].to_numpy(dtype=np.float64)
+    values = values[~np.isnan(values)]
+    n = len(values)
+    m = moments(values)
+    sd = std(m)
+    ranks = np.unique(np.linspace(1, n, min(qq_points, n)).round())
+    theoretical = stats.norm.ppf(_order_medians(n, ranks))
+    if n <= qq_points:
+        ordered = np.sort(values)
+        q1, med, q3 = _sorted_percentiles(ordered, [25, 50, 75])
+    else:
+        sketch = quantile_sketch(QQ_SKETCH, seed)
+        for start in range(0, n, QQ_CHUNK):
+            update_quantiles(sketch, values[start:start + QQ_CHUNK])
+        ordered = sketch_quantiles(sketch, (ranks - 0.5) / n)
+        ordered[[0, -1]] = m['min'], m['max']
+        q1, med, q3 = sketch_quantiles(sketch, [.25, .5, .75])
+    fit = stats.linregress(theoretical, ordered)
+
+    bins = _fd_bins(n, q1, q3, m['max'] - m['min'])
+    counts, edges = np.histogram(values, bins=bins)
+
+    lo, hi = q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)
+    inside = values[(values >= lo) & (values <= hi)]
+    fliers = np.sort(values[(values < lo) | (values > hi)])
+    box = {'label': feature, 'med': med, 'q1': q1, 'q3': q3,
+           'whislo': inside.min() if len(inside) else q1,
+           'whishi': inside.max() if len(inside) else q3,
+           'fliers': _spread(fliers, MAX_FLIERS)}
+
+    tested = values
+    if n > sample:
+        tested = np.random.default_rng(seed).choice(values, sample,
+                                                    replace=False)
+    g1 = (m['m3'] / n) / (m['m2'] / n) ** 1.5
+    g2 = (m['m4'] / n) / (m['m2'] / n) ** 2 - 3
+    jb = n / 6 * (g1 ** 2 + g2 ** 2 / 4)
+    shapiro = stats.shapiro(tested)
+    return {'feature': feature, 'n': n, 'mean': m['mean'], 'std': sd,
+            'skew': skew(m), 'kurtosis': kurt(m),
+            'hist': {'counts': counts, 'edges': edges},
+            'kde': _binned_kde(values, sd),
+            'qq': {'theoretical': theoretical, 'ordered': ordered,
+                   'slope': fit.slope, 'intercept': fit.intercept,
+                   'r': fit.rvalue},
+            'box': box,
+            'tests': {'sample': len(tested),
+                      'shapiro': {'statistic': float(shapiro.statistic),
+                                  'pvalue': float(shapiro.pvalue)},
+                      'anderson': _anderson(tested),
+                      'jarque_bera': {'statistic': float(jb),
+                                      'pvalue': float(stats.chi2.sf(jb, 2))}}}
+
+
+# The statistics of a normality summary as a one-row frame
+def normality_table(summary):
+    tests = summary['tests']
+    row = {'count': summary['n'], 'Skew': summary['skew'],
+           'Kurtosis': summary['kurtosis'], 'QQ r': summary['qq']['r'],
+           'Tested rows': tests['sample']}
+    for name in ('shapiro', 'anderson', 'jarque_bera'):
+        row['%s stat' % name] = tests[name]['statistic']
+        row['%s p' % name] = tests[name]['pvalue']
+    return pd.DataFrame([row], index=[summary['feature']])
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel, headless rendering of the report figures.
+
+Every figure of EDA.py and data_cleaning.py is described by a plot job: the
+figure function from functions.py, the data it needs, its keyword arguments
+and its own matplotlib/seaborn style. Jobs do not depend on global pyplot
+state, so they render independently on the Agg backend in a process pool.
+Each figure is written to the output directory and closed after saving, and
+a job whose data, arguments and code are unchanged is copied from the stage
+cache instead of being rendered again.
+"""
+import importlib
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from instrument import add_records, stage, take_records
+
+# Plots go to the directory given by HOUSE_PLOT_DIR, plots/ by default
+OUTPUT_DIR = os.environ.get('HOUSE_PLOT_DIR', 'plots')
+# Modules the figure functions draw with; a cached figure is keyed on their
+# whole source, so editing a helper, a summary or the save code re-renders it
+FIGURE_MODULES = ('functions', 'plot_data', 'sketches')
+
+
+# Describe one figure. data is passed to func as its first argument and only
+# the columns in data are sent to the worker, so pass the columns the figure
+# needs. style is a matplotlib style, sns_style/context/font_scale the
+# seaborn settings applied on top of it.
+def plot_job(func, filename, data, style='default', sns_style=None,
+             context='notebook', font_scale=1, cache=True, **kwargs):
+    return {'func': func, 'filename': filename, 'data': data,
+            'style': style, 'sns_style': sns_style, 'context': context,
+            'font_scale': font_scale, 'cache': cache, 'kwargs': kwargs}
+
+
+def _init_worker():
+    import matplotlib
+
+    matplotlib.use('Agg')
+    # Drop the stage records inherited from a forked parent
+    take_records()
+
+
+# Render one job inside its own style context
+def render_job(job, out_dir=OUTPUT_DIR):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from cache import cached_file
+
+    func, data, kwargs = job['func'], job['data'], job['kwargs']
+
+    def render(path):
+        with plt.style.context(job['style']), \
+                sns.axes_style(job['sns_style']), \
+                sns.plotting_context(job['context'],
+                                     font_scale=job['font_scale']):
+            func(data, path, **kwargs)
+
+    path = os.path.join(out_dir, job['filename'])
+    depends = [func, sys.modules[func.__module__]]
+    depends += [importlib.import_module(name) for name in FIGURE_MODULES]
+    with stage('plot ' + job['filename'], rows_in=data):
+        if job['cache']:
+            cached_file(os.path.splitext(job['filename'])[0], render, path,
+                        inputs=[data],
+                        params=dict(kwargs, style=job['style'],
+                                    sns_style=job['sns_style'],
+                                    context=job['context'],
+                                    font_scale=job['font_scale']),
+                        depends=depends)
+        else:
+            render(path)
+    return path
+
+
+# Render a job in a worker and hand its stage records back to the parent
+def _render_in_worker(job, out_dir):
+    path = render_job(job, out_dir)
+    return path, take_records()
+
+
+# Render all jobs on the Agg backend, in parallel unless processes is 1
+def render_jobs(jobs, out_dir=OUTPUT_DIR, processes=None):
+    os.makedirs(out_dir, exist_ok=True)
+    if processes == 1 or len(jobs) <= 1:
+        _init_worker()
+        return [render_job(job, out_dir) for job in jobs]
+    # Forked workers do not re-import the calling script, which is plain
+    # top-level code; spawn is only used where fork is unavailable
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(
+            'fork' if 'fork' in methods else None)
+    with ProcessPoolExecutor(processes, mp_context=context,
+                             initializer=_init_worker) as pool:
+        results = list(pool.map(_render_in_worker, jobs, repeat(out_dir)))
+    for _, recs in results:
+        add_records(recs)
+    return [path for path, _ in results]
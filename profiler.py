@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Single-pass missing-value profiler.
+
+For every column the profiler records the number of missing values and the
+dtype, from one vectorized null count over the frame. The number of distinct
+values is only computed when asked for (distinct=True), as it costs a hash
+of every value. A profile can be built from a whole frame or updated chunk
+by chunk (csv chunks, Parquet row groups), and profile_frame() caches its
+result so repeat calls on an unchanged frame are free. missing_table() turns
+a profile into the Variable/Total/Percent layout used by missing() and
+plot_missing_data().
+"""
+import weakref
+
+import numpy as np
+import pandas as pd
+
+# Distinct values are tracked exactly up to this many per column, after which
+# the column is reported with at least this cardinality
+MAX_DISTINCT = 10000
+
+_cache = {}
+
+
+# An empty profile to be filled with update_profile(); with distinct the
+# distinct values of every column are tracked as well
+def new_profile(distinct=False):
+    return {'rows': 0, 'columns': [], 'nulls': {}, 'dtypes': {},
+            'distinct': {} if distinct else None}
+
+
+# The distinct non-missing values of a chunk's column. A categorical column
+# is summarised from its codes, without turning its values into objects.
+def _uniques(values):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy()
+        used = np.bincount(codes[codes >= 0],
+                           minlength=len(values.cat.categories)) > 0
+        return values.cat.categories[used].tolist()
+    return values.dropna().unique().tolist()
+
+
+# Add one chunk to a profile. The missing values of all columns are counted
+# in one vectorized pass; the distinct values only if the profile tracks
+# them.
+def update_profile(profile, chunk, max_distinct=MAX_DISTINCT):
+    nulls = chunk.isnull().sum().to_numpy()
+    distinct = profile['distinct']
+    for j, (col, dtype) in enumerate(chunk.dtypes.items()):
+        if col not in profile['nulls']:
+            profile['columns'].append(col)
+            profile['nulls'][col] = 0
+            profile['dtypes'][col] = str(dtype)
+            if distinct is not None:
+                distinct[col] = set()
+        elif profile['dtypes'][col] != str(dtype):
+            profile['dtypes'][col] = 'object'
+        profile['nulls'][col] += int(nulls[j])
+        if distinct is not None and distinct[col] is not None:
+            distinct[col].update(_uniques(chunk.iloc[:, j]))
+            if len(distinct[col]) > max_distinct:
+                distinct[col] = None
+    profile['rows'] += len(chunk)
+    return profile
+
+
+# Profile a stream of chunks
+def profile_chunks(chunks, distinct=False, max_distinct=MAX_DISTINCT):
+    profile = new_profile(distinct)
+    for chunk in chunks:
+        update_profile(profile, chunk, max_distinct)
+    return profile
+
+
+# Yield the row groups of a Parquet file as frames
+def iter_row_groups(path, columns=None):
+    import pyarrow.parquet as pq
+    parquet = pq.ParquetFile(path)
+    for i in range(parquet.num_row_groups):
+        yield parquet.read_row_group(i, columns=columns).to_pandas()
+
+
+def profile_parquet(path, columns=None, distinct=False,
+                    max_distinct=MAX_DISTINCT):
+    return profile_chunks(iter_row_groups(path, columns), distinct,
+                          max_distinct)
+
+
+# Identity of the data behind a column, through public APIs only. NumPy,
+# datetime and timedelta columns are wrapped anew on every Series.array
+# access, so they are identified by the address of the buffer they view;
+# other extension arrays are stored as they are and identified by id().
+def _column_id(values):
+    if isinstance(values, (pd.arrays.DatetimeArray, pd.arrays.TimedeltaArray)):
+        values = values.view('i8')
+    elif not isinstance(values, pd.arrays.NumpyExtensionArray):
+        return id(values)
+    return np.asarray(values).__array_interface__['data'][0]
+
+
+# Frames are identified by their column labels and the identity of their
+# column data, so dropping or reassigning a column invalidates the cache.
+# Values written in place with .loc/.iloc are not detected; use cache=False
+# for frames modified that way.
+def _fingerprint(df):
+    return (df.shape, tuple(df.columns),
+            tuple(_column_id(values.array) for _, values in df.items()))
+
+
+# Profile a frame, reusing the last result for an unchanged frame (one
+# without distinct values only serves calls that don't ask for them)
+def profile_frame(df, cache=True, distinct=False, max_distinct=MAX_DISTINCT):
+    key = id(df)
+    if cache and key in _cache:
+        ref, fingerprint, profile = _cache[key]
+        if (ref() is df and fingerprint == _fingerprint(df)
+                and (not distinct or profile['distinct'] is not None)):
+            return profile
+    profile = update_profile(new_profile(distinct), df, max_distinct)
+    if cache:
+        _cache[key] = (weakref.ref(df, lambda _, key=key: _cache.pop(key,
+                                                                     None)),
+                       _fingerprint(df), profile)
+    return profile
+
+
+# One row per column: missing count and percentage, dtype and cardinality
+# (NaN when not tracked or above max_distinct)
+def profile_table(profile):
+    rows = max(profile['rows'], 1)
+    cols = profile['columns']
+    total = np.array([profile['nulls'][c] for c in cols], dtype=np.int64)
+    tracked = profile['distinct'] or {}
+    distinct = [len(tracked[c]) if tracked.get(c) is not None else np.nan
+                for c in cols]
+    return pd.DataFrame({'Variable': cols,
+                         'Total': total,
+                         'Percent': total / rows * 100,
+                         'Dtype': [profile['dtypes'][c] for c in cols],
+                         'Distinct': distinct})
+
+
+# Columns with missing values, most missing first
+def missing_table(profile):
+    table = profile_table(profile)[['Variable', 'Total', 'Percent']]
+    table = table[table['Total'] != 0]
+    return table.sort_values('Total', ascending=False,
+                             kind='mergesort').reset_index(drop=True)
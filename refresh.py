@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental daily refresh of the cleaned data.
+
+data_cleaning.py rebuilds everything from the raw files. When the feed only
+adds a few thousand sales a day, the refresh ingests just the new shards
+instead, against a persisted state written by the last full run:
+
+- the fitted cleaner (drop list and fill values, see cleaning.py),
+- the scan of the raw training data behind it: row count, missing values
+  per column and the value counts of the imputed columns, kept as
+  Misra-Gries heavy hitters so the state stays bounded,
+- the correlation sufficient statistics of the cleaned training data,
+- the shard files already ingested, by content digest.
+
+The new rows are cleaned with the stored cleaner unchanged, so old and new
+rows are imputed alike, and appended to the cleaned store (part files next
+to the Feather files, the end of the CSV exports). The counters and the
+correlation statistics are updated from the new rows only, so a refresh
+costs O(new rows). When a column's missing percentage crosses the drop
+threshold or the columns of the feed change, the refresh says so: the
+cleaning decisions then need a full re-plan with data_cleaning.py. Modes
+that moved away from the stored fill values are reported as well.
+
+Usage:
+    python refresh.py "Data/daily/train_2026-10-18*.csv"
+refreshes with the training shards not yet ingested and exits with status 1
+when a full re-plan is needed.
+"""
+import argparse
+import os
+import pickle
+import sys
+
+import numpy as np
+import pandas as pd
+
+from cache import file_digest
+from cleaning import (DROP_COLS, MISSING_THRESHOLD, TARGET, apply_cleaner,
+                      merge_scans, missing_from_scan, mode_from_counts,
+                      scan_chunk)
+from correlation import save_corr_stats, update_corr_stats
+from ingest import DATA_DIR, find_shards
+from storage import FORMATS, append_cleaned
+
+STATE_FILE = os.environ.get('HOUSE_REFRESH_STATE', 'refresh_state.pkl')
+# Counters kept per imputed column; modes are exact unless a column has
+# more distinct values than this (see sketches.py for the error bound)
+TOP_K = 1000
+
+
+# The state after a full run, from the raw training frame (with the log
+# SalePrice), the cleaner fitted on it, the correlation statistics of the
+# cleaned training frame and the raw shards that were read
+def new_state(raw_train, cleaner, corr, train_paths=(), test_paths=(),
+              top_k=TOP_K):
+    impute_cols = list(cleaner['fill'])
+    scan = merge_scans(None, scan_chunk(raw_train, impute_cols), top_k)
+    return {'cleaner': cleaner, 'scan': scan, 'corr': corr,
+            'top_k': top_k,
+            'ingested': {os.path.abspath(p): file_digest(p)
+                         for p in list(train_paths) + list(test_paths)}}
+
+
+def save_state(state, path=STATE_FILE):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def load_state(path=STATE_FILE):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+# Shards whose path and contents have not been ingested yet
+def new_shards(state, paths):
+    ingested = state['ingested']
+    return [p for p in paths
+            if ingested.get(os.path.abspath(p)) != file_digest(p)]
+
+
+def _percent(scan):
+    table = missing_from_scan(scan)
+    return table.set_index('Variable')['Percent']
+
+
+# What the new rows change in the cleaning decisions: columns whose missing
+# percentage crossed the threshold (a kept column that should now be dropped
+# or the reverse) and columns that appeared in or disappeared from the feed
+# need a full re-plan. Imputed columns with missing values whose mode
+# changed are reported too, but the stored fill value stays valid.
+def check_state(old_scan, new_scan, cleaner, delta_columns,
+                threshold=MISSING_THRESHOLD):
+    before, after = _percent(old_scan), _percent(new_scan)
+    crossings = []
+    for col, percent in after.items():
+        was = before.get(col, 0.0)
+        dropped = percent > threshold
+        # Columns dropped by judgement stay dropped whatever their count
+        if ((was > threshold) == dropped or col in DROP_COLS
+                or (col in cleaner['drop']) == dropped):
+            continue
+        crossings.append({'column': col, 'before': float(was),
+                          'after': float(percent),
+                          'action': 'drop' if dropped else 'keep'})
+    modes = []
+    for col, value in cleaner['fill'].items():
+        if not new_scan['nulls'].get(col, 0):
+            continue
+        mode = mode_from_counts(new_scan['counts'].get(col))
+        mode = mode.item() if hasattr(mode, 'item') else mode
+        if mode == mode and mode != value:
+            modes.append({'column': col, 'fill': value, 'mode': mode})
+    known = set(old_scan['columns'])
+    columns = {'added': [c for c in delta_columns if c not in known],
+               'missing': [c for c in known if c not in delta_columns
+                           and c != TARGET]}
+    return {'crossings': crossings, 'mode_changes': modes,
+            'columns': columns,
+            'replan': bool(crossings or columns['added']
+                           or columns['missing'])}
+
+
+def _read(paths):
+    frames = [pd.read_csv(p) for p in paths]
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+
+# Clean the new rows with the stored cleaner, in the column order of the
+# cleaned files
+def _clean(cleaner, df, target):
+    if target and TARGET in df.columns:
+        df[TARGET] = np.log(df[TARGET])
+    df = apply_cleaner(cleaner, df)
+    columns = [c for c in cleaner['columns'] if c in df.columns]
+    return df[columns]
+
+
+def _append(df, name, formats):
+    for fmt in formats:
+        path = '%s.%s' % (name, fmt)
+        if os.path.exists(path):
+            append_cleaned(df, path)
+
+
+# Ingest new training (and test) shards: update the counters and the
+# correlation statistics, append the cleaned rows and return a report with
+# the number of rows added and the checks of check_state()
+def refresh(state, train_paths=(), test_paths=(), out_dir='.',
+            formats=FORMATS, threshold=MISSING_THRESHOLD):
+    cleaner = state['cleaner']
+    report = {'train_rows': 0, 'test_rows': 0, 'crossings': [],
+              'mode_changes': [], 'columns': {'added': [], 'missing': []},
+              'replan': False}
+    train = _read(train_paths)
+    if train is not None:
+        old_scan = state['scan']
+        state['scan'] = merge_scans(old_scan,
+                                    scan_chunk(train, list(cleaner['fill'])),
+                                    state['top_k'])
+        report.update(check_state(old_scan, state['scan'], cleaner,
+                                  list(train.columns), threshold))
+        cleaned = _clean(cleaner, train, target=True)
+        state['corr'] = update_corr_stats(state['corr'], cleaned)
+        _append(cleaned, os.path.join(out_dir, 'Cleaned_train'), formats)
+        save_corr_stats(state['corr'], os.path.join(out_dir,
+                                                    'corr_stats.npz'))
+        report['train_rows'] = len(cleaned)
+    test = _read(test_paths)
+    if test is not None:
+        cleaned = _clean(cleaner, test, target=False)
+        _append(cleaned, os.path.join(out_dir, 'Cleaned_test'), formats)
+        report['test_rows'] = len(cleaned)
+    for path in list(train_paths) + list(test_paths):
+        state['ingested'][os.path.abspath(path)] = file_digest(path)
+    return report
+
+
+def print_report(report):
+    print("Appended %s training and %s test rows"
+          % (report['train_rows'], report['test_rows']))
+    for c in report['crossings']:
+        print("%s: %.1f%% -> %.1f%% missing, should now be %s"
+              % (c['column'], c['before'], c['after'],
+                 'dropped' if c['action'] == 'drop' else 'kept'))
+    for m in report['mode_changes']:
+        print("%s: mode is now %r, rows are still filled with %r"
+              % (m['column'], m['mode'], m['fill']))
+    for kind, cols in report['columns'].items():
+        if cols:
+            print("Columns %s in the feed: %s" % (kind, ', '.join(cols)))
+    if report['replan']:
+        print("The cleaning decisions are out of date: rerun "
+              "data_cleaning.py for a full re-plan")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Append new sales to the "
+                                                 "cleaned data")
+    parser.add_argument('train', nargs='?', default=DATA_DIR,
+                        help="directory, glob pattern or file of training "
+                             "shards")
+    parser.add_argument('--test', help="directory, glob pattern or file of "
+                                       "test shards")
+    parser.add_argument('--state', default=STATE_FILE)
+    args = parser.parse_args()
+    state = load_state(args.state)
+    train_paths = new_shards(state, find_shards(args.train, 'train*.csv'))
+    test_paths = (new_shards(state, find_shards(args.test, 'test*.csv'))
+                  if args.test else [])
+    report = refresh(state, train_paths, test_paths)
+    save_state(state, args.state)
+    print_report(report)
+    sys.exit(1 if report['replan'] else 0)
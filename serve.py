@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Single-listing prediction service.
+
+A small asyncio HTTP server (standard library only) that keeps the fitted
+cleaner and model in memory. POST /predict with a JSON listing (or a list of
+listings) returns the predicted SalePrice. A listing goes straight into a row
+of a preallocated float32 feature matrix: numbers are copied, missing fields
+take the cleaner's fill value and text fields are looked up in grade and
+category maps compiled once at startup from the model's feature index
+(features.py), so no DataFrame is built per request. Concurrent requests
+are gathered into micro-batches and predicted together, and the derived
+features are computed for a whole micro-batch at once.
+
+Usage:
+    python serve.py --model model.pkl --cleaner cleaner.json --port 8000
+    python load_test.py --port 8000
+"""
+import argparse
+import asyncio
+import json
+import os
+
+import numpy as np
+
+from cleaning import load_cleaner
+from features import UNKNOWN, add_derived
+from model import load_model, predict_log
+
+# A micro-batch is predicted when it is full or when its first request has
+# waited this long
+MAX_BATCH = 64
+MAX_WAIT = 0.002
+
+
+# Turn the feature index of the model into per-column matrix positions,
+# fill values and grade or category maps. Derived columns are not read from
+# the listing; they are computed from the matrix with features.add_derived.
+def compile_encoder(artifact, cleaner=None):
+    encoder = artifact['encoder']
+    fill = cleaner['fill'] if cleaner else {}
+    means = artifact['ridge']['mean']
+    numeric, ordinal = [], []
+    for j, col in enumerate(encoder['numeric']):
+        if col in encoder['ordinal']:
+            scale = encoder['ordinal'][col]
+            ordinal.append((j, col, scale, scale.get(str(fill.get(col)), 0)))
+        elif col not in encoder['derived']:
+            numeric.append((j, col, float(fill.get(col, means[j]))))
+    categorical = []
+    for j, (col, categories) in enumerate(encoder['categorical'].items(),
+                                          start=len(encoder['numeric'])):
+        index = {value: code for code, value in enumerate(categories)}
+        default = index.get(str(fill.get(col)), UNKNOWN)
+        categorical.append((j, col, index, default))
+    return {'numeric': numeric, 'ordinal': ordinal,
+            'categorical': categorical}
+
+
+# Write one listing into row i of the feature matrix
+def encode_record(compiled, record, X, i):
+    row = X[i]
+    for j, col, default in compiled['numeric']:
+        value = record.get(col)
+        row[j] = default if value is None or value != value else value
+    for j, col, scale, default in compiled['ordinal']:
+        value = record.get(col)
+        row[j] = default if value is None or value != value \
+            else scale.get(str(value), 0)
+    for j, col, index, default in compiled['categorical']:
+        value = record.get(col)
+        row[j] = default if value is None or value != value \
+            else index.get(str(value), UNKNOWN)
+
+
+class Predictor:
+    """Micro-batching predictor around a preallocated feature matrix."""
+
+    def __init__(self, artifact, cleaner=None, model='gbm',
+                 max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+        self.artifact = artifact
+        self.model = model
+        self.compiled = compile_encoder(artifact, cleaner)
+        encoder = artifact['encoder']
+        width = len(encoder['numeric']) + len(encoder['categorical'])
+        self.X = np.empty((max_batch, width), dtype=np.float32)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+
+    async def predict(self, record):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((record, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(),
+                                                        timeout))
+                except asyncio.TimeoutError:
+                    break
+            self._predict_batch(batch)
+
+    # A listing that fails to encode (a value out of the float32 range, a
+    # nested object, ...) fails its own request only; a failure of the
+    # prediction fails the requests of the batch. Either way the batcher
+    # keeps running.
+    def _predict_batch(self, batch):
+        ok = []
+        for record, future in batch:
+            try:
+                encode_record(self.compiled, record, self.X, len(ok))
+                ok.append(future)
+            except Exception as error:
+                _fail(future, error)
+        if not ok:
+            return
+        try:
+            X = add_derived(self.artifact['encoder'], self.X[:len(ok)])
+            prices = np.exp(predict_log(self.artifact, X, self.model))
+        except Exception as error:
+            for future in ok:
+                _fail(future, error)
+            return
+        for future, price in zip(ok, prices):
+            if not future.cancelled():
+                future.set_result(float(price))
+
+
+def _fail(future, error):
+    if not future.cancelled():
+        future.set_exception(error)
+
+
+def _response(writer, status, body):
+    payload = json.dumps(body).encode()
+    writer.write(b'HTTP/1.1 %s\r\nContent-Type: application/json\r\n'
+                 b'Content-Length: %d\r\nConnection: keep-alive\r\n\r\n'
+                 % (status.encode(), len(payload)) + payload)
+
+
+# Method, path, lower-cased headers and body length of a request head;
+# ValueError for a malformed request line, header or Content-Length
+def _parse_head(head):
+    lines = head.decode('latin-1').split('\r\n')
+    parts = lines[0].split(' ')
+    if len(parts) != 3:
+        raise ValueError("Malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            if ':' not in line:
+                raise ValueError("Malformed header")
+            key, value = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise ValueError("Invalid Content-Length") from None
+    if length < 0:
+        raise ValueError("Invalid Content-Length")
+    return parts[0], parts[1], headers, length
+
+
+# Serve HTTP/1.1 requests on one keep-alive connection
+async def handle(predictor, reader, writer):
+    try:
+        while True:
+            head = await reader.readuntil(b'\r\n\r\n')
+            try:
+                method, path, headers, length = _parse_head(head)
+            except ValueError as error:
+                # The end of the request can't be found, so the connection
+                # is closed after the reply
+                _response(writer, '400 Bad Request', {'error': str(error)})
+                await writer.drain()
+                break
+            body = await reader.readexactly(length)
+            if method == 'GET' and path == '/health':
+                _response(writer, '200 OK', {'status': 'ok'})
+            elif method == 'POST' and path == '/predict':
+                try:
+                    listing = json.loads(body)
+                    if isinstance(listing, list):
+                        prices = await asyncio.gather(
+                                *[predictor.predict(r) for r in listing])
+                        _response(writer, '200 OK', {'SalePrice': prices})
+                    else:
+                        price = await predictor.predict(listing)
+                        _response(writer, '200 OK', {'SalePrice': price})
+                except Exception as error:
+                    _response(writer, '400 Bad Request',
+                              {'error': '%s: %s' % (type(error).__name__,
+                                                    error)})
+            else:
+                _response(writer, '404 Not Found', {'error': 'not found'})
+            await writer.drain()
+            if headers.get('connection', '').lower() == 'close':
+                break
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+            ConnectionResetError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(predictor, host='127.0.0.1', port=8000):
+    batcher = asyncio.ensure_future(predictor.run())
+    server = await asyncio.start_server(
+            lambda r, w: handle(predictor, r, w), host, port)
+    print("Serving on http://%s:%s" % (host, port))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batcher.cancel()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="SalePrice prediction "
+                                                 "service")
+    parser.add_argument('--model', default='model.pkl')
+    parser.add_argument('--cleaner', default='cleaner.json')
+    parser.add_argument('--use', choices=('gbm', 'ridge', 'blend'),
+                        default='gbm')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH)
+    parser.add_argument('--max-wait', type=float, default=MAX_WAIT)
+    args = parser.parse_args()
+    artifact = load_model(args.model)
+    cleaner = load_cleaner(args.cleaner) if os.path.exists(args.cleaner) \
+        else None
+    # The predictor's queue must be created inside the running loop
+    async def main():
+        predictor = Predictor(artifact, cleaner, args.use, args.max_batch,
+                              args.max_wait)
+        await serve(predictor, args.host, args.port)
+    asyncio.run(main())
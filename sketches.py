@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Mergeable sketches for summaries of inputs too large to hold in memory.
+
+Every summary is built per partition and merged, so partitions of a multi-GB
+feed can be summarized independently (in parallel or one chunk at a time).
+
+- Heavy hitters (Misra-Gries) for categorical modes. With k counters over n
+  values every reported count is an underestimate by at most n / (k + 1), so
+  the reported mode is the exact mode whenever its lead over the runner-up is
+  larger than that bound. Exact path: Series.mode().
+- Quantile sketch (KLL) for describe-style percentiles. With the default
+  k=200 the rank error of a quantile is about 1.7 / k, i.e. the returned value
+  has a true rank within roughly 0.85% of the requested one, using O(k) memory
+  whatever n is. Compactions draw from a generator seeded per sketch, so the
+  same input gives the same sketch on every run. Exact path:
+  Series.describe().
+- Streaming moments for count, mean, std, skew and kurtosis. These merge
+  exactly (Pebay's pairwise formulas), so the only error is floating point.
+  skew() and kurt() use the same bias corrections as Series.skew() and
+  Series.kurt().
+"""
+import numpy as np
+import pandas as pd
+
+## Heavy hitters
+
+# Keep the k largest counters of a Series of value counts, the Misra-Gries
+# way: every counter is lowered by the (k+1)-th largest count and the
+# counters that drop to zero are removed
+def reduce_counts(counts, k):
+    if len(counts) <= k:
+        return counts
+    counts = counts.sort_values(ascending=False, kind='mergesort')
+    counts = counts.iloc[:k] - counts.iloc[k]
+    return counts[counts > 0]
+
+
+# Heavy hitters of a batch of values, as a Series of counts
+def heavy_hitters(values, k=100):
+    return reduce_counts(pd.Series(values).value_counts(), k)
+
+
+def merge_heavy_hitters(left, right, k=100):
+    return reduce_counts(left.add(right, fill_value=0), k)
+
+
+## Quantiles
+
+def quantile_sketch(k=200, seed=0):
+    return {'k': k, 'n': 0, 'levels': [np.empty(0)],
+            'rng': np.random.default_rng(seed)}
+
+
+def _capacity(k, level, height):
+    return max(2, int(np.ceil(k * (2 / 3) ** (height - 1 - level))))
+
+
+# Compact every level above its capacity: sort it and promote every other
+# item (random offset) to the next level, where it counts twice
+def _compress(sketch):
+    levels = sketch['levels']
+    level = 0
+    while level < len(levels):
+        if len(levels[level]) > _capacity(sketch['k'], level, len(levels)):
+            if level + 1 == len(levels):
+                levels.append(np.empty(0))
+            items = np.sort(levels[level])
+            odd = len(items) % 2
+            kept, items = items[len(items) - odd:], items[:len(items) - odd]
+            promoted = items[sketch['rng'].integers(2)::2]
+            levels[level + 1] = np.concatenate([levels[level + 1], promoted])
+            levels[level] = kept
+        level += 1
+    return sketch
+
+
+# Add a batch of values. A batch much larger than k is sorted once and every
+# 2**h-th value goes straight to level h, which is what h compactions of the
+# batch would keep; memory is bounded by the batch, so feed a long column in
+# chunks.
+def update_quantiles(sketch, values):
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    sketch['n'] += len(values)
+    level = 0
+    if len(values) > 2 * sketch['k']:
+        level = int(np.log2(len(values) / sketch['k']))
+        step = 2 ** level
+        values = np.sort(values)[sketch['rng'].integers(step)::step]
+    levels = sketch['levels']
+    while len(levels) <= level:
+        levels.append(np.empty(0))
+    levels[level] = np.concatenate([levels[level], values])
+    return _compress(sketch)
+
+
+def merge_quantiles(left, right):
+    height = max(len(left['levels']), len(right['levels']))
+    levels = []
+    for level in range(height):
+        parts = [s['levels'][level] for s in (left, right)
+                 if level < len(s['levels'])]
+        levels.append(np.concatenate(parts))
+    merged = {'k': left['k'], 'n': left['n'] + right['n'], 'levels': levels,
+              'rng': left['rng']}
+    return _compress(merged)
+
+
+# Approximate quantiles for the probabilities in qs
+def sketch_quantiles(sketch, qs):
+    items = np.concatenate(sketch['levels'])
+    weights = np.concatenate([np.full(len(items_h), 2.0 ** h)
+                              for h, items_h in enumerate(sketch['levels'])])
+    order = np.argsort(items, kind='mergesort')
+    items, cumulative = items[order], np.cumsum(weights[order])
+    ranks = np.asarray(qs, dtype=np.float64) * cumulative[-1]
+    idx = np.searchsorted(cumulative, ranks, side='left')
+    return items[np.clip(idx, 0, len(items) - 1)]
+
+
+## Moments
+
+# Count, mean, central moment sums, min and max of a batch of values
+def moments(values):
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    n = len(values)
+    if n == 0:
+        return {'n': 0, 'mean': 0.0, 'm2': 0.0, 'm3': 0.0, 'm4': 0.0,
+                'min': np.nan, 'max': np.nan}
+    mean = values.mean()
+    d = values - mean
+    d2 = d * d
+    return {'n': n, 'mean': mean, 'm2': d2.sum(), 'm3': (d2 * d).sum(),
+            'm4': (d2 * d2).sum(), 'min': values.min(), 'max': values.max()}
+
+
+def merge_moments(a, b):
+    if a['n'] == 0:
+        return dict(b)
+    if b['n'] == 0:
+        return dict(a)
+    na, nb = a['n'], b['n']
+    n = na + nb
+    delta = b['mean'] - a['mean']
+    m2 = a['m2'] + b['m2'] + delta ** 2 * na * nb / n
+    m3 = (a['m3'] + b['m3'] + delta ** 3 * na * nb * (na - nb) / n ** 2
+          + 3 * delta * (na * b['m2'] - nb * a['m2']) / n)
+    m4 = (a['m4'] + b['m4']
+          + delta ** 4 * na * nb * (na * na - na * nb + nb * nb) / n ** 3
+          + 6 * delta ** 2 * (na * na * b['m2'] + nb * nb * a['m2']) / n ** 2
+          + 4 * delta * (na * b['m3'] - nb * a['m3']) / n)
+    return {'n': n, 'mean': a['mean'] + delta * nb / n, 'm2': m2, 'm3': m3,
+            'm4': m4, 'min': min(a['min'], b['min']),
+            'max': max(a['max'], b['max'])}
+
+
+def std(m):
+    return np.sqrt(m['m2'] / (m['n'] - 1)) if m['n'] > 1 else np.nan
+
+
+# Sample skewness with the adjustment of Series.skew()
+def skew(m):
+    n = m['n']
+    if n < 3 or m['m2'] == 0:
+        return np.nan
+    g1 = (m['m3'] / n) / (m['m2'] / n) ** 1.5
+    return np.sqrt(n * (n - 1)) / (n - 2) * g1
+
+
+# Excess kurtosis with the adjustment of Series.kurt()
+def kurt(m):
+    n = m['n']
+    if n < 4 or m['m2'] == 0:
+        return np.nan
+    g2 = (m['m4'] / n) / (m['m2'] / n) ** 2 - 3
+    return (n - 1) / ((n - 2) * (n - 3)) * ((n + 1) * g2 + 6)
+
+
+## Summary
+
+# Sketch of one partition of a numerical column: moments and quantiles
+def summary_sketch(values, k=200, seed=0):
+    return {'moments': moments(values),
+            'quantiles': update_quantiles(quantile_sketch(k, seed), values)}
+
+
+def merge_summaries(left, right):
+    return {'moments': merge_moments(left['moments'], right['moments']),
+            'quantiles': merge_quantiles(left['quantiles'],
+                                         right['quantiles'])}
+
+
+# describe() plus Skew and Kurtosis from a summary sketch, as a one-row frame
+def describe_sketch(summary, name=None):
+    m = summary['moments']
+    q25, q50, q75 = sketch_quantiles(summary['quantiles'], [.25, .5, .75])
+    row = pd.Series({'count': float(m['n']), 'mean': m['mean'],
+                     'std': std(m), 'min': m['min'], '25%': q25, '50%': q50,
+                     '75%': q75, 'max': m['max'], 'Skew': skew(m),
+                     'Kurtosis': kurt(m)}, name=name)
+    return pd.DataFrame(row).T
+
+
+# Summarize a column given as one array or as an iterable of chunks
+def sketch_describe(chunks, name=None, k=200):
+    if isinstance(chunks, (pd.Series, np.ndarray)):
+        chunks = [chunks]
+    summary = None
+    for chunk in chunks:
+        part = summary_sketch(chunk, k)
+        summary = part if summary is None else merge_summaries(summary, part)
+    return describe_sketch(summary, name)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Typed columnar storage for the cleaned data.
+
+The cleaned frames are written as uncompressed Feather (Arrow IPC) files, or
+Parquet, with text columns stored as dictionary-encoded categoricals and
+numbers downcast to the smallest width that holds them exactly. Feather files
+are memory-mapped on load and only the requested columns are read, so the
+downstream scripts no longer re-parse every number of a CSV. CSV stays
+available as an export format; the export is written with its dtype schema
+(see dtype_plan.py) so it is parsed straight into compact dtypes.
+
+Rows are appended with append_cleaned(): columnar files can't grow in place,
+so the rows go to numbered part files (Cleaned_train.part-00001.feather)
+that are read back with the main file, until the next full write replaces
+them all.
+
+Usage:
+    python storage.py Cleaned_train.csv Cleaned_test.csv
+converts existing CSVs to Feather and reports load time and memory of both.
+"""
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from dtype_plan import (load_schema, merge_schemas, read_planned,
+                        save_schema, schema_from_frame)
+
+FORMATS = ('feather', 'parquet', 'csv')
+
+
+# Downcast a numerical column to the smallest dtype that holds every value
+def downcast(series):
+    if pd.api.types.is_bool_dtype(series):
+        return series
+    if pd.api.types.is_integer_dtype(series):
+        return pd.to_numeric(series, downcast='integer')
+    if pd.api.types.is_float_dtype(series):
+        values = series.to_numpy()
+        small = values.astype(np.float32)
+        if np.array_equal(small.astype(values.dtype), values, equal_nan=True):
+            return series.astype(np.float32)
+    return series
+
+
+# Store text columns as categoricals and downcast the numerical ones
+def compact_frame(df):
+    out = {}
+    for col in df.columns:
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            out[col] = series
+        elif pd.api.types.is_numeric_dtype(series):
+            out[col] = downcast(series)
+        else:
+            out[col] = series.astype('category')
+    return pd.DataFrame(out, index=df.index)
+
+
+def _format(path):
+    ext = os.path.splitext(path)[1].lstrip('.').lower()
+    if ext not in FORMATS:
+        raise ValueError("Unknown format for %s, expected one of %s"
+                         % (path, ', '.join(FORMATS)))
+    return ext
+
+
+def _schema_path(csv_path):
+    return os.path.splitext(csv_path)[0] + '.schema.json'
+
+
+# Part files appended to a columnar file, in the order they were written
+def _part_paths(path):
+    root, ext = os.path.splitext(path)
+    return sorted(glob.glob(glob.escape(root) + '.part-*' + ext))
+
+
+# Write a cleaned frame; the format follows the file extension
+def write_cleaned(df, path):
+    fmt = _format(path)
+    if fmt == 'csv':
+        df.to_csv(path, index=False, header=True)
+        # The dtypes go next to the export so it is read back compact
+        save_schema(schema_from_frame(df), _schema_path(path))
+        return
+    # A full write replaces the rows appended since the last one
+    for part in _part_paths(path):
+        os.remove(part)
+    _write_columnar(df, path, fmt)
+
+
+def _write_columnar(df, path, fmt):
+    df = compact_frame(df).reset_index(drop=True)
+    if fmt == 'feather':
+        # Uncompressed so the file can be memory-mapped on load
+        df.to_feather(path, compression='uncompressed')
+    else:
+        df.to_parquet(path, index=False)
+
+
+# Append rows to a cleaned file: a new part file next to a columnar file, or
+# the end of a CSV export, whose schema is widened to hold the new rows
+def append_cleaned(df, path):
+    fmt = _format(path)
+    if fmt == 'csv':
+        header = list(pd.read_csv(path, nrows=0).columns)
+        df[header].to_csv(path, mode='a', index=False, header=False)
+        schema = schema_from_frame(df[header])
+        if os.path.exists(_schema_path(path)):
+            schema = merge_schemas(load_schema(_schema_path(path)), schema)
+        save_schema(schema, _schema_path(path))
+        return path
+    root, ext = os.path.splitext(path)
+    part = '%s.part-%05d%s' % (root, len(_part_paths(path)) + 1, ext)
+    _write_columnar(df, part, fmt)
+    return part
+
+
+# Read a cleaned file, optionally only some of its columns, together with
+# the part files appended to it
+def read_cleaned(path, columns=None):
+    fmt = _format(path)
+    parts = _part_paths(path) if fmt != 'csv' else []
+    if parts:
+        frames = [_read_one(p, fmt, columns) for p in [path] + parts]
+        # Categories may differ between parts; compact them again once joined
+        return compact_frame(pd.concat(frames, ignore_index=True))
+    return _read_one(path, fmt, columns)
+
+
+def _read_one(path, fmt, columns=None):
+    if fmt == 'feather':
+        from pyarrow import feather
+        table = feather.read_table(path, columns=columns, memory_map=True)
+        return table.to_pandas(split_blocks=True, self_destruct=True)
+    if fmt == 'parquet':
+        return pd.read_parquet(path, columns=columns)
+    if os.path.exists(_schema_path(path)):
+        return read_planned(path, load_schema(_schema_path(path)),
+                            usecols=columns)
+    return compact_frame(pd.read_csv(path, usecols=columns))
+
+
+# Load the cleaned data by name ("Cleaned_train"), preferring the columnar
+# files and falling back to the CSV export
+def load_cleaned(name, columns=None):
+    for fmt in FORMATS:
+        path = '%s.%s' % (name, fmt)
+        if os.path.exists(path):
+            return read_cleaned(path, columns)
+    raise FileNotFoundError("No cleaned file found for %s" % name)
+
+
+def _measure(load):
+    start = time.perf_counter()
+    df = load()
+    seconds = time.perf_counter() - start
+    return seconds, df.memory_usage(deep=True).sum()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description="Convert cleaned CSV files to a columnar format")
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--format', choices=FORMATS[:2], default='feather')
+    args = parser.parse_args()
+    for csv_path in args.files:
+        out_path = os.path.splitext(csv_path)[0] + '.' + args.format
+        write_cleaned(pd.read_csv(csv_path), out_path)
+        csv_time, csv_bytes = _measure(lambda: pd.read_csv(csv_path))
+        new_time, new_bytes = _measure(lambda: read_cleaned(out_path))
+        print("%s: load %.1f ms -> %.1f ms, memory %.0f KB -> %.0f KB"
+              % (csv_path, csv_time * 1000, new_time * 1000,
+                 csv_bytes / 1024, new_bytes / 1024))